@@ -0,0 +1,112 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals, absolute_import, print_function
+
+import argparse
+import re
+import subprocess
+import timeit
+
+from estuary_updater.handlers.distgit import DistGitHandler
+
+
+# Synthetic commit messages used when no Git repository is given
+SAMPLE_COMMIT_MESSAGES = (
+    'Layer: Fix memleaks\n\nResolves: rhbz1534646, rhbz1484051\nRelated: #1234567, rhbz#2345678\n',
+    'Rebase to the latest upstream release\n\n{0}Resolves: {1}\n'.format(
+        'Update the changelog\n' * 20,
+        ', '.join('rhbz#{0}'.format(1500000 + i) for i in range(50))),
+    'Reverted: bug635241\nResolves: rhbz1534646, rhbz1484051\n',
+    'Fix a typo in the spec file\n'
+)
+
+
+def legacy_parse_bugzilla_bugs(commit_message):
+    """
+    Parse the Bugzilla bugs of a commit message the way parse_bugzilla_bugs used to.
+
+    The regular expressions are compiled on every call and the duplicate bug IDs are kept.
+
+    :param str commit_message: the dist-git commit message
+    :return: a dictionary with the keys resolves, related, reverted with values as lists of
+        Bugzilla IDs
+    :rtype: dict
+    """
+    bugzilla_bug_pattern = re.compile(
+        r'^(?:(reverted|resolves|related)\: *(.+))', re.IGNORECASE | re.MULTILINE)
+    matches = re.findall(bugzilla_bug_pattern, commit_message)
+    bug_ids_pattern = re.compile(r'(?:(?:bug|bz|rhbz)\s*#?|#)\s*(\d+)', re.IGNORECASE)
+    bug_rel_mapping = {
+        'resolves': [],
+        'related': [],
+        'reverted': []
+    }
+    for match in matches:
+        rel_type = match[0].lower()
+        bug_rel_mapping[rel_type] += list(re.findall(bug_ids_pattern, match[1]))
+    return bug_rel_mapping
+
+
+def get_git_commit_messages(repo_path, max_count):
+    """
+    Get the commit messages of a Git repository, such as a clone of a dist-git repository.
+
+    :param str repo_path: the path of the Git repository
+    :param int max_count: the maximum number of commits
+    :return: the commit messages
+    :rtype: list
+    """
+    output = subprocess.check_output(
+        ['git', 'log', '--format=%B%x00', '--max-count={0}'.format(max_count)], cwd=repo_path)
+    return [message.strip('\n') for message in output.decode('utf-8', 'replace').split('\x00')
+            if message.strip()]
+
+
+def main(argv=None):
+    """
+    Compare the time it takes to parse commit messages with the current and the legacy parser.
+
+    :kwarg list argv: the command-line arguments, which default to sys.argv
+    """
+    parser = argparse.ArgumentParser(
+        description='Measure the time it takes to parse the Bugzilla bugs of commit messages')
+    parser.add_argument('--git-repo', help=(
+        'the path of a Git repository, such as a dist-git clone, whose commit messages are parsed '
+        'instead of the synthetic ones'))
+    parser.add_argument('--max-count', type=int, default=10000,
+                        help='the maximum number of commit messages to read from the repository')
+    parser.add_argument('--number', type=int, default=10,
+                        help='the number of times the commit messages are parsed')
+    args = parser.parse_args(argv)
+
+    if args.git_repo:
+        commit_messages = get_git_commit_messages(args.git_repo, args.max_count)
+    else:
+        # Every message is repeated once, like the message of a commit cherry-picked to a branch
+        commit_messages = [
+            '{0}\n\n(cherry picked from commit {1})\n'.format(
+                SAMPLE_COMMIT_MESSAGES[index // 2 % len(SAMPLE_COMMIT_MESSAGES)], index // 2)
+            for index in range(10000)
+        ]
+    references = sum(
+        len(bug_ids) for bug_rel_mapping in DistGitHandler.parse_bugzilla_bugs_batch(
+            commit_messages) for bug_ids in bug_rel_mapping.values())
+    print('{0} commit messages with {1} bug references'.format(
+        len(commit_messages), references))
+
+    timings = (
+        ('legacy', lambda: [legacy_parse_bugzilla_bugs(msg) for msg in commit_messages]),
+        ('precompiled',
+         lambda: [DistGitHandler.parse_bugzilla_bugs(msg) for msg in commit_messages]),
+        ('batch', lambda: DistGitHandler.parse_bugzilla_bugs_batch(commit_messages))
+    )
+    legacy_time = None
+    for name, func in timings:
+        elapsed = timeit.timeit(func, number=args.number) / args.number
+        legacy_time = legacy_time or elapsed
+        print('{0:<12} {1:>10.2f} ms {2:>8.1f}x'.format(
+            name, elapsed * 1000, legacy_time / elapsed))
+
+
+if __name__ == '__main__':
+    main()
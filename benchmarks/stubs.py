@@ -0,0 +1,238 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals, absolute_import
+
+import copy
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+from os import path
+import re
+from socketserver import ThreadingMixIn
+import threading
+from xmlrpc.server import SimpleXMLRPCRequestHandler, SimpleXMLRPCServer
+import zlib
+
+from tests import message_dir
+
+
+def _stable_id(value, modulo):
+    """
+    Turn a string into a number that is the same in every run so that results are comparable.
+
+    :param str value: the string
+    :param int modulo: the upper bound of the number
+    :return: the number
+    :rtype: int
+    """
+    return zlib.crc32(value.encode('utf-8')) % modulo
+
+
+def _load_fixture(*parts):
+    """
+    Load a JSON fixture from the tests/messages directory.
+
+    :param parts: the path components of the fixture relative to the messages directory
+    :return: the parsed fixture
+    """
+    with open(path.join(message_dir, *parts), 'r') as f:
+        return json.load(f)
+
+
+class KojiStub(object):
+    """Answer the Koji hub API calls made by the handlers with builds based on the fixtures."""
+
+    def __init__(self, components_per_module=3):
+        """
+        Initialize the stub.
+
+        :kwarg int components_per_module: the number of builds tagged in the tag of a module build
+        """
+        self.components_per_module = components_per_module
+        self.builds = {}
+        for name in ('build_complete', 'modulebuild_complete'):
+            info = _load_fixture('koji', name + '.json')['body']['msg']['info']
+            self.builds[info['id']] = info
+        self.template = self.builds[736244]
+
+    def _dispatch(self, method, params):
+        """
+        Call the stub method of a Koji API method.
+
+        :param str method: the name of the Koji API method
+        :param tuple params: the XML-RPC parameters, which may end with Koji's encoded kwargs
+        :return: the result of the call
+        """
+        args = list(params)
+        kwargs = {}
+        if args and isinstance(args[-1], dict) and args[-1].get('__starstar'):
+            kwargs = args.pop()
+            del kwargs['__starstar']
+        return getattr(self, method)(*args, **kwargs)
+
+    def multiCall(self, calls, strict=False):
+        """
+        Run several calls like Koji's multicall does.
+
+        :param list calls: the calls as dictionaries with the methodName and params keys
+        :kwarg bool strict: ignored since the stub calls don't fail
+        :return: a list with the result of each call wrapped in a list
+        :rtype: list
+        """
+        return [[self._dispatch(call['methodName'], call['params'])] for call in calls]
+
+    def getBuild(self, build_info, strict=False):
+        """
+        Get a build by its ID or NVR, making one up from the template if it's unknown.
+
+        :param build_info: the ID or NVR of the build
+        :kwarg bool strict: ignored since every build exists
+        :return: the build
+        :rtype: dict
+        """
+        if build_info in self.builds:
+            return self.builds[build_info]
+        build = copy.deepcopy(self.template)
+        if isinstance(build_info, int):
+            build['id'] = build['build_id'] = build_info
+            build['release'] = '{0}.{1}'.format(build['release'], build_info)
+        else:
+            build['name'], build['version'], build['release'] = build_info.rsplit('-', 2)
+            build['package_name'] = build['name']
+            build['id'] = build['build_id'] = _stable_id(build_info, 10 ** 9)
+        build['nvr'] = '{0}-{1}-{2}'.format(build['name'], build['version'], build['release'])
+        build['state'] = 1
+        build['completion_time'] = build['start_time']
+        return build
+
+    def getTag(self, tag_info, **kwargs):
+        """
+        Get a tag by its name.
+
+        :param str tag_info: the name of the tag
+        :return: the tag
+        :rtype: dict
+        """
+        return {'id': _stable_id(tag_info, 10 ** 6), 'name': tag_info}
+
+    def getTaskResult(self, task_id, **kwargs):
+        """
+        Get the result of a container build task.
+
+        :param int task_id: the ID of the task
+        :return: the task result with the ID of the build the task created
+        :rtype: dict
+        """
+        return {'koji_builds': [str(task_id + 10 ** 8)]}
+
+    def listTaggedRPMS(self, tag, **kwargs):
+        """
+        List the RPMs and builds in a tag.
+
+        :param str tag: the name of the tag
+        :return: no RPMs and the IDs of the builds in the tag
+        :rtype: tuple
+        """
+        first_id = _stable_id(tag, 10 ** 8) + 2 * 10 ** 8
+        builds = [
+            {'id': first_id + i, 'package_name': 'component{0}'.format(i)}
+            for i in range(self.components_per_module)
+        ]
+        return [], builds
+
+
+class ErrataRequestHandler(BaseHTTPRequestHandler):
+    """Answer the Errata Tool API requests made by the handlers with the fixtures."""
+
+    erratum = _load_fixture('errata', 'api_errata.json')
+    product = _load_fixture('errata', 'api_product_info.json')
+    users = {
+        user['id']: user for user in (
+            _load_fixture('errata', 'api_reporter_info.json'),
+            _load_fixture('errata', 'api_assigned_to_info.json'))
+    }
+
+    def do_GET(self):
+        """Respond with the JSON of the requested advisory, product or user."""
+        user_match = re.match(r'^/api/v1/user/(\d+)$', self.path)
+        if self.path.startswith('/api/v1/erratum/'):
+            body = self.erratum
+        elif re.match(r'^/products/\d+\.json$', self.path):
+            body = self.product
+        elif user_match:
+            user_id = int(user_match.group(1))
+            body = self.users.get(user_id)
+            if body is None:
+                body = dict(self.users[3001095], id=user_id,
+                            login_name='user{0}@redhat.com'.format(user_id))
+        else:
+            self.send_error(404)
+            return
+
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        """Don't log every request."""
+        pass
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    """An HTTP server that handles every request in its own thread."""
+
+    daemon_threads = True
+
+
+class KojiRequestHandler(SimpleXMLRPCRequestHandler):
+    """Serve XML-RPC requests on the same path as a Koji hub."""
+
+    rpc_paths = ('/kojihub',)
+
+
+class ThreadingXMLRPCServer(ThreadingMixIn, SimpleXMLRPCServer):
+    """An XML-RPC server that handles every request in its own thread."""
+
+    daemon_threads = True
+
+
+def _serve(server):
+    """
+    Run a server in a daemon thread.
+
+    :param server: the server to run
+    :return: the server
+    """
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def start_koji_stub(components_per_module=3):
+    """
+    Start the Koji hub stub on a random local port.
+
+    :kwarg int components_per_module: the number of builds tagged in the tag of a module build
+    :return: the server and the URL of the hub
+    :rtype: tuple
+    """
+    server = ThreadingXMLRPCServer(
+        ('127.0.0.1', 0), KojiRequestHandler, allow_none=True, logRequests=False)
+    server.register_instance(KojiStub(components_per_module))
+    _serve(server)
+    return server, 'http://127.0.0.1:{0}/kojihub'.format(server.server_address[1])
+
+
+def start_errata_stub():
+    """
+    Start the Errata Tool stub on a random local port.
+
+    :return: the server and the URL of the Errata Tool
+    :rtype: tuple
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), ErrataRequestHandler)
+    _serve(server)
+    return server, 'http://127.0.0.1:{0}/'.format(server.server_address[1])
@@ -0,0 +1,52 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals, absolute_import, print_function
+
+import argparse
+from datetime import datetime
+import timeit
+
+from estuary_updater.timestamps import parse_timestamp, parse_timestamps
+
+
+# A timestamp of each format with the strptime format the handlers used to parse it with
+TIMESTAMPS = (
+    ('koji', '2018-08-03 17:49:42.735506', '%Y-%m-%d %H:%M:%S.%f'),
+    ('koji_no_microseconds', '2018-06-15 20:26:38', '%Y-%m-%d %H:%M:%S'),
+    ('iso', '2018-06-14T23:50:37Z', '%Y-%m-%dT%H:%M:%SZ'),
+    ('errata_utc', '2018-07-03 13:34:14 UTC', '%Y-%m-%d %H:%M:%S UTC')
+)
+
+
+def main(argv=None):
+    """
+    Compare the time it takes to parse timestamps with parse_timestamp and with strptime.
+
+    :kwarg list argv: the command-line arguments, which default to sys.argv
+    """
+    parser = argparse.ArgumentParser(
+        description='Measure the time it takes to parse the timestamps of each format')
+    parser.add_argument('--number', type=int, default=100000,
+                        help='the number of times each timestamp is parsed')
+    args = parser.parse_args(argv)
+
+    print('{0:<24} {1:>14} {2:>14} {3:>9}'.format(
+        'format', 'strptime us', 'parser us', 'speedup'))
+    for name, timestamp, ts_format in TIMESTAMPS:
+        assert parse_timestamp(timestamp) == datetime.strptime(timestamp, ts_format)
+        strptime_time = timeit.timeit(
+            lambda: datetime.strptime(timestamp, ts_format), number=args.number)
+        parser_time = timeit.timeit(lambda: parse_timestamp(timestamp), number=args.number)
+        print('{0:<24} {1:>14.3f} {2:>14.3f} {3:>8.1f}x'.format(
+            name, strptime_time * 10 ** 6 / args.number, parser_time * 10 ** 6 / args.number,
+            strptime_time / parser_time))
+
+    # A replay parses the same creation and completion times of a build many times
+    batch = [timestamp for _, timestamp, _ in TIMESTAMPS] * 100
+    batch_time = timeit.timeit(lambda: parse_timestamps(batch), number=max(args.number // 400, 1))
+    print('{0:<24} {1:>14} {2:>14.3f}'.format(
+        'batch', '', batch_time * 10 ** 6 / (max(args.number // 400, 1) * len(batch))))
+
+
+if __name__ == '__main__':
+    main()
@@ -2,6 +2,7 @@
 
 from __future__ import unicode_literals, absolute_import
 
+import abc
 import logging
 import pkg_resources
 
@@ -21,3 +22,7 @@ try:
     version = pkg_resources.get_distribution('estuary').version
 except pkg_resources.DistributionNotFound:
     version = 'unknown'
+
+# The base class of abstract classes. Setting __metaclass__ only has an effect on Python 2, so the
+# abstract methods of a class based on this are enforced on Python 3 as well.
+ABC = abc.ABCMeta(str('ABC'), (object,), {})
@@ -0,0 +1,233 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals, absolute_import
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, wait
+import threading
+
+import fedmsg.consumers
+import moksha.hub
+
+from estuary_updater import config, log, version
+from estuary_updater.dispatcher import Dispatcher
+from estuary_updater.metrics import Gauge
+
+
+class AsyncPipeline(object):
+    """
+    Process messages concurrently on an asyncio event loop running in its own thread.
+
+    Handler methods that are coroutine functions are awaited on the event loop. All the other
+    handler methods are run on a thread pool so that the blocking Koji, Errata Tool and Neo4j
+    clients don't block the event loop. Messages with the same ordering key are processed in the
+    order they were submitted.
+    """
+
+    def __init__(self, dispatcher, concurrency):
+        """
+        Initialize the pipeline.
+
+        :param Dispatcher dispatcher: the dispatcher that finds the handler method of a message
+        :param int concurrency: the maximum number of messages that are in flight at once
+        """
+        self.dispatcher = dispatcher
+        self.loop = asyncio.new_event_loop()
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        self._in_flight = threading.BoundedSemaphore(concurrency)
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+        # The ordering keys mapped to the lock and the number of messages using that lock
+        self._key_locks = {}
+        self._thread = None
+
+    def start(self):
+        """Start running the event loop in a background thread."""
+        self._thread = threading.Thread(
+            target=self.loop.run_forever, name='estuary-updater-event-loop')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, msg):
+        """
+        Schedule a message to be processed on the event loop.
+
+        This blocks while the maximum number of messages are in flight.
+
+        :param dict msg: a received message from the message bus
+        :return: a future that is done once the message is processed
+        :rtype: concurrent.futures.Future
+        """
+        self._in_flight.acquire()
+        future = asyncio.run_coroutine_threadsafe(self.process(msg), self.loop)
+        with self._pending_lock:
+            self._pending.add(future)
+        future.add_done_callback(self._message_done)
+        return future
+
+    def in_flight(self):
+        """
+        Get the number of messages that were submitted but aren't processed yet.
+
+        :return: the number of messages
+        :rtype: int
+        """
+        with self._pending_lock:
+            return len(self._pending)
+
+    def _message_done(self, future):
+        """
+        Release the in-flight slot of a processed message.
+
+        :param concurrent.futures.Future future: the future of the processed message
+        """
+        with self._pending_lock:
+            self._pending.discard(future)
+        self._in_flight.release()
+
+    async def process(self, msg):
+        """
+        Process a message after the previous messages with the same ordering key.
+
+        Any failure is logged instead of raised.
+
+        :param dict msg: a received message from the message bus
+        """
+        try:
+            key = self.dispatcher.get_ordering_key(msg)
+        except Exception:
+            log.exception('Failed to get the ordering key of the message: {0}'.format(
+                msg['headers']['message-id']))
+            return
+
+        if key is None:
+            await self._dispatch_logged(msg)
+            return
+
+        # asyncio locks are acquired in the order they are waited on, which keeps the order
+        if key not in self._key_locks:
+            self._key_locks[key] = [asyncio.Lock(), 0]
+        key_lock = self._key_locks[key]
+        key_lock[1] += 1
+        try:
+            async with key_lock[0]:
+                await self._dispatch_logged(msg)
+        finally:
+            key_lock[1] -= 1
+            if not key_lock[1]:
+                del self._key_locks[key]
+
+    async def _dispatch_logged(self, msg):
+        """
+        Process a message and log any failure.
+
+        :param dict msg: a received message from the message bus
+        """
+        try:
+            await self.dispatch(msg)
+        except Exception:
+            log.exception('Failed to process the message: {0}'.format(
+                msg['headers']['message-id']))
+
+    async def dispatch(self, msg):
+        """
+        Process a message with the handler method registered for its topic.
+
+        :param dict msg: a received message from the message bus
+        :return: a bool based on if a handler processed the message
+        :rtype: bool
+        """
+        handler_method = self.dispatcher.get_handler_method(msg)
+        if handler_method is None:
+            return False
+
+        if asyncio.iscoroutinefunction(handler_method):
+            await handler_method(msg)
+        else:
+            await self.loop.run_in_executor(self.executor, self.dispatcher.dispatch, msg)
+        return True
+
+    def stop(self):
+        """Wait for the messages in flight to be processed and stop the event loop."""
+        with self._pending_lock:
+            pending = list(self._pending)
+        wait(pending)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.loop.close()
+        self.executor.shutdown()
+
+
+class AsyncEstuaryUpdater(fedmsg.consumers.FedmsgConsumer):
+    """
+    A consumer that processes up to "estuary_updater.async_concurrency" messages concurrently.
+
+    It handles the same topics as ``estuary_updater.consumer.EstuaryUpdater``. It isn't registered
+    as a moksha consumer, so it only runs in place of that consumer with the
+    ``estuary-updater-async`` command.
+    """
+
+    topic = config.get('estuary_updater.topics', [])
+    config_key = 'estuary_updater.enabled'
+
+    def __init__(self, hub, *args, **kw):
+        """
+        Initialize the consumer.
+
+        :param moksha.hub.CentralMokshaHub hub: the hub the consumer is registered with
+        """
+        if not hub.config.get(self.config_key):
+            self.dispatcher = None
+            super(AsyncEstuaryUpdater, self).__init__(hub, *args, **kw)
+            return
+
+        log.info('Starting up the asyncio Estuary Updater v{0}'.format(version))
+        self.dispatcher = Dispatcher(config)
+        self.dispatcher.startup()
+        self.pipeline = AsyncPipeline(
+            self.dispatcher, config.get('estuary_updater.async_concurrency', 16))
+        self.pipeline.start()
+        if self.dispatcher.metrics is not None:
+            self.dispatcher.metrics.registry.add_collector(self.collect_metrics)
+        super(AsyncEstuaryUpdater, self).__init__(hub, *args, **kw)
+
+    def collect_metrics(self):
+        """
+        Get the number of messages in flight as a metric.
+
+        :return: the metrics
+        :rtype: list
+        """
+        queue_depth = Gauge(
+            'estuary_updater_queue_depth', 'The number of messages waiting to be processed',
+            ('queue',))
+        queue_depth.set(self.pipeline.in_flight(), queue='in_flight')
+        return [queue_depth]
+
+    def consume(self, msg):
+        """
+        Schedule a message from the message bus to be processed.
+
+        :param dict msg: a received message from the message bus
+        """
+        self.pipeline.submit(msg)
+
+    def stop(self):
+        """Wait for the messages in flight and shut down the handlers."""
+        if self.dispatcher is not None:
+            log.info('Shutting down the asyncio Estuary Updater')
+            self.pipeline.stop()
+            self.dispatcher.shutdown()
+        super(AsyncEstuaryUpdater, self).stop()
+
+
+def main():
+    """Run a fedmsg hub with the asyncio consumer as its only consumer."""
+    options = dict(config)
+    # Like fedmsg-hub, subscribe to the fedmsg endpoints when ZeroMQ is used instead of STOMP
+    if options.get('zmq_enabled', True):
+        options['zmq_subscribe_endpoints'] = ','.join(
+            ','.join(endpoints) for endpoints in options.get('endpoints', {}).values())
+    moksha.hub.main(options=options, consumers=[AsyncEstuaryUpdater], framework=False)
@@ -0,0 +1,375 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals, absolute_import
+
+from collections import OrderedDict
+from contextlib import contextmanager
+import json
+import os
+import threading
+import time
+
+
+class TTLCache(object):
+    """A thread-safe least recently used cache whose entries expire after a time-to-live."""
+
+    def __init__(self, max_size, ttl):
+        """
+        Initialize the cache.
+
+        :param int max_size: the maximum number of entries before the least recently used entries
+            are evicted
+        :param float ttl: the number of seconds an entry is valid for
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """Return the number of entries in the cache, including the expired ones."""
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """
+        Get a value from the cache.
+
+        :param key: the key of the entry
+        :param default: the value to return if the key isn't cached or has expired
+        :return: the cached value or the default
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[0] <= time.time():
+                self.misses += 1
+                return default
+            # Reinsert the entry to mark it as the most recently used
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        """
+        Add or replace a value in the cache.
+
+        :param key: the key of the entry
+        :param value: the value to cache
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time() + self.ttl, value)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, *keys):
+        """
+        Remove entries from the cache.
+
+        :param keys: the keys of the entries to remove
+        """
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        """Remove all the entries from the cache."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Get the statistics of the cache.
+
+        :return: the hits, misses, evictions, size and hit ratio of the cache
+        :rtype: dict
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+                'hit_ratio': float(self.hits) / lookups if lookups else 0.0
+            }
+
+    def save(self, path):
+        """
+        Save the entries that haven't expired to a JSON file.
+
+        The keys and values of the cache must be serializable to JSON.
+
+        :param str path: the path of the file
+        """
+        now = time.time()
+        with self._lock:
+            entries = [
+                [key, expires, value] for key, (expires, value) in self._entries.items()
+                if expires > now
+            ]
+        # Write to a temporary file first so that a crash doesn't leave a truncated file behind
+        tmp_path = '{0}.tmp'.format(path)
+        with open(tmp_path, 'w') as f:
+            json.dump(entries, f)
+        os.rename(tmp_path, path)
+
+    def load(self, path):
+        """
+        Add the entries that haven't expired from a JSON file created by the save method.
+
+        :param str path: the path of the file
+        :return: the number of entries that were loaded
+        :rtype: int
+        """
+        with open(path, 'r') as f:
+            entries = json.load(f)
+        now = time.time()
+        loaded = 0
+        with self._lock:
+            for key, expires, value in entries:
+                if expires > now and key not in self._entries:
+                    self._entries[key] = (expires, value)
+                    loaded += 1
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return loaded
+
+
+class NodeCache(object):
+    """
+    A cache of Neo4j nodes keyed by their unique properties.
+
+    The properties last written to a node are also remembered so that upserting a node with the
+    same properties again can skip the write to Neo4j and reuse the cached node instead.
+
+    The cache is shared by all the threads, so the nodes written inside a Neo4j transaction are
+    staged per thread with the deferred method and are only visible to the other threads once the
+    transaction is committed.
+    """
+
+    def __init__(self, max_size, ttl):
+        """
+        Initialize the cache.
+
+        :param int max_size: the maximum number of nodes to cache
+        :param float ttl: the number of seconds a node is cached for
+        """
+        self.skipped_writes = 0
+        self._stats_lock = threading.Lock()
+        self._cache = TTLCache(max_size, ttl)
+        self._local = threading.local()
+
+    @contextmanager
+    def deferred(self):
+        """
+        Stage the nodes cached by the current thread until the block finishes without an error.
+
+        This is used around a Neo4j transaction so that the nodes of a transaction that is rolled
+        back, which don't exist in Neo4j, are never used by the other threads.
+
+        :return: a context manager
+        """
+        staged = self._local.staged = OrderedDict()
+        try:
+            yield
+            for key, value in staged.items():
+                self._cache.set(key, value)
+        finally:
+            self._local.staged = None
+
+    def _get_entry(self, key):
+        """
+        Get an entry staged by the current thread or from the shared cache.
+
+        :param tuple key: the key of the entry
+        :return: the entry or None
+        """
+        staged = getattr(self._local, 'staged', None)
+        if staged and key in staged:
+            return staged[key]
+        return self._cache.get(key)
+
+    def _set_entry(self, key, value):
+        """
+        Stage an entry if the current thread is in a transaction or else add it to the shared cache.
+
+        :param tuple key: the key of the entry
+        :param value: the entry
+        """
+        staged = getattr(self._local, 'staged', None)
+        if staged is None:
+            self._cache.set(key, value)
+        else:
+            staged.pop(key, None)
+            staged[key] = value
+
+    def _invalidate_entries(self, keys):
+        """
+        Remove entries from the shared cache and from the entries staged by the current thread.
+
+        :param list keys: the keys of the entries
+        """
+        staged = getattr(self._local, 'staged', None)
+        if staged:
+            for key in keys:
+                staged.pop(key, None)
+        self._cache.invalidate(*keys)
+
+    @staticmethod
+    def _get_key(model, properties):
+        """
+        Get the cache key of a node.
+
+        :param type model: the neomodel class of the node
+        :param dict properties: the properties of the node
+        :return: the name of the class followed by the values of its unique properties
+        :rtype: tuple
+        """
+        return (model.__name__,) + tuple(
+            properties.get(name) for name in model.__required_properties__)
+
+    @staticmethod
+    def _get_fingerprint(properties):
+        """
+        Get a hash of the properties of a node.
+
+        :param dict properties: the properties of the node
+        :return: the hash
+        :rtype: int
+        """
+        return hash(repr(sorted(properties.items())))
+
+    def get(self, model, properties, update_existing=True):
+        """
+        Get a cached node.
+
+        :param type model: the neomodel class of the node
+        :param dict properties: the properties of the node
+        :kwarg bool update_existing: when true, the node is only returned if it was last written
+            with the same properties, like create_or_update requires. Otherwise, any cached node
+            with the same unique properties is returned, like get_or_create requires.
+        :return: the cached node or None
+        :rtype: neomodel.StructuredNode or None
+        """
+        cached = self._get_entry(self._get_key(model, properties))
+        if cached is None:
+            return None
+        fingerprint, node = cached
+        if update_existing and fingerprint != self._get_fingerprint(properties):
+            return None
+        with self._stats_lock:
+            self.skipped_writes += 1
+        return node
+
+    def set(self, model, properties, node, update_existing=True):
+        """
+        Cache a node that was just written to Neo4j.
+
+        :param type model: the neomodel class of the node
+        :param dict properties: the properties of the node that were written
+        :param neomodel.StructuredNode node: the node
+        :kwarg bool update_existing: whether the properties were set on the node even if it already
+            existed, which is not the case with get_or_create
+        """
+        if update_existing:
+            fingerprint = self._get_fingerprint(properties)
+        else:
+            # The node may have had different properties already, so they are unknown
+            fingerprint = None
+        self._set_entry(self._get_key(model, properties), (fingerprint, node))
+
+    def create_or_update(self, model, properties):
+        """
+        Call create_or_update on the neomodel class unless the properties were already written.
+
+        :param type model: the neomodel class of the node
+        :param dict properties: the properties of the node
+        :return: the node
+        :rtype: neomodel.StructuredNode
+        """
+        node = self.get(model, properties)
+        if node is None:
+            node = model.create_or_update(properties)[0]
+            self.set(model, properties, node)
+        return node
+
+    def get_or_create(self, model, properties):
+        """
+        Call get_or_create on the neomodel class unless the node is cached.
+
+        :param type model: the neomodel class of the node
+        :param dict properties: the properties of the node
+        :return: the node
+        :rtype: neomodel.StructuredNode
+        """
+        node = self.get(model, properties, update_existing=False)
+        if node is None:
+            node = model.get_or_create(properties)[0]
+            self.set(model, properties, node, update_existing=False)
+        return node
+
+    def get_fingerprinted(self, key, fingerprint):
+        """
+        Get a value cached with set_fingerprinted, such as a node and the input it was written from.
+
+        :param tuple key: the key of the value
+        :param fingerprint: the hashable fingerprint of the input that would be written now
+        :return: a tuple of a bool based on if the value was cached with the same fingerprint, in
+            which case the write can be skipped, and the cached value or None
+        :rtype: tuple
+        """
+        cached = self._get_entry(('fingerprinted',) + key)
+        if cached is None:
+            return False, None
+        if cached[0] == fingerprint:
+            with self._stats_lock:
+                self.skipped_writes += 1
+            return True, cached[1]
+        return False, cached[1]
+
+    def set_fingerprinted(self, key, fingerprint, value):
+        """
+        Cache a value along with the fingerprint of the input that was just written to Neo4j.
+
+        :param tuple key: the key of the value
+        :param fingerprint: the hashable fingerprint of the input
+        :param value: the value to cache
+        """
+        self._set_entry(('fingerprinted',) + key, (fingerprint, value))
+
+    def invalidate_fingerprinted(self, *keys):
+        """
+        Remove values cached with set_fingerprinted.
+
+        :param keys: the keys of the values to remove
+        """
+        self._invalidate_entries([('fingerprinted',) + key for key in keys])
+
+    def invalidate(self, model, properties):
+        """
+        Remove a node from the cache.
+
+        :param type model: the neomodel class of the node
+        :param dict properties: the properties of the node with at least its unique properties
+        """
+        self._invalidate_entries([self._get_key(model, properties)])
+
+    def clear(self):
+        """Remove all the nodes from the cache."""
+        self._cache.clear()
+
+    def stats(self):
+        """
+        Get the statistics of the cache.
+
+        :return: the statistics of the underlying TTLCache and the number of skipped writes
+        :rtype: dict
+        """
+        stats = self._cache.stats()
+        with self._stats_lock:
+            stats['skipped_writes'] = self.skipped_writes
+        return stats
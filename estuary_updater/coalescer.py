@@ -0,0 +1,108 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals, absolute_import
+
+from collections import OrderedDict
+import itertools
+import threading
+
+from estuary_updater import log
+
+
+def coalesce_messages(msgs, get_key):
+    """
+    Only keep the newest message about each entity, in the position of the first message about it.
+
+    :param list msgs: the messages in the order they were received
+    :param callable get_key: the function that returns the coalesce key of a message or None
+    :return: the kept messages and the number of discarded messages
+    :rtype: tuple
+    """
+    kept = OrderedDict()
+    for index, msg in enumerate(msgs):
+        key = get_key(msg)
+        if key is None:
+            key = ('unkeyed', index)
+        kept[key] = msg
+    return list(kept.values()), len(msgs) - len(kept)
+
+
+class Coalescer(object):
+    """
+    Buffer messages for a short window and only keep the newest message about each entity.
+
+    A newer message about an entity replaces the buffered one but keeps its position, so the
+    entity is still processed before the messages that were received after it first appeared.
+    Messages without a coalesce key are never discarded.
+    """
+
+    def __init__(self, get_key, process, window, max_size):
+        """
+        Initialize the coalescer.
+
+        :param callable get_key: the function that returns the coalesce key of a message or None
+        :param callable process: the function called with each message that is kept
+        :param int window: the maximum number of milliseconds a message is buffered for
+        :param int max_size: the number of buffered messages that causes an immediate flush
+        """
+        self.get_key = get_key
+        self.process = process
+        self.window = window
+        self.max_size = max_size
+        self.discarded = 0
+        self._pending = OrderedDict()
+        self._unkeyed_counter = itertools.count()
+        self._lock = threading.Lock()
+        # Only one flush runs at a time so that the messages are processed in order
+        self._flush_lock = threading.Lock()
+        self._timer = None
+
+    def add(self, msg):
+        """
+        Buffer a message, replacing the buffered message about the same entity.
+
+        :param dict msg: a received message from the message bus
+        """
+        key = self.get_key(msg)
+        with self._lock:
+            if key is None:
+                key = ('unkeyed', next(self._unkeyed_counter))
+            elif key in self._pending:
+                self.discarded += 1
+                log.debug('Discarding the superseded message: {0}'.format(
+                    self._pending[key]['headers']['message-id']))
+            # Assigning an existing key of an OrderedDict keeps its position
+            self._pending[key] = msg
+            full = len(self._pending) >= self.max_size
+            if not full and self._timer is None:
+                self._timer = threading.Timer(self.window / 1000.0, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+        if full:
+            self.flush()
+
+    def flush(self):
+        """Process all the buffered messages in the order their entities were first received."""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, OrderedDict()
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+            for msg in pending.values():
+                try:
+                    self.process(msg)
+                except Exception:
+                    log.exception('Failed to process the message: {0}'.format(
+                        msg['headers']['message-id']))
+
+    def stats(self):
+        """
+        Get the statistics of the coalescer.
+
+        :return: the number of discarded and buffered messages
+        :rtype: dict
+        """
+        with self._lock:
+            return {'discarded': self.discarded, 'pending': len(self._pending)}
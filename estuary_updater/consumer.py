@@ -2,10 +2,15 @@
 
 from __future__ import unicode_literals, absolute_import
 
+import threading
+
 import fedmsg.consumers
 
 from estuary_updater import config, log, version
-from estuary_updater.handlers import all_handlers
+from estuary_updater.coalescer import Coalescer
+from estuary_updater.dispatcher import Dispatcher
+from estuary_updater.metrics import Counter, Gauge
+from estuary_updater.workers import KeyedWorkerPool
 
 
 class EstuaryUpdater(fedmsg.consumers.FedmsgConsumer):
@@ -14,10 +19,54 @@ class EstuaryUpdater(fedmsg.consumers.FedmsgConsumer):
     topic = config.get('estuary_updater.topics', [])
     config_key = 'estuary_updater.enabled'
 
-    def __init__(self, *args, **kw):
-        """Initialize the consumer."""
+    def __init__(self, hub, *args, **kw):
+        """
+        Initialize the consumer.
+
+        moksha creates every registered consumer, so nothing is started when the consumer is
+        disabled.
+
+        :param moksha.hub.CentralMokshaHub hub: the hub the consumer is registered with
+        """
+        if not hub.config.get(self.config_key):
+            self.dispatcher = None
+            super(EstuaryUpdater, self).__init__(hub, *args, **kw)
+            return
+
         log.info('Starting up Estuary Updater v{0}'.format(version))
-        super(EstuaryUpdater, self).__init__(*args, **kw)
+        # The handlers are created once so that their sessions are reused across messages
+        self.dispatcher = Dispatcher(config)
+        self.dispatcher.startup()
+        # When the batch size is greater than one, messages are buffered and applied in a single
+        # Neo4j transaction once the batch is full or the batch timeout (in milliseconds) expires
+        self.batch_size = config.get('estuary_updater.batch_size', 1)
+        self.batch_timeout = config.get('estuary_updater.batch_timeout', 500)
+        self._batch = []
+        self._batch_lock = threading.Lock()
+        # Only one batch is processed at a time so that messages are applied in the order they
+        # were received
+        self._flush_lock = threading.Lock()
+        self._batch_timer = None
+        # When there is more than one worker, messages are processed in parallel, but the messages
+        # about the same build, advisory or dist-git branch are still processed in order
+        self.workers = config.get('estuary_updater.workers', 1)
+        self.worker_pool = None
+        if self.workers > 1:
+            self.worker_pool = KeyedWorkerPool(
+                self.dispatcher.dispatch_messages, self.workers,
+                config.get('estuary_updater.worker_queue_size', 100), self.batch_size)
+            self.worker_pool.start()
+        # When the coalesce window (in milliseconds) is set, only the newest state message of a
+        # Koji build or Freshmaker event or build received within the window is processed
+        self.coalescer = None
+        coalesce_window = config.get('estuary_updater.coalesce_window', 0)
+        if coalesce_window > 0:
+            self.coalescer = Coalescer(
+                self.dispatcher.get_coalesce_key, self.process, coalesce_window,
+                config.get('estuary_updater.coalesce_max_size', 1000))
+        if self.dispatcher.metrics is not None:
+            self.dispatcher.metrics.registry.add_collector(self.collect_metrics)
+        super(EstuaryUpdater, self).__init__(hub, *args, **kw)
 
     def consume(self, msg):
         """
@@ -25,14 +74,87 @@ class EstuaryUpdater(fedmsg.consumers.FedmsgConsumer):
 
         :param dict msg: a received message from the message bus
         """
-        # Try to find a handler that can handle this type of message
-        for handler_cls in all_handlers:
-            if handler_cls.can_handle(msg):
-                log.debug('The handler {0} supports handling the message: {1}'.format(
-                    handler_cls.__name__, msg['headers']['message-id']))
-                handler = handler_cls(config)
-                log.debug('The handler {0} is instantiated and will handle the message: {1}'.format(
-                    handler_cls.__name__, msg['headers']['message-id']))
-                handler.handle(msg)
-                log.debug('The handler {0} is done handling the message: {1}'.format(
-                    handler_cls.__name__, msg['headers']['message-id']))
+        if self.coalescer is not None:
+            self.coalescer.add(msg)
+        else:
+            self.process(msg)
+
+    def process(self, msg):
+        """
+        Process a message on a worker, as part of a batch or right away based on the configuration.
+
+        :param dict msg: a received message from the message bus
+        """
+        if self.worker_pool is not None:
+            # This blocks while the worker's queue is full so that the backlog stays bounded
+            self.worker_pool.submit(self.dispatcher.get_ordering_key(msg), msg)
+            return
+
+        if self.batch_size <= 1:
+            self.dispatcher.dispatch(msg)
+            return
+
+        with self._batch_lock:
+            self._batch.append(msg)
+            batch_full = len(self._batch) >= self.batch_size
+            if not batch_full and self._batch_timer is None:
+                self._batch_timer = threading.Timer(self.batch_timeout / 1000.0, self.flush_batch)
+                self._batch_timer.daemon = True
+                self._batch_timer.start()
+
+        if batch_full:
+            self.flush_batch()
+
+    def flush_batch(self):
+        """Process all the buffered messages in a single Neo4j transaction."""
+        with self._flush_lock:
+            with self._batch_lock:
+                batch, self._batch = self._batch, []
+                if self._batch_timer is not None:
+                    self._batch_timer.cancel()
+                    self._batch_timer = None
+            if batch:
+                log.debug('Processing a batch of {0} messages'.format(len(batch)))
+                self.dispatcher.dispatch_batch(batch)
+
+    def collect_metrics(self):
+        """
+        Get the number of messages waiting to be processed and discarded by coalescing as metrics.
+
+        :return: the metrics
+        :rtype: list
+        """
+        queue_depth = Gauge(
+            'estuary_updater_queue_depth', 'The number of messages waiting to be processed',
+            ('queue',))
+        queue_depth.set(len(self._batch), queue='batch')
+        metrics = [queue_depth]
+        if self.worker_pool is not None:
+            queue_depth.set(self.worker_pool.qsize(), queue='workers')
+        if self.coalescer is not None:
+            stats = self.coalescer.stats()
+            queue_depth.set(stats['pending'], queue='coalescer')
+            discarded = Counter(
+                'estuary_updater_coalesced_messages_total',
+                'The number of superseded messages that were discarded')
+            discarded.inc(stats['discarded'])
+            metrics.append(discarded)
+        return metrics
+
+    def drain(self):
+        """Wait until all the buffered and queued messages are processed."""
+        if self.coalescer is not None:
+            self.coalescer.flush()
+        if self.worker_pool is not None:
+            self.worker_pool.join()
+        self.flush_batch()
+
+    def stop(self):
+        """Process the remaining buffered messages and shut down the handlers."""
+        if self.dispatcher is not None:
+            log.info('Shutting down Estuary Updater')
+            self.drain()
+            if self.worker_pool is not None:
+                self.worker_pool.stop()
+            self.dispatcher.shutdown()
+        super(EstuaryUpdater, self).stop()
@@ -0,0 +1,155 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals, absolute_import
+
+from neomodel.match import OUTGOING, INCOMING
+
+
+def get_merge_params(model, properties):
+    """
+    Deflate the properties of a node the same way neomodel's get_or_create and create_or_update do.
+
+    :param type model: the neomodel class of the node
+    :param dict properties: the properties of the node keyed by their Python names
+    :return: a dictionary with the key "create" containing all the deflated properties and the key
+        "update" containing only the deflated properties that were specified
+    :rtype: dict
+    """
+    deflated = model.deflate(properties, skip_empty=True)
+    update = {}
+    for name in properties:
+        db_property = getattr(model, name).db_property or name
+        if db_property in deflated:
+            update[db_property] = deflated[db_property]
+    return {'create': deflated, 'update': update}
+
+
+def merge_node_clause(model, variable, params, update_existing=False):
+    """
+    Build a MERGE clause that upserts a node like neomodel's get_or_create or create_or_update.
+
+    :param type model: the neomodel class of the node
+    :param str variable: the Cypher variable to bind the node to
+    :param str params: the Cypher expression of the parameters returned by get_merge_params
+    :kwarg bool update_existing: when true, the specified properties are also set on an existing
+        node like create_or_update does
+    :return: the Cypher clause
+    :rtype: str
+    """
+    merge_keys = ', '.join(
+        '{0}: {1}.create.{0}'.format(getattr(model, name).db_property or name, params)
+        for name in model.__required_properties__
+    )
+    clause = 'MERGE ({0}:{1} {{{2}}})\nON CREATE SET {0} = {3}.create\n'.format(
+        variable, ':'.join(model.inherited_labels()), merge_keys, params)
+    if update_existing:
+        clause += 'ON MATCH SET {0} += {1}.update\n'.format(variable, params)
+    return clause
+
+
+def relationship_pattern(model, rel_name, source, target, rel_variable=''):
+    """
+    Build the Cypher pattern of a relationship defined on a neomodel class.
+
+    :param type model: the neomodel class that defines the relationship
+    :param str rel_name: the name of the relationship attribute on the neomodel class
+    :param str source: the Cypher variable of the node the relationship is accessed from
+    :param str target: the Cypher variable of the node on the other end of the relationship
+    :kwarg str rel_variable: the Cypher variable to bind the relationship to
+    :return: the Cypher pattern
+    :rtype: str
+    """
+    definition = getattr(model, rel_name).definition
+    rel = '[{0}:{1}]'.format(rel_variable, definition['relation_type'])
+    if definition['direction'] == OUTGOING:
+        return '({0})-{1}->({2})'.format(source, rel, target)
+    elif definition['direction'] == INCOMING:
+        return '({0})<-{1}-({2})'.format(source, rel, target)
+    return '({0})-{1}-({2})'.format(source, rel, target)
+
+
+def merge_relationship_clause(model, rel_name, source, target):
+    """
+    Build a MERGE clause that connects two nodes like neomodel's connect does.
+
+    :param type model: the neomodel class that defines the relationship
+    :param str rel_name: the name of the relationship attribute on the neomodel class
+    :param str source: the Cypher variable of the node the relationship is accessed from
+    :param str target: the Cypher variable of the node to connect to
+    :return: the Cypher clause
+    :rtype: str
+    """
+    return 'MERGE {0}\n'.format(relationship_pattern(model, rel_name, source, target))
+
+
+def conditional_connect_clause(model, rel_name, source, target, carried_variables):
+    """
+    Build Cypher clauses that connect two nodes like Estuary's conditional_connect does.
+
+    Any existing relationship of this type from the source node to another node is deleted before
+    the nodes are connected, since the relationship can only point to one node.
+
+    :param type model: the neomodel class that defines the relationship
+    :param str rel_name: the name of the relationship attribute on the neomodel class
+    :param str source: the Cypher variable of the node the relationship is accessed from
+    :param str target: the Cypher variable of the node to connect to
+    :param list carried_variables: the Cypher variables that the rest of the query needs, which
+        must include the source and target variables
+    :return: the Cypher clauses
+    :rtype: str
+    """
+    old_rel = '{0}_old_{1}'.format(source, rel_name)
+    other = '{0}_other_{1}'.format(source, rel_name)
+    carried = ', '.join(carried_variables)
+    return (
+        'WITH {carried}\n'
+        'OPTIONAL MATCH {pattern}\n'
+        'WHERE {other} <> {target}\n'
+        'DELETE {old_rel}\n'
+        'WITH DISTINCT {carried}\n'
+        '{merge}'
+    ).format(
+        carried=carried,
+        pattern=relationship_pattern(model, rel_name, source, other, old_rel),
+        other=other,
+        target=target,
+        old_rel=old_rel,
+        merge=merge_relationship_clause(model, rel_name, source, target)
+    )
+
+
+def match_node_by_id_clause(model, variable, node_id):
+    """
+    Build a MATCH clause that binds a node that is already known to exist by its internal ID.
+
+    :param type model: the neomodel class of the node
+    :param str variable: the Cypher variable to bind the node to
+    :param str node_id: the Cypher expression of the internal ID of the node
+    :return: the Cypher clause
+    :rtype: str
+    """
+    return 'MATCH ({0}:{1})\nWHERE id({0}) = {2}\n'.format(
+        variable, ':'.join(model.inherited_labels()), node_id)
+
+
+def connect_many_query(model, rel_name, target_model):
+    """
+    Build a Cypher query that merges many nodes and connects a node to all of them.
+
+    The query takes the internal ID of the node as the "source_id" parameter and the parameters
+    returned by get_merge_params for each node to connect as the "targets" parameter. All the nodes
+    and relationships are stored with a single UNWIND instead of a get_or_create and connect call
+    per node.
+
+    :param type model: the neomodel class that defines the relationship
+    :param str rel_name: the name of the relationship attribute on the neomodel class
+    :param type target_model: the neomodel class of the nodes to connect to
+    :return: the Cypher query
+    :rtype: str
+    """
+    return ''.join([
+        match_node_by_id_clause(model, 'source', '$source_id'),
+        'UNWIND $targets AS target\n',
+        merge_node_clause(target_model, 'target_node', 'target'),
+        merge_relationship_clause(model, rel_name, 'source', 'target_node')
+    ])
@@ -0,0 +1,353 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals, absolute_import
+
+import abc
+from contextlib import contextmanager
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+from estuary_updater import ABC
+from estuary_updater.cache import TTLCache
+
+
+def get_content_hash(msg):
+    """
+    Get a hash of the content of a message that doesn't change when the message is redelivered.
+
+    The headers are left out since the broker sets a new message ID and timestamp.
+
+    :param dict msg: the message
+    :return: the SHA-1 hex digest of the topic and body of the message
+    :rtype: str
+    """
+    content = json.dumps([msg['topic'], msg['body'].get('msg')], sort_keys=True)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+class DedupStore(ABC):
+    """
+    The base class of the stores of the messages that were already applied to Neo4j.
+
+    A message is a duplicate if its message ID was applied within the window of the store, or if
+    the last message applied about the same entity, as given by the ordering key of the message,
+    had the same content. Comparing the content with the last message of the entity only, instead
+    of all the messages within the window, keeps a build that is tagged, untagged and then tagged
+    again from skipping the second tag message.
+    """
+
+    def __init__(self):
+        """Initialize the store."""
+        self.skipped = {'message_id': 0, 'content': 0}
+        self._stats_lock = threading.Lock()
+        self._local = threading.local()
+
+    def is_duplicate(self, message_id, key, content_hash):
+        """
+        Check if a message was already applied.
+
+        :param str message_id: the ID of the message
+        :param key: the hashable ordering key of the message or None if it doesn't have one
+        :param str content_hash: the hash of the content of the message
+        :return: the reason the message is a duplicate, which is "message_id" or "content", or None
+        :rtype: str or None
+        """
+        reason = None
+        pending = getattr(self._local, 'pending', None) or []
+        if any(entry[0] == message_id for entry in pending) or self._has_message(message_id):
+            reason = 'message_id'
+        elif key is not None:
+            for _, pending_key, pending_hash in reversed(pending):
+                if pending_key == key:
+                    latest_hash = pending_hash
+                    break
+            else:
+                latest_hash = self._get_latest_hash(key)
+            if latest_hash == content_hash:
+                reason = 'content'
+
+        if reason is not None:
+            with self._stats_lock:
+                self.skipped[reason] += 1
+        return reason
+
+    def mark(self, message_id, key, content_hash):
+        """
+        Record that a message was applied.
+
+        :param str message_id: the ID of the message
+        :param key: the hashable ordering key of the message or None if it doesn't have one
+        :param str content_hash: the hash of the content of the message
+        """
+        pending = getattr(self._local, 'pending', None)
+        if pending is None:
+            self._mark([(message_id, key, content_hash)])
+        else:
+            pending.append((message_id, key, content_hash))
+
+    @contextmanager
+    def deferred(self):
+        """
+        Hold the messages marked by the current thread until the block finishes without an error.
+
+        This is used around a Neo4j transaction so that the messages of a batch that is rolled back
+        aren't recorded as applied.
+
+        :return: a context manager
+        """
+        pending = self._local.pending = []
+        try:
+            yield
+            self._mark(pending)
+        finally:
+            self._local.pending = None
+
+    def stats(self):
+        """
+        Get the statistics of the store.
+
+        :return: the number of messages skipped by message ID and by content and the size
+        :rtype: dict
+        """
+        with self._stats_lock:
+            return dict(self.skipped, size=self._get_size())
+
+    def close(self):
+        """Release anything the store holds."""
+        pass
+
+    @abc.abstractmethod
+    def _has_message(self, message_id):
+        """
+        Check if a message ID was applied within the window.
+
+        :param str message_id: the ID of the message
+        :return: a bool based on if the message ID was applied
+        :rtype: bool
+        """
+        pass
+
+    @abc.abstractmethod
+    def _get_latest_hash(self, key):
+        """
+        Get the content hash of the last message applied about an entity within the window.
+
+        :param key: the hashable ordering key of the entity
+        :return: the content hash or None
+        :rtype: str or None
+        """
+        pass
+
+    @abc.abstractmethod
+    def _mark(self, entries):
+        """
+        Record that messages were applied.
+
+        :param list entries: tuples of the message ID, ordering key and content hash
+        """
+        pass
+
+    @abc.abstractmethod
+    def _get_size(self):
+        """
+        Get the number of message IDs in the store.
+
+        :return: the number of message IDs, including the expired ones
+        :rtype: int
+        """
+        pass
+
+
+class MemoryDedupStore(DedupStore):
+    """A dedup store that keeps the applied messages in memory."""
+
+    def __init__(self, max_size, ttl):
+        """
+        Initialize the store.
+
+        :param int max_size: the maximum number of message IDs and of entities to remember
+        :param float ttl: the number of seconds a message is remembered for
+        """
+        super(MemoryDedupStore, self).__init__()
+        self._messages = TTLCache(max_size, ttl)
+        self._latest_hashes = TTLCache(max_size, ttl)
+
+    def _has_message(self, message_id):
+        """
+        Check if a message ID was applied within the window.
+
+        :param str message_id: the ID of the message
+        :return: a bool based on if the message ID was applied
+        :rtype: bool
+        """
+        return self._messages.get(message_id) is not None
+
+    def _get_latest_hash(self, key):
+        """
+        Get the content hash of the last message applied about an entity within the window.
+
+        :param key: the hashable ordering key of the entity
+        :return: the content hash or None
+        :rtype: str or None
+        """
+        return self._latest_hashes.get(key)
+
+    def _mark(self, entries):
+        """
+        Record that messages were applied.
+
+        :param list entries: tuples of the message ID, ordering key and content hash
+        """
+        for message_id, key, content_hash in entries:
+            self._messages.set(message_id, True)
+            if key is not None:
+                self._latest_hashes.set(key, content_hash)
+
+    def _get_size(self):
+        """
+        Get the number of message IDs in the store.
+
+        :return: the number of message IDs, including the expired ones
+        :rtype: int
+        """
+        return len(self._messages)
+
+
+class SQLiteDedupStore(DedupStore):
+    """
+    A dedup store that keeps the applied messages in a local SQLite database.
+
+    Unlike the in-memory store, it remembers the applied messages across restarts, which is when
+    the broker is most likely to redeliver them.
+    """
+
+    def __init__(self, path, max_size, ttl):
+        """
+        Initialize the store and create its tables if needed.
+
+        :param str path: the path of the SQLite database file
+        :param int max_size: the maximum number of message IDs and of entities to remember
+        :param float ttl: the number of seconds a message is remembered for
+        """
+        super(SQLiteDedupStore, self).__init__()
+        self.max_size = max_size
+        self.ttl = ttl
+        self._marks_since_prune = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS messages '
+                '(message_id TEXT PRIMARY KEY, applied REAL NOT NULL)')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS latest_hashes '
+                '(key TEXT PRIMARY KEY, content_hash TEXT NOT NULL, applied REAL NOT NULL)')
+            self._connection.execute(
+                'CREATE INDEX IF NOT EXISTS messages_applied ON messages (applied)')
+            self._connection.execute(
+                'CREATE INDEX IF NOT EXISTS latest_hashes_applied ON latest_hashes (applied)')
+        self._prune()
+
+    def _has_message(self, message_id):
+        """
+        Check if a message ID was applied within the window.
+
+        :param str message_id: the ID of the message
+        :return: a bool based on if the message ID was applied
+        :rtype: bool
+        """
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT 1 FROM messages WHERE message_id = ? AND applied > ?',
+                (message_id, time.time() - self.ttl)).fetchone()
+        return row is not None
+
+    def _get_latest_hash(self, key):
+        """
+        Get the content hash of the last message applied about an entity within the window.
+
+        :param key: the ordering key of the entity, which must be serializable to JSON
+        :return: the content hash or None
+        :rtype: str or None
+        """
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT content_hash FROM latest_hashes WHERE key = ? AND applied > ?',
+                (json.dumps(key), time.time() - self.ttl)).fetchone()
+        return row[0] if row else None
+
+    def _mark(self, entries):
+        """
+        Record that messages were applied in a single SQLite transaction.
+
+        :param list entries: tuples of the message ID, ordering key and content hash
+        """
+        if not entries:
+            return
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO messages (message_id, applied) VALUES (?, ?)',
+                [(message_id, now) for message_id, _, _ in entries])
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO latest_hashes (key, content_hash, applied) '
+                'VALUES (?, ?, ?)',
+                [(json.dumps(key), content_hash, now)
+                 for _, key, content_hash in entries if key is not None])
+            self._marks_since_prune += len(entries)
+            prune = self._marks_since_prune >= max(self.max_size // 10, 1)
+        if prune:
+            self._prune()
+
+    def _prune(self):
+        """Delete the expired rows and the oldest rows over the maximum size."""
+        with self._lock, self._connection:
+            self._marks_since_prune = 0
+            for table in ('messages', 'latest_hashes'):
+                self._connection.execute(
+                    'DELETE FROM {0} WHERE applied <= ?'.format(table), (time.time() - self.ttl,))
+                self._connection.execute(
+                    'DELETE FROM {0} WHERE rowid IN (SELECT rowid FROM {0} '
+                    'ORDER BY applied DESC LIMIT -1 OFFSET ?)'.format(table), (self.max_size,))
+
+    def _get_size(self):
+        """
+        Get the number of message IDs in the store.
+
+        :return: the number of message IDs, including the expired ones
+        :rtype: int
+        """
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*) FROM messages').fetchone()[0]
+
+    def close(self):
+        """Close the SQLite database."""
+        with self._lock:
+            self._connection.close()
+
+
+def get_dedup_store(config):
+    """
+    Create the dedup store configured by "estuary_updater.dedup".
+
+    :param dict config: the fedmsg configuration
+    :return: the store or None if deduplication is disabled
+    :rtype: DedupStore or None
+    :raises ValueError: if "estuary_updater.dedup" is not "memory", "sqlite" or disabled
+    """
+    backend = config.get('estuary_updater.dedup')
+    if not backend:
+        return None
+    max_size = config.get('estuary_updater.dedup_max_size', 100000)
+    ttl = config.get('estuary_updater.dedup_ttl', 86400)
+    if backend == 'memory':
+        return MemoryDedupStore(max_size, ttl)
+    elif backend == 'sqlite':
+        return SQLiteDedupStore(
+            config.get('estuary_updater.dedup_path', 'estuary-updater-dedup.sqlite'), max_size,
+            ttl)
+    raise ValueError('The configuration "estuary_updater.dedup" must be "memory" or "sqlite"')
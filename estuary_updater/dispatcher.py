@@ -0,0 +1,290 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals, absolute_import
+
+from contextlib import contextmanager
+import time
+
+import neomodel
+
+from estuary_updater import log, tracing
+from estuary_updater.dedup import get_content_hash, get_dedup_store
+from estuary_updater.handlers import topic_to_handler
+from estuary_updater.metrics import ConsumerMetrics, Counter, start_server
+from estuary_updater.query_monitor import QueryMonitor
+from estuary_updater.resources import SharedResources
+
+
+class Dispatcher(object):
+    """Send messages to long-lived handler instances based on the topic of the message."""
+
+    def __init__(self, config):
+        """
+        Initialize the dispatcher by instantiating every registered handler once.
+
+        :param dict config: the fedmsg configuration
+        """
+        self.config = config
+        self.resources = SharedResources(config)
+        # When enabled, the dispatch of each message, its Koji calls, Errata Tool requests and Neo4j
+        # queries are timed and exported as a trace
+        self.tracing = config.get('estuary_updater.tracing', False)
+        if self.tracing:
+            tracing.instrument_neo4j()
+            if config.get('estuary_updater.tracing_log', True):
+                tracing.add_exporter(tracing.log_exporter)
+        # When enabled, the Cypher queries of each message are counted per handler method and
+        # checked against the query budgets
+        self.query_monitor = None
+        query_budgets = config.get('estuary_updater.query_budgets')
+        if config.get('estuary_updater.query_monitor', False) or query_budgets:
+            self.query_monitor = QueryMonitor(
+                query_budgets, config.get('estuary_updater.query_budget_strict', False))
+        # When enabled, messages that were already applied, such as the ones redelivered by the
+        # broker, are skipped
+        self.dedup_store = get_dedup_store(config)
+        # The metrics are only recorded when they are served
+        self.metrics = None
+        self.metrics_server = None
+        if config.get('estuary_updater.metrics_port') is not None:
+            self.metrics = ConsumerMetrics(self.resources)
+            tracing.instrument_neo4j()
+            tracing.add_query_listener(self.metrics.observe_query)
+            if self.dedup_store is not None:
+                self.metrics.registry.add_collector(self.collect_dedup_metrics)
+        self.handlers = {}
+        # The topics mapped to the handler instance and its method that processes the topic
+        self._topic_to_method = {}
+        for topic, (handler_cls, method_name) in topic_to_handler.items():
+            if handler_cls not in self.handlers:
+                self.handlers[handler_cls] = handler_cls(config, self.resources)
+            handler = self.handlers[handler_cls]
+            self._topic_to_method[topic] = (handler, getattr(handler, method_name))
+
+    def startup(self):
+        """Run the startup hook of every handler and start serving the metrics if enabled."""
+        for handler in self.handlers.values():
+            handler.startup()
+        if self.metrics is not None and self.metrics_server is None:
+            self.metrics_server = start_server(
+                self.metrics.registry, self.config.get('estuary_updater.metrics_host', '0.0.0.0'),
+                self.config['estuary_updater.metrics_port'])
+
+    def shutdown(self):
+        """Run the shutdown hook of every handler and close the shared sessions."""
+        for handler in self.handlers.values():
+            try:
+                handler.shutdown()
+            except Exception:
+                log.exception('The handler {0} failed to shut down'.format(
+                    type(handler).__name__))
+        if self.metrics is not None:
+            tracing.remove_query_listener(self.metrics.observe_query)
+        if self.metrics_server is not None:
+            self.metrics_server.shutdown()
+            self.metrics_server.server_close()
+            self.metrics_server = None
+        if self.dedup_store is not None:
+            self.dedup_store.close()
+        self.resources.close()
+
+    def collect_dedup_metrics(self):
+        """
+        Get the number of duplicate messages that were skipped as metrics.
+
+        :return: the metrics
+        :rtype: list
+        """
+        stats = self.dedup_store.stats()
+        skipped = Counter(
+            'estuary_updater_duplicate_messages_total',
+            'The number of messages skipped since they were already applied', ('reason',))
+        for reason in ('message_id', 'content'):
+            skipped.inc(stats[reason], reason=reason)
+        return [skipped]
+
+    def get_handler_method(self, msg):
+        """
+        Get the bound handler method that processes the message.
+
+        :param dict msg: a received message from the message bus
+        :return: the handler method or None if no handler supports the topic of the message
+        :rtype: callable or None
+        """
+        return self._topic_to_method.get(msg['topic'], (None, None))[1]
+
+    def get_ordering_key(self, msg):
+        """
+        Get the key of the entity the message is about from the handler of the message.
+
+        :param dict msg: a received message from the message bus
+        :return: a hashable key or None if the message doesn't need to be ordered or is malformed
+        """
+        return self._get_handler_key(msg, 'get_ordering_key')
+
+    def get_coalesce_key(self, msg):
+        """
+        Get the coalesce key of the message from the handler of the message.
+
+        :param dict msg: a received message from the message bus
+        :return: a hashable key or None if the message must never be discarded or is malformed
+        """
+        return self._get_handler_key(msg, 'get_coalesce_key')
+
+    def _get_handler_key(self, msg, key_method_name):
+        """
+        Get a key of the message from the handler of the message.
+
+        The key methods of the handlers run before the message is validated, so a malformed message
+        gets no key. It then fails the validation of its handler like any other bad message.
+
+        :param dict msg: a received message from the message bus
+        :param str key_method_name: the name of the key method of the handler
+        :return: a hashable key or None
+        """
+        try:
+            handler = self._topic_to_method.get(msg['topic'], (None, None))[0]
+            if handler is None:
+                return None
+            return getattr(handler, key_method_name)(msg)
+        except (KeyError, TypeError):
+            log.warning('The message {0} is malformed, so it has no key'.format(
+                msg.get('headers', {}).get('message-id')))
+            return None
+
+    def dispatch_messages(self, msgs):
+        """
+        Process messages one by one or in a single transaction if there are more than one.
+
+        Any failure is logged instead of raised.
+
+        :param list msgs: the messages to process in the order they were received
+        :return: the messages that failed to be processed
+        :rtype: list
+        """
+        if len(msgs) > 1:
+            return self.dispatch_batch(msgs)
+
+        failed = []
+        for msg in msgs:
+            try:
+                self.dispatch(msg)
+            except Exception:
+                log.exception('Failed to process the message: {0}'.format(
+                    msg['headers']['message-id']))
+                failed.append(msg)
+        return failed
+
+    def dispatch(self, msg):
+        """
+        Process a message with the handler method registered for its topic.
+
+        :param dict msg: a received message from the message bus
+        :return: a bool based on if a handler processed the message, which is false when no
+            handler supports the topic or the message was already applied
+        :rtype: bool
+        """
+        handler, handler_method = self._topic_to_method.get(msg['topic'], (None, None))
+        if handler is None:
+            return False
+
+        message_id = msg['headers']['message-id']
+        dedup_entry = None
+        if self.dedup_store is not None:
+            dedup_entry = (
+                message_id, self.get_ordering_key(msg), get_content_hash(msg))
+            reason = self.dedup_store.is_duplicate(*dedup_entry)
+            if reason is not None:
+                log.debug('Skipping the message {0} since a message with the same {1} was already '
+                          'applied'.format(message_id, reason.replace('_', ' ')))
+                return False
+
+        handler_name = type(handler).__name__
+        log.debug('The handler {0} will handle the message: {1}'.format(handler_name, message_id))
+        trace_tags = {
+            'topic': msg['topic'],
+            'handler': handler_name,
+            'message_id': message_id
+        }
+        start = time.time()
+        failed = True
+        try:
+            with tracing.trace(self.tracing, **trace_tags):
+                if self.query_monitor is None:
+                    handler_method(msg)
+                else:
+                    method_name = '{0}.{1}'.format(handler_name, topic_to_handler[msg['topic']][1])
+                    with self.query_monitor.measure(method_name, message_id):
+                        handler_method(msg)
+            failed = False
+        finally:
+            if self.metrics is not None:
+                self.metrics.observe_message(msg, handler_name, time.time() - start, failed)
+        if dedup_entry is not None:
+            self.dedup_store.mark(*dedup_entry)
+        log.debug('The handler {0} is done handling the message: {1}'.format(
+            handler_name, message_id))
+        return True
+
+    @contextmanager
+    def transaction(self):
+        """
+        Open a Neo4j transaction and only share its cached nodes once it's committed.
+
+        The messages of the transaction are also only recorded as applied, counted in the metrics
+        and traced once it's committed.
+
+        :return: a context manager
+        """
+        with self.resources.node_cache.deferred(), tracing.deferred(), self._deferred_metrics():
+            if self.dedup_store is None:
+                with neomodel.db.transaction:
+                    yield
+            else:
+                with self.dedup_store.deferred():
+                    with neomodel.db.transaction:
+                        yield
+
+    @contextmanager
+    def _deferred_metrics(self):
+        """
+        Hold the messages observed in the metrics until the block finishes without an error.
+
+        :return: a context manager
+        """
+        if self.metrics is None:
+            yield
+        else:
+            with self.metrics.deferred():
+                yield
+
+    def dispatch_batch(self, msgs):
+        """
+        Process messages in a single Neo4j transaction.
+
+        If processing any of the messages fails, the transaction is rolled back and the messages are
+        processed one by one so that a single bad message can't keep the others from being stored.
+
+        :param list msgs: the messages to process in the order they were received
+        :return: the messages that failed to be processed
+        :rtype: list
+        """
+        try:
+            with self.transaction():
+                for msg in msgs:
+                    self.dispatch(msg)
+        except Exception:
+            log.exception('Failed to process the batch of {0} messages in a single transaction, so '
+                          'they will be processed individually'.format(len(msgs)))
+        else:
+            return []
+
+        failed = []
+        for msg in msgs:
+            try:
+                self.dispatch(msg)
+            except Exception:
+                log.exception('Failed to process the message: {0}'.format(
+                    msg['headers']['message-id']))
+                failed.append(msg)
+        return failed
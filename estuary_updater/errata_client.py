@@ -0,0 +1,120 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals, absolute_import
+
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+import requests_kerberos
+
+from estuary_updater import tracing
+
+
+class ErrataClient(object):
+    """
+    A client for the Errata Tool API that reuses its connections across requests.
+
+    All the threads share a single pool of keep-alive connections, and each thread reuses its own
+    Kerberos authentication context since it is not thread-safe.
+    """
+
+    def __init__(self, config, cache=None):
+        """
+        Initialize the client.
+
+        :param dict config: the fedmsg configuration
+        :kwarg TTLCache cache: the cache of products and users, which rarely change
+        """
+        self.config = config
+        self.cache = cache
+        self.timeout = config.get('estuary_updater.errata_timeout', 10)
+        self._local = threading.local()
+        self.session = requests.Session()
+        retries = Retry(
+            total=config.get('estuary_updater.errata_retries', 3),
+            backoff_factor=0.5,
+            status_forcelist=(500, 502, 503, 504)
+        )
+        pool_size = config.get('estuary_updater.errata_pool_size', 10)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retries)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    @property
+    def auth(self):
+        """
+        Get the Kerberos authentication of the current thread.
+
+        :return: the Kerberos authentication
+        :rtype: requests_kerberos.HTTPKerberosAuth
+        """
+        auth = getattr(self._local, 'auth', None)
+        if auth is None:
+            auth = requests_kerberos.HTTPKerberosAuth()
+            self._local.auth = auth
+        return auth
+
+    def get(self, path):
+        """
+        Get a JSON document from the Errata Tool API.
+
+        :param str path: the path of the API endpoint starting with a slash
+        :return: the decoded JSON
+        :rtype: dict
+        """
+        url = self.config['estuary_updater.errata_url'].rstrip('/') + path
+        with tracing.span('errata.get', path=path):
+            response = self.session.get(url, auth=self.auth, timeout=self.timeout)
+            return response.json()
+
+    def get_erratum(self, advisory_id):
+        """
+        Get an advisory from the Errata Tool API.
+
+        :param int advisory_id: the ID of the advisory
+        :return: the advisory
+        :rtype: dict
+        """
+        return self.get('/api/v1/erratum/{0}'.format(advisory_id))
+
+    def get_cached(self, path):
+        """
+        Get a JSON document from the cache or from the Errata Tool API if it isn't cached.
+
+        :param str path: the path of the API endpoint starting with a slash
+        :return: the decoded JSON
+        :rtype: dict
+        """
+        if self.cache is None:
+            return self.get(path)
+        rv = self.cache.get(path)
+        if rv is None:
+            rv = self.get(path)
+            self.cache.set(path, rv)
+        return rv
+
+    def get_product(self, product_id):
+        """
+        Get a product from the cache or from the Errata Tool API.
+
+        :param int product_id: the ID of the product
+        :return: the product
+        :rtype: dict
+        """
+        return self.get_cached('/products/{0}.json'.format(product_id))
+
+    def get_user(self, user_id):
+        """
+        Get a user from the cache or from the Errata Tool API.
+
+        :param int user_id: the ID of the user
+        :return: the user
+        :rtype: dict
+        """
+        return self.get_cached('/api/v1/user/{0}'.format(user_id))
+
+    def close(self):
+        """Close all the pooled connections."""
+        self.session.close()
@@ -10,3 +10,27 @@ from estuary_updater.handlers.koji import KojiHandler
 
 # All handler classes are added here
 all_handlers = [DistGitHandler, FreshmakerHandler, ErrataHandler, KojiHandler]
+
+
+def get_topic_to_handler(handlers):
+    """
+    Build the dispatch table mapping every supported topic to its handler class and method name.
+
+    :param list handlers: the handler classes to register
+    :return: a dictionary with topics as keys and tuples of (handler class, method name) as values
+    :rtype: dict
+    :raises RuntimeError: if more than one handler registers the same topic
+    """
+    topic_to_handler = {}
+    for handler_cls in handlers:
+        for topic, method_name in handler_cls.topic_to_method.items():
+            if topic in topic_to_handler:
+                raise RuntimeError('The topic {0} is registered by both {1} and {2}'.format(
+                    topic, topic_to_handler[topic][0].__name__, handler_cls.__name__))
+            topic_to_handler[topic] = (handler_cls, method_name)
+    return topic_to_handler
+
+
+# The dispatch table is built once at import time so that finding the handler of a message is a
+# single dictionary lookup
+topic_to_handler = get_topic_to_handler(all_handlers)
@@ -7,152 +7,315 @@ import re
 from estuary.models.distgit import DistGitRepo, DistGitBranch, DistGitCommit
 from estuary.models.bugzilla import BugzillaBug
 from estuary.models.user import User
-from estuary.utils.general import timestamp_to_datetime
+import neomodel
 
 from estuary_updater.handlers.base import BaseHandler
+from estuary_updater.cypher import (
+    get_merge_params, merge_node_clause, merge_relationship_clause, conditional_connect_clause,
+    match_node_by_id_clause)
+from estuary_updater.schemas import Field, Schema, string_types
+from estuary_updater.timestamps import parse_timestamps
+
+
+# The fields of a commit message
+COMMIT_SCHEMA = Schema('DistGitCommitMessage', [
+    Field('email', 'headers.email', string_types),
+    Field('namespace', 'headers.namespace', string_types),
+    Field('repo', 'headers.repo', string_types),
+    Field('branch', 'headers.branch', string_types),
+    Field('rev', 'headers.rev', string_types),
+    Field('message', 'body.msg.message', string_types),
+    Field('author_date', 'body.msg.author_date', string_types),
+    Field('commit_date', 'body.msg.commit_date', string_types)
+])
+# The fields of a push message
+PUSH_SCHEMA = Schema('DistGitPushMessage', [
+    Field('oldrev', 'body.msg.oldrev', string_types),
+    Field('commits', 'body.msg.commits', list)
+])
+# Matches the "Resolves:", "Related:" and "Reverted:" lines of a commit message and the rest of them
+BUGZILLA_LINE_PATTERN = re.compile(
+    r'^(?:(reverted|resolves|related)\: *(.+))', re.IGNORECASE | re.MULTILINE)
+# Matches a bug reference, such as "rhbz#123", "bz 123" or "#123", and captures the ID
+BUGZILLA_ID_PATTERN = re.compile(r'(?:(?:bug|bz|rhbz)\s*#?|#)\s*(\d+)', re.IGNORECASE)
+# The nodes of the commit query that can be cached, in the order they are returned
+COMMIT_QUERY_NODES = (('repo', DistGitRepo), ('branch', DistGitBranch), ('author', User))
+# The commit queries keyed by the variables of the nodes that are cached
+_commit_queries = {}
+
+
+def _build_commit_query(cached_variables):
+    """
+    Build the Cypher query used to store a dist-git commit.
+
+    The result is the same graph that calling get_or_create, create_or_update, connect and
+    conditional_connect on each node produces. The repo, branch and author nodes that are in the
+    node cache are matched by their internal IDs instead of being merged again.
+
+    :param tuple cached_variables: the variables out of "repo", "branch" and "author" whose nodes
+        are cached and whose IDs are passed as the "<variable>_id" parameters
+    :return: the Cypher query, which returns the repo, branch and author nodes
+    :rtype: str
+    """
+    # The MATCH clauses must come before any MERGE clause
+    clauses = [
+        match_node_by_id_clause(model, variable, '${0}_id'.format(variable))
+        for variable, model in COMMIT_QUERY_NODES if variable in cached_variables
+    ]
+    for variable, model in COMMIT_QUERY_NODES:
+        if variable not in cached_variables:
+            clauses.append(merge_node_clause(
+                model, variable, '${0}'.format(variable), update_existing=(model is User)))
+    clauses += [
+        merge_node_clause(DistGitCommit, 'commit', '$commit', update_existing=True),
+        merge_relationship_clause(DistGitRepo, 'contributors', 'repo', 'author'),
+        merge_relationship_clause(DistGitRepo, 'branches', 'repo', 'branch'),
+        merge_relationship_clause(DistGitRepo, 'commits', 'repo', 'commit'),
+        merge_relationship_clause(DistGitBranch, 'contributors', 'branch', 'author'),
+        merge_relationship_clause(DistGitBranch, 'commits', 'branch', 'commit'),
+        conditional_connect_clause(
+            DistGitCommit, 'author', 'commit', 'author', ['repo', 'branch', 'author', 'commit']),
+        # FOREACH is used instead of UNWIND so that the row is kept when there are no bugs
+        'FOREACH (bug IN $bugs |\n',
+        merge_node_clause(BugzillaBug, 'bug_node', 'bug.params')
+    ]
+    for _, rel_name in DistGitHandler.bug_rel_types:
+        merge_rel = merge_relationship_clause(DistGitCommit, rel_name, 'commit', 'bug_node')
+        clauses.append(
+            "FOREACH (_ IN CASE WHEN '{0}' IN bug.relationships THEN [1] ELSE [] END |\n"
+            "  {1})\n".format(rel_name, merge_rel.strip()))
+    clauses.append(')\nRETURN repo, branch, author\n')
+    return ''.join(clauses)
+
+
+def get_commit_query(cached_variables):
+    """
+    Get the Cypher query used to store a dist-git commit, building it on the first use.
+
+    :param tuple cached_variables: the variables whose nodes are cached
+    :return: the Cypher query
+    :rtype: str
+    """
+    cached_variables = tuple(sorted(cached_variables))
+    query = _commit_queries.get(cached_variables)
+    if query is None:
+        query = _commit_queries[cached_variables] = _build_commit_query(cached_variables)
+    return query
+
+
+def _build_push_query():
+    """
+    Build the Cypher query used to store the parent-child relationships of pushed commits.
+
+    :return: the Cypher query
+    :rtype: str
+    """
+    return ''.join([
+        'UNWIND $pairs AS pair\n',
+        merge_node_clause(DistGitCommit, 'parent', 'pair.parent'),
+        merge_node_clause(DistGitCommit, 'child', 'pair.child'),
+        merge_relationship_clause(DistGitCommit, 'parent', 'child', 'parent')
+    ])
+
+
+PUSH_QUERY = _build_push_query()
 
 
 class DistGitHandler(BaseHandler):
     """A handler for dist-git related messages."""
 
-    @staticmethod
-    def can_handle(msg):
+    topic_to_method = {
+        '/topic/VirtualTopic.eng.distgit.commit': 'commit_handler',
+        '/topic/VirtualTopic.eng.distgit.push': 'push_handler'
+    }
+    schemas = {
+        'commit_handler': COMMIT_SCHEMA,
+        'push_handler': PUSH_SCHEMA
+    }
+
+    # The keys returned by parse_bugzilla_bugs mapped to their DistGitCommit relationships
+    bug_rel_types = (
+        ('resolves', 'resolved_bugs'),
+        ('related', 'related_bugs'),
+        ('reverted', 'reverted_bugs')
+    )
+
+    def get_ordering_key(self, msg):
         """
-        Determine if this is a dist-git message.
+        Get the repo and branch of the message so that the commits of a branch stay in order.
 
-        :param dict msg: a message to be analyzed
-        :return: a bool based on if the handler can handle this kind of message
-        :rtype: bool
+        :param dict msg: a message to be processed
+        :return: a tuple with the handler name, namespace, repo and branch
+        :rtype: tuple
         """
-        supported_topics = [
-            '/topic/VirtualTopic.eng.distgit.commit',
-            '/topic/VirtualTopic.eng.distgit.push'
-        ]
-        return msg['topic'] in supported_topics
+        return ('distgit', msg['headers']['namespace'], msg['headers']['repo'],
+                msg['headers']['branch'])
 
-    def handle(self, msg):
+    def startup(self):
         """
-        Handle a dist-git message by sending it to the right handler method and update Neo4j.
+        Check the configuration of the handler before it receives its first message.
 
-        :param dict msg: a message to be processed
+        :raises ValueError: if "estuary_updater.push_chunk_size" is less than 1
         """
-        if msg['topic'] == '/topic/VirtualTopic.eng.distgit.commit':
-            self.commit_handler(msg)
-        elif msg['topic'] == '/topic/VirtualTopic.eng.distgit.push':
-            self.push_handler(msg)
-        else:
-            raise RuntimeError('This message is unable to be handled: {0}'.format(msg))
+        if self.config.get('estuary_updater.push_chunk_size', 500) < 1:
+            raise ValueError(
+                'The configuration "estuary_updater.push_chunk_size" must be at least 1')
 
     def commit_handler(self, msg):
         """
         Handle a dist-git commit message and update Neo4j if necessary.
 
+        The repo, branch, author, commit, Bugzilla bugs and all their relationships are stored with
+        a single Cypher query instead of a round trip per node and relationship. The repo, branch
+        and author nodes in the node cache are matched by their IDs instead of being merged.
+
         :param dict msg: a message to be processed
         """
-        repo = DistGitRepo.get_or_create({
-            'namespace': msg['headers']['namespace'],
-            'name': msg['headers']['repo']
-        })[0]
-
-        branch = DistGitBranch.get_or_create({
-            'name': msg['headers']['branch'],
-            'repo_namespace': msg['headers']['namespace'],
-            'repo_name': msg['headers']['repo']
-        })[0]
-
+        fields = self.extract_fields(msg)
         # Get the username from the email if the email is a Red Hat email
-        email = msg['headers']['email'].lower()
+        email = fields.email.lower()
         if email.endswith('@redhat.com'):
             username = email.split('@redhat.com')[0]
         else:
             username = email
 
-        author = User.create_or_update({
-            'username': username,
-            'email': email
-        })[0]
-
-        commit_message = msg['body']['msg']['message']
-        commit = DistGitCommit.create_or_update({
-            'hash_': msg['headers']['rev'],
-            'log_message': commit_message,
-            'author_date': timestamp_to_datetime(msg['body']['msg']['author_date']),
-            'commit_date': timestamp_to_datetime(msg['body']['msg']['commit_date'])
-        })[0]
-
+        commit_message = fields.message
         bug_rel_mapping = self.parse_bugzilla_bugs(commit_message)
+        # A bug can be mentioned more than once, so map each bug to all its relationships
+        bug_relationships = {}
+        for rel_type, rel_name in self.bug_rel_types:
+            for bug_id in bug_rel_mapping[rel_type]:
+                bug_relationships.setdefault(bug_id, set()).add(rel_name)
 
-        for bug_id in bug_rel_mapping['resolves']:
-            bug = BugzillaBug.get_or_create({
-                'id_': bug_id
-            })[0]
-            commit.resolved_bugs.connect(bug)
-
-        for bug_id in bug_rel_mapping['related']:
-            bug = BugzillaBug.get_or_create({
-                'id_': bug_id
-            })[0]
-            commit.related_bugs.connect(bug)
-
-        for bug_id in bug_rel_mapping['reverted']:
-            bug = BugzillaBug.get_or_create({
-                'id_': bug_id
-            })[0]
-            commit.reverted_bugs.connect(bug)
+        node_properties = {
+            'repo': {
+                'namespace': fields.namespace,
+                'name': fields.repo
+            },
+            'branch': {
+                'name': fields.branch,
+                'repo_namespace': fields.namespace,
+                'repo_name': fields.repo
+            },
+            'author': {
+                'username': username,
+                'email': email
+            }
+        }
+        # The author and commit dates are usually the same, so they are parsed together
+        author_date, commit_date = parse_timestamps([fields.author_date, fields.commit_date])
+        params = {
+            'commit': get_merge_params(DistGitCommit, {
+                'hash_': fields.rev,
+                'log_message': commit_message,
+                'author_date': author_date,
+                'commit_date': commit_date
+            }),
+            'bugs': [
+                {
+                    'params': get_merge_params(BugzillaBug, {'id_': bug_id}),
+                    'relationships': sorted(rel_names)
+                }
+                for bug_id, rel_names in bug_relationships.items()
+            ]
+        }
 
-        commit.conditional_connect(commit.author, author)
+        node_cache = self.resources.node_cache
+        cached_variables = []
+        for variable, model in COMMIT_QUERY_NODES:
+            properties = node_properties[variable]
+            params[variable] = get_merge_params(model, properties)
+            node = node_cache.get(model, properties, update_existing=(model is User))
+            if node is not None:
+                cached_variables.append(variable)
+                params['{0}_id'.format(variable)] = node.id
 
-        repo.contributors.connect(author)
-        repo.branches.connect(branch)
-        repo.commits.connect(commit)
+        results, _ = neomodel.db.cypher_query(get_commit_query(cached_variables), params)
+        if not results and cached_variables:
+            # A cached node was deleted from Neo4j, so merge all the nodes instead
+            for variable, model in COMMIT_QUERY_NODES:
+                node_cache.invalidate(model, node_properties[variable])
+            results, _ = neomodel.db.cypher_query(get_commit_query(()), params)
 
-        branch.contributors.connect(author)
-        branch.commits.connect(commit)
+        for (variable, model), node in zip(COMMIT_QUERY_NODES, results[0]):
+            node_cache.set(
+                model, node_properties[variable], model.inflate(node),
+                update_existing=(model is User))
 
     def push_handler(self, msg):
         """
         Handle dist-git push messages by updating the parent-child relationship of commits in Neo4j.
 
+        The commits are sent as ordered parent and child pairs in chunks of
+        "estuary_updater.push_chunk_size" pairs, with one Cypher query per chunk.
+
         :param dict msg: a message to be processed
         """
-        commits = msg['body']['msg']['commits']
-        parent = DistGitCommit.get_or_create({
-            'hash_': msg['body']['msg']['oldrev']
-        })[0]
-        for commit in commits:
-            child = DistGitCommit.get_or_create({
-                'hash_': commit
-            })[0]
-            child.parent.connect(parent)
-            parent = child
+        fields = self.extract_fields(msg)
+        hashes = [fields.oldrev] + fields.commits
+        if len(hashes) == 1:
+            DistGitCommit.get_or_create({'hash_': hashes[0]})
+            return
+
+        commit_params = [get_merge_params(DistGitCommit, {'hash_': hash_}) for hash_ in hashes]
+        pairs = [
+            {'parent': parent, 'child': child}
+            for parent, child in zip(commit_params, commit_params[1:])
+        ]
+        chunk_size = self.config.get('estuary_updater.push_chunk_size', 500)
+        for i in range(0, len(pairs), chunk_size):
+            neomodel.db.cypher_query(PUSH_QUERY, {'pairs': pairs[i:i + chunk_size]})
 
     @staticmethod
     def parse_bugzilla_bugs(commit_message):
         """
         Parse the Bugzilla bugs mentioned in a a dist-git commit message.
 
+        The message is scanned once for the "Resolves:", "Related:" and "Reverted:" lines. The bug
+        references are then only looked for between the start and end positions of the rest of
+        those lines, without copying them. A bug mentioned more than once for the same relationship
+        type is only listed once.
+
         :param str commit_message: the dist-git commit message
         :rtype: dict
         :return: a dictionary with the keys resolves, related, reverted with
-            values as lists of Bugzilla IDs
+            values as lists of Bugzilla IDs in the order they are mentioned
         """
-        # Look for 'Resolves', 'Related', or 'Reverts' action Bugzilla bugs
-        bugzilla_bug_pattern = re.compile(
-            r'^(?:(reverted|resolves|related)\: *(.+))', re.IGNORECASE | re.MULTILINE)
-        matches = re.findall(bugzilla_bug_pattern, commit_message)
-
-        # Pull out the bug id numbers without their prefixes or whitespace
-        bug_ids_pattern = re.compile(r'(?:(?:bug|bz|rhbz)\s*#?|#)\s*(\d+)', re.IGNORECASE)
-
         bug_rel_mapping = {
             'resolves': [],
             'related': [],
             'reverted': []
         }
-
-        # Populate values of bug relationship type keys to their corresponding bug IDs
-        for match in matches:
-            rel_type = match[0].lower()
-            bug_rel_mapping[rel_type] += list(re.findall(bug_ids_pattern, match[1]))
+        seen_bug_ids = dict((rel_type, set()) for rel_type in bug_rel_mapping)
+        for line_match in BUGZILLA_LINE_PATTERN.finditer(commit_message):
+            rel_type = line_match.group(1).lower()
+            for bug_id in BUGZILLA_ID_PATTERN.findall(
+                    commit_message, line_match.start(2), line_match.end(2)):
+                # Skip the duplicate bug IDs so that a bug isn't linked several times
+                if bug_id not in seen_bug_ids[rel_type]:
+                    seen_bug_ids[rel_type].add(bug_id)
+                    bug_rel_mapping[rel_type].append(bug_id)
 
         return bug_rel_mapping
+
+    @classmethod
+    def parse_bugzilla_bugs_batch(cls, commit_messages):
+        """
+        Parse the Bugzilla bugs mentioned in many dist-git commit messages, such as for a backfill.
+
+        Identical commit messages, such as the ones of a commit cherry-picked to several branches,
+        are only parsed once.
+
+        :param iterable commit_messages: the dist-git commit messages
+        :rtype: list
+        :return: the dictionaries returned by parse_bugzilla_bugs in the same order as the commit
+            messages. Identical commit messages share the same dictionary.
+        """
+        parsed = {}
+        results = []
+        for commit_message in commit_messages:
+            bug_rel_mapping = parsed.get(commit_message)
+            if bug_rel_mapping is None:
+                bug_rel_mapping = parsed[commit_message] = cls.parse_bugzilla_bugs(commit_message)
+            results.append(bug_rel_mapping)
+        return results
@@ -3,57 +3,59 @@
 from __future__ import unicode_literals, absolute_import
 
 from estuary.models.errata import Advisory, ContainerAdvisory
-from estuary.models.bugzilla import BugzillaBug
 from estuary.models.user import User
-from estuary.utils.general import timestamp_to_datetime
-import requests
-import requests_kerberos
 import neomodel
 
 from estuary_updater.handlers.base import BaseHandler
+from estuary_updater.schemas import Field, Schema, string_types
+from estuary_updater.timestamps import parse_timestamp, parse_timestamps
+from estuary_updater import tracing
+
+
+# The fields of an advisory created or status changed message
+ADVISORY_SCHEMA = Schema('ErrataAdvisoryMessage', [
+    Field('advisory_id', 'body.headers.errata_id'),
+    Field('type', 'body.headers.type', string_types),
+    Field('synopsis', 'body.headers.synopsis', string_types),
+    Field('product', 'body.msg.product', string_types)
+])
+# The fields of a builds added message
+BUILDS_ADDED_SCHEMA = Schema('ErrataBuildsAddedMessage', [
+    Field('advisory_id', 'body.headers.errata_id'),
+    Field('nvr', 'body.headers.brew_build', string_types),
+    Field('when', 'body.headers.when', string_types)
+])
+# The fields of a builds removed message
+BUILDS_REMOVED_SCHEMA = Schema('ErrataBuildsRemovedMessage', [
+    Field('advisory_id', 'body.headers.errata_id'),
+    Field('nvr', 'body.headers.brew_build', string_types)
+])
 
 
 class ErrataHandler(BaseHandler):
     """A handler for dist-git related messages."""
 
-    @staticmethod
-    def can_handle(msg):
+    topic_to_method = {
+        '/topic/VirtualTopic.eng.errata.activity.status': 'advisory_handler',
+        '/topic/VirtualTopic.eng.errata.activity.created': 'advisory_handler',
+        '/topic/VirtualTopic.eng.errata.builds.added': 'builds_added_handler',
+        '/topic/VirtualTopic.eng.errata.builds.removed': 'builds_removed_handler'
+    }
+    schemas = {
+        'advisory_handler': ADVISORY_SCHEMA,
+        'builds_added_handler': BUILDS_ADDED_SCHEMA,
+        'builds_removed_handler': BUILDS_REMOVED_SCHEMA
+    }
+
+    def get_ordering_key(self, msg):
         """
-        Determine if this handler can handle this message.
-
-        :param dict msg: a message to be analyzed
-        :return: a bool based on if the handler can handle this kind of message
-        :rtype: bool
-        """
-        supported_topics = [
-            '/topic/VirtualTopic.eng.errata.activity.status',
-            '/topic/VirtualTopic.eng.errata.activity.created',
-            '/topic/VirtualTopic.eng.errata.builds.added',
-            '/topic/VirtualTopic.eng.errata.builds.removed'
-        ]
-        return msg['topic'] in supported_topics
-
-    def handle(self, msg):
-        """
-        Handle an Errata tool message and update Neo4j if necessary.
+        Get the advisory ID of the message so that messages about an advisory stay in order.
 
         :param dict msg: a message to be processed
+        :return: a tuple with the handler name and the advisory ID
+        :rtype: tuple
         """
-        topic = msg['topic']
-
-        advisory_topics = [
-            '/topic/VirtualTopic.eng.errata.activity.status',
-            '/topic/VirtualTopic.eng.errata.activity.created'
-        ]
-
-        if topic in advisory_topics:
-            self.advisory_handler(msg)
-        elif topic == '/topic/VirtualTopic.eng.errata.builds.added':
-            self.builds_added_handler(msg)
-        elif topic == '/topic/VirtualTopic.eng.errata.builds.removed':
-            self.builds_removed_handler(msg)
-        else:
-            raise RuntimeError('This message is unable to be handled: {0}'.format(msg))
+        return ('errata', msg['body']['headers']['errata_id'])
 
     def advisory_handler(self, msg):
         """
@@ -61,68 +63,69 @@ class ErrataHandler(BaseHandler):
 
         :param dict msg: a message to be processed
         """
-        advisory_id = msg['body']['headers']['errata_id']
+        fields = self.extract_fields(msg)
+        advisory_id = fields.advisory_id
 
-        erratum_url = '{0}/api/v1/erratum/{1}'.format(
-            self.config['estuary_updater.errata_url'].rstrip('/'), advisory_id)
-        response = requests.get(erratum_url, auth=requests_kerberos.HTTPKerberosAuth(), timeout=10)
-        advisory_json = response.json()
+        errata_client = self.resources.errata_client
+        advisory_json = errata_client.get_erratum(advisory_id)
 
-        advisory_type = msg['body']['headers']['type'].lower()
+        advisory_type = fields.type.lower()
         advisory_info = advisory_json['errata'][advisory_type]
 
-        embargoed = msg['body']['headers']['synopsis'] == 'REDACTED'
+        embargoed = fields.synopsis == 'REDACTED'
         # We can't store information on embargoed advisories other than the ID
         if not embargoed:
-            product_url = '{0}/products/{1}.json'.format(
-                self.config['estuary_updater.errata_url'].rstrip('/'),
-                advisory_info['product_id']
-            )
-            response = requests.get(
-                product_url, auth=requests_kerberos.HTTPKerberosAuth(), timeout=10)
-            product_json = response.json()
-
-            reporter_url = '{0}/api/v1/user/{1}'.format(
-                self.config['estuary_updater.errata_url'].rstrip('/'), advisory_info['reporter_id'])
-            response = requests.get(
-                reporter_url, auth=requests_kerberos.HTTPKerberosAuth(), timeout=10)
-            reporter_json = response.json()
-
-            reporter = User.create_or_update({
+            # The lookups don't depend on each other, so they are made concurrently and the users
+            # are stored while the remaining requests are in flight
+            executor = self.resources.executor
+            node_cache = self.resources.node_cache
+            get_product = tracing.bind(errata_client.get_product)
+            get_user = tracing.bind(errata_client.get_user)
+            product_future = executor.submit(get_product, advisory_info['product_id'])
+            reporter_future = executor.submit(get_user, advisory_info['reporter_id'])
+            if advisory_info['assigned_to_id'] == advisory_info['reporter_id']:
+                assigned_to_future = reporter_future
+            else:
+                assigned_to_future = executor.submit(get_user, advisory_info['assigned_to_id'])
+
+            reporter_json = reporter_future.result()
+            reporter = node_cache.create_or_update(User, {
                 'username': reporter_json['login_name'].split('@')[0],
                 'email': reporter_json['email_address']
-            })[0]
+            })
 
-            assigned_to_url = '{0}/api/v1/user/{1}'.format(
-                self.config['estuary_updater.errata_url'].rstrip('/'),
-                advisory_info['assigned_to_id'])
-            response = requests.get(
-                assigned_to_url, auth=requests_kerberos.HTTPKerberosAuth(), timeout=10)
-            assigned_to_json = response.json()
-
-            assigned_to = User.create_or_update({
+            assigned_to_json = assigned_to_future.result()
+            assigned_to = node_cache.create_or_update(User, {
                 'username': assigned_to_json['login_name'].split('@')[0],
                 'email': assigned_to_json['email_address']
-            })[0]
+            })
+
+            product_json = product_future.result()
 
             advisory_params = {
                 'advisory_name': advisory_info['fulladvisory'],
                 'content_types': advisory_info['content_types'],
                 'id_': advisory_id,
                 'product_name': product_json['product']['name'],
-                'product_short_name': msg['body']['msg']['product'],
+                'product_short_name': fields.product,
                 'security_impact': advisory_info['security_impact'],
                 'state': advisory_info['status'],
-                'synopsis': msg['body']['headers']['synopsis']
+                'synopsis': fields.synopsis
             }
-            for dt in ('actual_ship_date', 'created_at', 'issue_date', 'release_date',
-                       'security_sla', 'status_updated_at', 'update_date'):
-                if advisory_info[dt]:
-                    if dt == 'status_updated_at':
-                        estuary_key = 'status_time'
-                    else:
-                        estuary_key = dt
-                    advisory_params[estuary_key] = timestamp_to_datetime(advisory_info[dt])
+            date_keys = [
+                dt for dt in ('actual_ship_date', 'created_at', 'issue_date', 'release_date',
+                              'security_sla', 'status_updated_at', 'update_date')
+                if advisory_info[dt]
+            ]
+            # The dates are often the same, such as the creation, issue and update dates of a new
+            # advisory, so they are parsed together
+            parsed_dates = parse_timestamps(advisory_info[dt] for dt in date_keys)
+            for dt, parsed_date in zip(date_keys, parsed_dates):
+                if dt == 'status_updated_at':
+                    estuary_key = 'status_time'
+                else:
+                    estuary_key = dt
+                advisory_params[estuary_key] = parsed_date
         else:
             advisory_params = {
                 'id_': advisory_id,
@@ -156,10 +159,8 @@ class ErrataHandler(BaseHandler):
             advisory.conditional_connect(advisory.assigned_to, assigned_to)
 
             bugs = advisory_json['bugs']['bugs']
-
-            for bug in bugs:
-                bug = BugzillaBug.get_or_create({'id_': bug['bug']['id']})[0]
-                advisory.attached_bugs.connect(bug)
+            self.connect_bugzilla_bugs(
+                advisory, 'attached_bugs', [bug['bug']['id'] for bug in bugs])
 
     def builds_added_handler(self, msg):
         """
@@ -167,21 +168,19 @@ class ErrataHandler(BaseHandler):
 
         :param dict msg: a message to be processed
         """
-        embargoed = msg['body']['headers']['brew_build'] == 'REDACTED'
+        fields = self.extract_fields(msg)
+        embargoed = fields.nvr == 'REDACTED'
         # We can't store information on embargoed advisories other than the ID
         if embargoed:
             return
         advisory = Advisory.get_or_create({
-            'id_': msg['body']['headers']['errata_id']
+            'id_': fields.advisory_id
         })[0]
 
-        nvr = msg['body']['headers']['brew_build']
-        koji_build = self.get_or_create_build(nvr)
+        koji_build = self.get_or_create_build(fields.nvr)
 
-        time_attached_string = msg['body']['headers']['when']
-        if time_attached_string.endswith(' UTC'):
-            time_attached_string = time_attached_string[:-4]
-        time_attached = timestamp_to_datetime(time_attached_string)
+        # The parser handles the " UTC" suffix of the timestamp
+        time_attached = parse_timestamp(fields.when)
 
         attached_rel = advisory.attached_builds.relationship(koji_build)
         if attached_rel:
@@ -196,15 +195,15 @@ class ErrataHandler(BaseHandler):
 
         :param dict msg: a message to be processed
         """
-        embargoed = msg['body']['headers']['brew_build'] == 'REDACTED'
+        fields = self.extract_fields(msg)
+        embargoed = fields.nvr == 'REDACTED'
         # We can't store information on embargoed advisories other than the ID
         if embargoed:
             return
         advisory = Advisory.get_or_create({
-            'id_': msg['body']['headers']['errata_id']
+            'id_': fields.advisory_id
         })[0]
 
-        nvr = msg['body']['headers']['brew_build']
-        koji_build = self.get_or_create_build(nvr)
+        koji_build = self.get_or_create_build(fields.nvr)
 
         advisory.attached_builds.disconnect(koji_build)
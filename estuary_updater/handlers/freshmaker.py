@@ -4,45 +4,83 @@ from __future__ import unicode_literals, absolute_import
 
 from estuary.models.freshmaker import FreshmakerEvent, FreshmakerBuild
 from estuary.models.errata import Advisory
-from estuary.utils.general import timestamp_to_datetime
 
 from estuary_updater.handlers.base import BaseHandler
+from estuary_updater.schemas import Field, Schema, integer_types, string_types
+from estuary_updater.timestamps import parse_timestamp
 from estuary_updater import log
 
 
+# The fields of an event state changed message
+EVENT_STATE_SCHEMA = Schema('FreshmakerEventMessage', [
+    Field('id', 'body.msg.id', integer_types),
+    Field('event_type_id', 'body.msg.event_type_id'),
+    Field('message_id', 'body.msg.message_id', string_types),
+    Field('search_key', 'body.msg.search_key'),
+    Field('state', 'body.msg.state'),
+    Field('state_name', 'body.msg.state_name'),
+    Field('state_reason', 'body.msg.state_reason'),
+    Field('time_created', 'body.msg.time_created', string_types, required=False, nullable=True),
+    Field('time_done', 'body.msg.time_done', string_types, required=False, nullable=True)
+])
+# The fields of a build state changed message
+BUILD_STATE_SCHEMA = Schema('FreshmakerBuildMessage', [
+    Field('id', 'body.msg.id', integer_types),
+    Field('event_id', 'body.msg.event_id', integer_types),
+    # The build ID in Freshmaker is actually the Koji task ID
+    Field('build_id', 'body.msg.build_id', integer_types, nullable=True),
+    Field('dep_on', 'body.msg.dep_on'),
+    Field('name', 'body.msg.name'),
+    Field('original_nvr', 'body.msg.original_nvr'),
+    Field('rebuilt_nvr', 'body.msg.rebuilt_nvr'),
+    Field('state', 'body.msg.state', integer_types),
+    Field('state_name', 'body.msg.state_name'),
+    Field('state_reason', 'body.msg.state_reason'),
+    Field('time_submitted', 'body.msg.time_submitted', string_types),
+    Field('time_completed', 'body.msg.time_completed', string_types, nullable=True),
+    Field('type', 'body.msg.type'),
+    Field('type_name', 'body.msg.type_name'),
+    Field('url', 'body.msg.url')
+])
+
+
 class FreshmakerHandler(BaseHandler):
     """A handler for Freshmaker-related messages."""
 
-    @staticmethod
-    def can_handle(msg):
-        """
-        Determine if the message is a Freshmaker-related message and can be handled by this handler.
+    topic_to_method = {
+        '/topic/VirtualTopic.eng.freshmaker.event.state.changed': 'event_state_handler',
+        '/topic/VirtualTopic.eng.freshmaker.build.state.changed': 'build_state_handler'
+    }
+    schemas = {
+        'event_state_handler': EVENT_STATE_SCHEMA,
+        'build_state_handler': BUILD_STATE_SCHEMA
+    }
 
-        :param dict msg: a message to be analyzed
-        :return: a bool based on if the handler can handle this kind of message
-        :rtype: bool
+    def get_ordering_key(self, msg):
         """
-        supported_topics = [
-            '/topic/VirtualTopic.eng.freshmaker.event.state.changed',
-            '/topic/VirtualTopic.eng.freshmaker.build.state.changed'
-        ]
+        Get the Freshmaker event ID of the message.
+
+        The builds of an event are connected to the event node, so they are ordered by the event.
 
-        return msg['topic'] in supported_topics
+        :param dict msg: a message to be processed
+        :return: a tuple with the handler name and the event ID
+        :rtype: tuple
+        """
+        if msg['topic'] == '/topic/VirtualTopic.eng.freshmaker.build.state.changed':
+            return ('freshmaker', msg['body']['msg']['event_id'])
+        return ('freshmaker', msg['body']['msg']['id'])
 
-    def handle(self, msg):
+    def get_coalesce_key(self, msg):
         """
-        Handle a Freshmaker message and update Neo4j if necessary.
+        Get the Freshmaker event or build ID of the message.
 
         :param dict msg: a message to be processed
+        :return: a tuple with the message type and the ID
+        :rtype: tuple
         """
-        topic = msg['topic']
-
-        if topic == '/topic/VirtualTopic.eng.freshmaker.event.state.changed':
-            self.event_state_handler(msg)
-        elif topic == '/topic/VirtualTopic.eng.freshmaker.build.state.changed':
-            self.build_state_handler(msg)
-        else:
-            raise RuntimeError('This message is unable to be handled: {0}'.format(msg))
+        if msg['topic'] == '/topic/VirtualTopic.eng.freshmaker.build.state.changed':
+            return ('freshmaker_build', msg['body']['msg']['id'])
+        return ('freshmaker_event', msg['body']['msg']['id'])
 
     def event_state_handler(self, msg):
         """
@@ -50,20 +88,21 @@ class FreshmakerHandler(BaseHandler):
 
         :param dict msg: a message to be processed
         """
-        msg_id = msg['body']['msg']['message_id']
+        fields = self.extract_fields(msg)
+        msg_id = fields.message_id
         event_params = {
-            'id_': str(msg['body']['msg']['id']),
-            'event_type_id': msg['body']['msg']['event_type_id'],
+            'id_': str(fields.id),
+            'event_type_id': fields.event_type_id,
             'message_id': msg_id,
-            'state': msg['body']['msg']['state'],
-            'state_name': msg['body']['msg']['state_name'],
-            'state_reason': msg['body']['msg']['state_reason']
+            'state': fields.state,
+            'state_name': fields.state_name,
+            'state_reason': fields.state_reason
         }
 
-        if 'time_created' in msg['body']['msg']:
-            event_params['time_created'] = timestamp_to_datetime(msg['body']['msg']['time_created'])
-        if 'time_done' in msg['body']['msg'] and msg['body']['msg']['time_done'] is not None:
-            event_params['time_done'] = timestamp_to_datetime(msg['body']['msg']['time_done'])
+        if fields.time_created is not None:
+            event_params['time_created'] = parse_timestamp(fields.time_created)
+        if fields.time_done is not None:
+            event_params['time_done'] = parse_timestamp(fields.time_done)
 
         event = FreshmakerEvent.create_or_update(event_params)[0]
 
@@ -73,7 +112,7 @@ class FreshmakerHandler(BaseHandler):
                      .format(msg_id))
             advisory_name = None
         advisory = Advisory.get_or_create({
-            'id_': msg['body']['msg']['search_key'],
+            'id_': fields.search_key,
             'advisory_name': advisory_name
         })[0]
 
@@ -85,17 +124,17 @@ class FreshmakerHandler(BaseHandler):
 
         :param dict msg: a message to be processed
         """
-        build_info = msg['body']['msg']
-        event_id = msg['body']['msg']['event_id']
+        build_info = self.extract_fields(msg)
+        event_id = build_info.event_id
         freshmaker_build = None
         build = None
         # build_id in Freshmaker is actually the task_id
-        if not build_info['build_id']:
+        if not build_info.build_id:
             log.debug('Skipping Koji build update for event {0} because build_id is not set'.format(
                 event_id))
             freshmaker_build = self.create_or_update_freshmaker_build(build_info, event_id)
         # Ignore Freshmaker dry run mode, indicated by a negative ID
-        elif build_info['build_id'] < 0:
+        elif build_info.build_id < 0:
             log.debug('Skipping build update for event {0} because it is a dry run'.format(
                 event_id))
         else:
@@ -114,59 +153,58 @@ class FreshmakerHandler(BaseHandler):
         """
         Create or update a FreshmakerBuild.
 
-        :param dict build: the build represented in Freshmaker being created or updated
+        :param Record build: the fields of the build state changed message of the build
         :param int event_id: the id of the Freshmaker event
         :return: the created/updated FreshmakerBuild or None if it cannot be created
         :rtype: FreshmakerBuild or None
         """
-        log.debug('Creating FreshmakerBuild {0}'.format(build['build_id']))
+        log.debug('Creating FreshmakerBuild {0}'.format(build.build_id))
         fb_params = dict(
-            id_=build['id'],
-            build_id=build['build_id'],
-            dep_on=build['dep_on'],
-            name=build['name'],
-            original_nvr=build['original_nvr'],
-            rebuilt_nvr=build['rebuilt_nvr'],
-            state=build['state'],
-            state_name=build['state_name'],
-            state_reason=build['state_reason'],
-            time_submitted=timestamp_to_datetime(build['time_submitted']),
-            type_=build['type'],
-            type_name=build['type_name'],
-            url=build['url']
+            id_=build.id,
+            build_id=build.build_id,
+            dep_on=build.dep_on,
+            name=build.name,
+            original_nvr=build.original_nvr,
+            rebuilt_nvr=build.rebuilt_nvr,
+            state=build.state,
+            state_name=build.state_name,
+            state_reason=build.state_reason,
+            time_submitted=parse_timestamp(build.time_submitted),
+            type_=build.type,
+            type_name=build.type_name,
+            url=build.url
         )
-        if build['time_completed']:
-            fb_params['time_completed'] = timestamp_to_datetime(
-                build['time_completed'])
+        if build.time_completed:
+            fb_params['time_completed'] = parse_timestamp(build.time_completed)
         return FreshmakerBuild.create_or_update(fb_params)[0]
 
     def create_or_update_build(self, build, event_id):
         """
         Use the Koji Task Result to create or update a ContainerKojiBuild.
 
-        :param dict build: the build represented in Freshmaker being created or updated
+        :param Record build: the fields of the build state changed message of the build
         :param int event_id: the id of the Freshmaker event
         :return: the created/updated ContainerKojiBuild or None if it cannot be created
         :rtype: ContainerKojiBuild or None
         """
         # Builds in Koji only exist when the Koji task this Freshmaker build represents completes
-        if build['state'] != 1:
+        if build.state != 1:
             log.debug('Skipping build update for event {0} because the build is not complete yet'
                       .format(event_id))
             return None
         try:
-            koji_task_result = self.koji_session.getTaskResult(build['build_id'])
+            koji_task_result = self.get_koji_task_result(build.build_id)
         except Exception:
-            log.error('Failed to get the Koji task result with ID {0}'.format(build['build_id']))
+            log.error('Failed to get the Koji task result with ID {0}'.format(build.build_id))
             raise
 
         if not koji_task_result.get('koji_builds'):
             log.warn('The task result of {0} does not contain the koji_builds key'.format(
-                build['build_id']))
+                build.build_id))
             return None
         # The ID is returned as a string so it must be cast to an int
         koji_build_id = int(koji_task_result['koji_builds'][0])
         # It's always going to be a container build when the build comes from Freshmaker, so we can
         # just set force_container_label to avoid unncessary heuristic checks
         return self.get_or_create_build(
-            koji_build_id, build['original_nvr'], force_container_label=True)
+            koji_build_id, build.original_nvr, force_container_label=True)
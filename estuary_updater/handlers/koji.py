@@ -6,56 +6,99 @@ import re
 
 from estuary.models.koji import KojiBuild, KojiTag, ModuleKojiBuild
 from estuary.models.distgit import DistGitCommit
+from estuary.models.user import User
+import neomodel
 
 from estuary_updater.handlers.base import BaseHandler
-from estuary_updater import log
+from estuary_updater.cypher import (
+    get_merge_params, merge_node_clause, merge_relationship_clause, conditional_connect_clause)
+from estuary_updater.schemas import Field, Schema, integer_types, string_types
+from estuary_updater import log, tracing
+
+
+# The fields of a build state message
+BUILD_SCHEMA = Schema('KojiBuildMessage', [
+    Field('info', 'body.msg.info', dict),
+    Field('build_id', 'body.msg.info.id', integer_types),
+    Field('source', 'body.msg.info.source', string_types, nullable=True),
+    Field('extra', 'body.msg.info.extra', dict, required=False, nullable=True)
+])
+# The fields of a build tag or untag message
+BUILD_TAG_SCHEMA = Schema('KojiBuildTagMessage', [
+    Field('topic', 'topic', string_types),
+    Field('build_id', 'body.msg.build.id', integer_types),
+    Field('tag_id', 'body.msg.tag.id', integer_types),
+    Field('tag_name', 'body.msg.tag.name', string_types)
+])
+# The commit hash at the end of the source URL of a build
+COMMIT_HASH_PATTERN = re.compile(r'(?:\#)([0-9a-f]{40})$')
+
+
+def _build_components_query():
+    """
+    Build the Cypher query used to store the component builds of a module build.
+
+    :return: the Cypher query
+    :rtype: str
+    """
+    return ''.join([
+        'MATCH (module) WHERE id(module) = $module_id\n',
+        'UNWIND $components AS component\n',
+        merge_node_clause(KojiBuild, 'build', 'component.build', update_existing=True),
+        merge_node_clause(User, 'owner', 'component.owner', update_existing=True),
+        conditional_connect_clause(
+            KojiBuild, 'owner', 'build', 'owner', ['module', 'build', 'owner']),
+        merge_relationship_clause(ModuleKojiBuild, 'components', 'module', 'build')
+    ])
+
+
+COMPONENTS_QUERY = _build_components_query()
 
 
 class KojiHandler(BaseHandler):
     """A handler for Koji related messages."""
 
-    @staticmethod
-    def can_handle(msg):
+    topic_to_method = {
+        '/topic/VirtualTopic.eng.brew.build.complete': 'build_handler',
+        '/topic/VirtualTopic.eng.brew.build.building': 'build_handler',
+        '/topic/VirtualTopic.eng.brew.build.failed': 'build_handler',
+        '/topic/VirtualTopic.eng.brew.build.canceled': 'build_handler',
+        '/topic/VirtualTopic.eng.brew.build.deleted': 'build_handler',
+        '/topic/VirtualTopic.eng.brew.build.tag': 'build_tag_handler',
+        '/topic/VirtualTopic.eng.brew.build.untag': 'build_tag_handler'
+    }
+    schemas = {
+        'build_handler': BUILD_SCHEMA,
+        'build_tag_handler': BUILD_TAG_SCHEMA
+    }
+
+    def get_ordering_key(self, msg):
         """
-        Determine if this handler can handle this message.
+        Get the Koji build ID of the message so that messages about a build stay in order.
 
-        :param dict msg: a message to be analyzed
-        :return: a bool based on if the handler can handle this kind of message
-        :rtype: bool
+        :param dict msg: a message to be processed
+        :return: a tuple with the handler name and the build ID
+        :rtype: tuple
         """
-        supported_topics = [
-            '/topic/VirtualTopic.eng.brew.build.complete',
-            '/topic/VirtualTopic.eng.brew.build.building',
-            '/topic/VirtualTopic.eng.brew.build.failed',
-            '/topic/VirtualTopic.eng.brew.build.canceled',
-            '/topic/VirtualTopic.eng.brew.build.deleted',
-            '/topic/VirtualTopic.eng.brew.build.tag',
-            '/topic/VirtualTopic.eng.brew.build.untag'
-        ]
-        return msg['topic'] in supported_topics
-
-    def handle(self, msg):
+        if msg['topic'] in ('/topic/VirtualTopic.eng.brew.build.tag',
+                            '/topic/VirtualTopic.eng.brew.build.untag'):
+            return ('koji', msg['body']['msg']['build']['id'])
+        return ('koji', msg['body']['msg']['info']['id'])
+
+    def get_coalesce_key(self, msg):
         """
-        Handle a message and update Neo4j if necessary.
+        Get the Koji build ID of a build state message.
+
+        The newest state message of a build contains everything that is stored about it, while tag
+        messages are never coalesced since each of them adds or removes a different tag.
 
         :param dict msg: a message to be processed
+        :return: a tuple with the message type and the build ID or None
+        :rtype: tuple or None
         """
-        topic = msg['topic']
-
-        build_topic = ['/topic/VirtualTopic.eng.brew.build.complete',
-                       '/topic/VirtualTopic.eng.brew.build.building',
-                       '/topic/VirtualTopic.eng.brew.build.failed',
-                       '/topic/VirtualTopic.eng.brew.build.canceled',
-                       '/topic/VirtualTopic.eng.brew.build.deleted']
-        tag_topic = ['/topic/VirtualTopic.eng.brew.build.tag',
-                     '/topic/VirtualTopic.eng.brew.build.untag']
-
-        if topic in build_topic:
-            self.build_handler(msg)
-        elif topic in tag_topic:
-            self.build_tag_handler(msg)
-        else:
-            raise RuntimeError('This message is unable to be handled: {0}'.format(msg))
+        if self.topic_to_method.get(msg['topic']) == 'build_handler':
+            return ('koji_build', msg['body']['msg']['info']['id'])
+        return None
 
     def build_handler(self, msg):
         """
@@ -63,39 +106,39 @@ class KojiHandler(BaseHandler):
 
         :param dict msg: a message to be processed
         """
-        if not msg['body']['msg']['info']['source']:
+        fields = self.extract_fields(msg)
+        # The state of the build changed, so any cached copy of it is outdated
+        self.invalidate_koji_build(fields.info)
+        if not fields.source:
             return
-        commit_hash_pattern = re.compile(r'(?:\#)([0-9a-f]{40})$')
-        commit_hash = re.findall(commit_hash_pattern, msg['body']['msg']['info']['source'])
+        commit_hash = COMMIT_HASH_PATTERN.findall(fields.source)
 
         # Container builds and rpms have commit hashes, so we want to process them
         if commit_hash:
             commit = DistGitCommit.get_or_create({
                 'hash_': commit_hash[0]
             })[0]
-            build = self.get_or_create_build(msg['body']['msg']['info']['id'])
+            build = self.get_or_create_build(fields.build_id)
 
             if build.__label__ == ModuleKojiBuild.__label__:
-                extra_json = msg['body']['msg']['info']['extra']
-                module_extra_info = extra_json.get('typeinfo', {}).get('module')
+                module_extra_info = fields.extra.get('typeinfo', {}).get('module')
                 module_build_tag_name = module_extra_info.get('content_koji_tag')
                 if module_build_tag_name:
                     try:
-                        tag_info = self.koji_session.getTag(module_build_tag_name)
+                        tag_info = self.get_koji_tag(module_build_tag_name)
                     except Exception:
                         log.error('Failed to get tag {0}'.format(module_build_tag_name))
                         raise
-                    module_build_tag = KojiTag.create_or_update({
+                    module_build_tag = self.resources.node_cache.create_or_update(KojiTag, {
                         'id_': tag_info['id'],
                         'name': module_build_tag_name
-                    })[0]
+                    })
 
                     module_build_tag.module_builds.connect(build)
 
-                    _, components = self.koji_session.listTaggedRPMS(module_build_tag_name)
-                    for component in components:
-                        component_build = self.get_or_create_build(component)
-                        build.components.connect(component_build)
+                    with tracing.span('koji.listTaggedRPMS', tag=module_build_tag_name):
+                        _, components = self.koji_session.listTaggedRPMS(module_build_tag_name)
+                    self.create_or_update_components(build, self.get_component_builds(components))
 
             build.conditional_connect(build.commit, commit)
 
@@ -105,16 +148,86 @@ class KojiHandler(BaseHandler):
 
         :param dict msg: a message to be processed
         """
-        build = KojiBuild.nodes.get_or_none(id_=msg['body']['msg']['build']['id'])
+        fields = self.extract_fields(msg)
+        build = KojiBuild.nodes.get_or_none(id_=fields.build_id)
         # Check to see if we want to process this tag
         if not build:
             return
-        tag = KojiTag.create_or_update({
-            'id_': msg['body']['msg']['tag']['id'],
-            'name': msg['body']['msg']['tag']['name']
-        })[0]
+        tag = self.resources.node_cache.create_or_update(KojiTag, {
+            'id_': fields.tag_id,
+            'name': fields.tag_name
+        })
 
-        if msg['topic'] == '/topic/VirtualTopic.eng.brew.build.tag':
+        if fields.topic == '/topic/VirtualTopic.eng.brew.build.tag':
             tag.builds.connect(build)
         else:
             tag.builds.disconnect(build)
+
+    def get_component_builds(self, components):
+        """
+        Get the build info of the components of a module build.
+
+        The builds returned by listTaggedRPMS are used as is when they have everything needed to
+        store them. Otherwise, their build info is taken from the shared cache or retrieved with
+        Koji multicalls of up to "estuary_updater.koji_batch_size" builds each.
+
+        :param list components: the builds returned by listTaggedRPMS
+        :return: the build info of the components
+        :rtype: list
+        """
+        builds = []
+        missing_build_ids = []
+        for component in components:
+            if all(key in component for key in self.build_info_keys):
+                builds.append(component)
+                continue
+            cached_build = self.resources.koji_cache.get(('build', component['id']))
+            if cached_build is None:
+                missing_build_ids.append(component['id'])
+            else:
+                builds.append(cached_build)
+
+        batch_size = self.config.get('estuary_updater.koji_batch_size', 100)
+        for i in range(0, len(missing_build_ids), batch_size):
+            args_list = [(build_id, True) for build_id in missing_build_ids[i:i + batch_size]]
+            try:
+                component_builds = self.koji_multicall('getBuild', args_list)
+            except Exception:
+                log.error('Failed to get the component builds {0}'.format(
+                    ', '.join(str(args[0]) for args in args_list)))
+                raise
+            for component_build in component_builds:
+                self.cache_koji_build(component_build)
+            builds += component_builds
+
+        return builds
+
+    def create_or_update_components(self, build, components):
+        """
+        Create or update the component builds of a module build and connect them to it.
+
+        The components are stored along with their owners in a single Cypher query.
+
+        :param ModuleKojiBuild build: the module build
+        :param list components: the build info of the components from the Koji API
+        """
+        components_params = []
+        for component in components:
+            build_model, build_params, owner_params = self.get_build_params(component)
+            if build_model is KojiBuild:
+                components_params.append({
+                    'build': get_merge_params(KojiBuild, build_params),
+                    'owner': get_merge_params(User, owner_params)
+                })
+            else:
+                # Module components are RPM builds, but fall back to the handling of special
+                # build types just in case
+                build.components.connect(self.get_or_create_build(component))
+
+        if components_params:
+            neomodel.db.cypher_query(
+                COMPONENTS_QUERY, {'module_id': build.id, 'components': components_params})
+            # The components were written without get_or_create_build, so their fingerprints are
+            # outdated
+            self.resources.node_cache.invalidate_fingerprinted(*(
+                ('koji_build', component['id']) for component in components))
@@ -0,0 +1,426 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals, absolute_import
+
+import abc
+from contextlib import contextmanager
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+from estuary_updater import ABC, log
+
+
+# The default upper bounds of the histogram buckets in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(labels):
+    """
+    Format labels in the Prometheus text format.
+
+    :param dict labels: the label names and values
+    :return: the formatted labels, which is empty if there are no labels
+    :rtype: str
+    """
+    if not labels:
+        return ''
+    pairs = []
+    for name, value in sorted(labels.items()):
+        value = '{0}'.format(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+        pairs.append('{0}="{1}"'.format(name, value))
+    return '{{{0}}}'.format(','.join(pairs))
+
+
+def _format_value(value):
+    """
+    Format a sample value in the Prometheus text format.
+
+    :param float value: the value
+    :return: the formatted value
+    :rtype: str
+    """
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Metric(ABC):
+    """The base class of metrics whose samples are labeled by the same label names."""
+
+    metric_type = None
+
+    def __init__(self, name, description, label_names=()):
+        """
+        Initialize the metric.
+
+        :param str name: the name of the metric
+        :param str description: the help text of the metric
+        :kwarg tuple label_names: the names of the labels of the samples
+        """
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _get_key(self, labels):
+        """
+        Get the values of the labels in the order of the label names.
+
+        :param dict labels: the label names and values
+        :return: the label values
+        :rtype: tuple
+        """
+        return tuple(labels[name] for name in self.label_names)
+
+    @abc.abstractmethod
+    def collect(self):
+        """
+        Get the samples of the metric.
+
+        :return: a list of tuples with the sample name, labels and value
+        :rtype: list
+        """
+        pass
+
+
+class Counter(Metric):
+    """A value that only goes up, such as the number of processed messages."""
+
+    metric_type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        """
+        Increment the counter.
+
+        :kwarg float amount: the amount to add
+        :param labels: the label values of the sample
+        """
+        key = self._get_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        """
+        Get the value of the counter.
+
+        :param labels: the label values of the sample
+        :return: the value
+        :rtype: float
+        """
+        return self._values.get(self._get_key(labels), 0)
+
+    def collect(self):
+        """
+        Get the samples of the counter.
+
+        :return: a list of tuples with the sample name, labels and value
+        :rtype: list
+        """
+        with self._lock:
+            return [
+                (self.name, dict(zip(self.label_names, key)), value)
+                for key, value in sorted(self._values.items())
+            ]
+
+
+class Gauge(Counter):
+    """A value that can go up and down, such as the age of the last message."""
+
+    metric_type = 'gauge'
+
+    def set(self, value, **labels):
+        """
+        Set the value of the gauge.
+
+        :param float value: the value
+        :param labels: the label values of the sample
+        """
+        with self._lock:
+            self._values[self._get_key(labels)] = value
+
+
+class Histogram(Metric):
+    """The distribution of observed values, such as the handler latency."""
+
+    metric_type = 'histogram'
+
+    def __init__(self, name, description, label_names=(), buckets=DEFAULT_BUCKETS):
+        """
+        Initialize the histogram.
+
+        :param str name: the name of the metric
+        :param str description: the help text of the metric
+        :kwarg tuple label_names: the names of the labels of the samples
+        :kwarg tuple buckets: the upper bounds of the buckets in ascending order
+        """
+        super(Histogram, self).__init__(name, description, label_names)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        """
+        Record an observed value.
+
+        :param float value: the value
+        :param labels: the label values of the sample
+        """
+        key = self._get_key(labels)
+        with self._lock:
+            if key not in self._values:
+                self._values[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            values = self._values[key]
+            for index, upper_bound in enumerate(self.buckets):
+                if value <= upper_bound:
+                    values['buckets'][index] += 1
+                    break
+            values['sum'] += value
+            values['count'] += 1
+
+    def collect(self):
+        """
+        Get the cumulative bucket, sum and count samples of the histogram.
+
+        :return: a list of tuples with the sample name, labels and value
+        :rtype: list
+        """
+        samples = []
+        with self._lock:
+            for key, values in sorted(self._values.items()):
+                labels = dict(zip(self.label_names, key))
+                cumulative = 0
+                for upper_bound, count in zip(self.buckets, values['buckets']):
+                    cumulative += count
+                    bucket_labels = dict(labels, le=_format_value(upper_bound))
+                    samples.append((self.name + '_bucket', bucket_labels, cumulative))
+                samples.append((self.name + '_sum', labels, values['sum']))
+                samples.append((self.name + '_count', labels, values['count']))
+        return samples
+
+
+class Registry(object):
+    """The metrics and collectors exposed by the metrics endpoint."""
+
+    def __init__(self):
+        """Initialize the registry."""
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        """
+        Add a metric to the registry.
+
+        :param Metric metric: the metric
+        :return: the metric
+        :rtype: Metric
+        """
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        """
+        Add a function that returns metrics computed when the endpoint is scraped.
+
+        :param callable collector: a function returning a list of Metric objects
+        """
+        self.collectors.append(collector)
+
+    def render(self):
+        """
+        Render all the metrics in the Prometheus text format.
+
+        :return: the metrics
+        :rtype: str
+        """
+        metrics = list(self.metrics)
+        for collector in self.collectors:
+            try:
+                metrics.extend(collector())
+            except Exception:
+                log.exception('Failed to collect the metrics of {0}'.format(collector))
+
+        lines = []
+        for metric in metrics:
+            lines.append('# HELP {0} {1}'.format(metric.name, metric.description))
+            lines.append('# TYPE {0} {1}'.format(metric.name, metric.metric_type))
+            for name, labels, value in metric.collect():
+                lines.append('{0}{1} {2}'.format(
+                    name, _format_labels(labels), _format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+
+class ConsumerMetrics(object):
+    """The metrics recorded while processing messages."""
+
+    def __init__(self, resources):
+        """
+        Initialize the metrics.
+
+        :param SharedResources resources: the resources whose cache statistics are exposed
+        """
+        self.resources = resources
+        self.registry = Registry()
+        self.messages = self.registry.register(Counter(
+            'estuary_updater_messages_total', 'The number of processed messages', ('topic',)))
+        self.errors = self.registry.register(Counter(
+            'estuary_updater_message_errors_total', 'The number of messages that failed',
+            ('topic',)))
+        self.handler_duration = self.registry.register(Histogram(
+            'estuary_updater_handler_duration_seconds', 'The time spent handling a message',
+            ('handler',)))
+        self.neo4j_queries = self.registry.register(Counter(
+            'estuary_updater_neo4j_queries_total', 'The number of Cypher queries sent to Neo4j'))
+        self.neo4j_query_duration = self.registry.register(Histogram(
+            'estuary_updater_neo4j_query_duration_seconds', 'The time spent on a Cypher query'))
+        self.last_message_timestamp = None
+        self.registry.add_collector(self.collect_caches)
+        self.registry.add_collector(self.collect_lag)
+        self._local = threading.local()
+
+    def observe_message(self, msg, handler_name, duration, failed):
+        """
+        Record a processed message.
+
+        :param dict msg: the message
+        :param str handler_name: the name of the handler class of the message
+        :param float duration: the seconds it took to handle the message
+        :param bool failed: whether handling the message raised an exception
+        """
+        pending = getattr(self._local, 'pending', None)
+        if pending is None:
+            self._observe_message(msg, handler_name, duration, failed)
+        else:
+            pending.append((msg, handler_name, duration, failed))
+
+    @contextmanager
+    def deferred(self):
+        """
+        Hold the messages observed by the current thread until the block finishes without an error.
+
+        This is used around a Neo4j transaction so that the messages of a batch that is rolled back
+        and then processed one by one are only counted once.
+
+        :return: a context manager
+        """
+        pending = self._local.pending = []
+        try:
+            yield
+            for observation in pending:
+                self._observe_message(*observation)
+        finally:
+            self._local.pending = None
+
+    def _observe_message(self, msg, handler_name, duration, failed):
+        """
+        Record a processed message in the metrics.
+
+        :param dict msg: the message
+        :param str handler_name: the name of the handler class of the message
+        :param float duration: the seconds it took to handle the message
+        :param bool failed: whether handling the message raised an exception
+        """
+        self.messages.inc(topic=msg['topic'])
+        if failed:
+            self.errors.inc(topic=msg['topic'])
+        self.handler_duration.observe(duration, handler=handler_name)
+        # The JMS timestamp is in milliseconds and is 0 when it's not set
+        try:
+            timestamp = int(msg.get('headers', {}).get('timestamp') or 0) / 1000.0
+        except (TypeError, ValueError):
+            timestamp = 0
+        if timestamp:
+            self.last_message_timestamp = timestamp
+
+    def observe_query(self, duration):
+        """
+        Record a Cypher query.
+
+        :param float duration: the seconds the query took
+        """
+        self.neo4j_queries.inc()
+        self.neo4j_query_duration.observe(duration)
+
+    def collect_caches(self):
+        """
+        Get the statistics of the shared caches as metrics.
+
+        :return: the cache metrics
+        :rtype: list
+        """
+        hits = Counter('estuary_updater_cache_hits_total', 'The number of cache hits', ('cache',))
+        misses = Counter(
+            'estuary_updater_cache_misses_total', 'The number of cache misses', ('cache',))
+        hit_ratio = Gauge(
+            'estuary_updater_cache_hit_ratio', 'The ratio of cache lookups that hit', ('cache',))
+        size = Gauge('estuary_updater_cache_size', 'The number of cached entries', ('cache',))
+        for name, stats in self.resources.cache_stats().items():
+            hits.inc(stats['hits'], cache=name)
+            misses.inc(stats['misses'], cache=name)
+            hit_ratio.set(stats['hit_ratio'], cache=name)
+            size.set(stats['size'], cache=name)
+        return [hits, misses, hit_ratio, size]
+
+    def collect_lag(self):
+        """
+        Get the age of the timestamp of the last processed message as a metric.
+
+        :return: the lag metric or nothing if no message with a timestamp was processed yet
+        :rtype: list
+        """
+        if self.last_message_timestamp is None:
+            return []
+        age = Gauge(
+            'estuary_updater_last_message_age_seconds',
+            'The seconds since the last processed message was sent')
+        age.set(time.time() - self.last_message_timestamp)
+        return [age]
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    """An HTTP server that handles every request in its own thread."""
+
+    daemon_threads = True
+
+
+def start_server(registry, host, port):
+    """
+    Serve the metrics of a registry on /metrics in a background thread.
+
+    :param Registry registry: the registry of the metrics
+    :param str host: the address to listen on
+    :param int port: the port to listen on
+    :return: the server, which can be stopped with its shutdown method and then closed with its
+        server_close method
+    :rtype: HTTPServer
+    """
+    class MetricsRequestHandler(BaseHTTPRequestHandler):
+        """Respond with the metrics in the Prometheus text format."""
+
+        def do_GET(self):
+            """Respond to a GET request."""
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            data = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            """Don't log every scrape."""
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+    thread = threading.Thread(target=server.serve_forever, name='estuary-updater-metrics')
+    thread.daemon = True
+    thread.start()
+    log.info('Serving the metrics on {0}:{1}'.format(host, server.server_address[1]))
+    return server
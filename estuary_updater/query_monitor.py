@@ -0,0 +1,137 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals, absolute_import
+
+from contextlib import contextmanager
+import threading
+
+from estuary_updater import log, tracing
+
+
+# The query counts that are active in the current thread
+_local = threading.local()
+
+
+class QueryBudgetExceeded(Exception):
+    """Raised when processing a message issues more Cypher queries than its budget allows."""
+
+    pass
+
+
+class QueryCount(object):
+    """The number of Cypher queries issued in a block of code and the time they took."""
+
+    def __init__(self):
+        """Initialize the count."""
+        self.queries = 0
+        self.duration = 0.0
+
+
+def _record_query(duration):
+    """
+    Add a Cypher query to every count that is active in the current thread.
+
+    :param float duration: the number of seconds the query took
+    """
+    for count in getattr(_local, 'counts', ()):
+        count.queries += 1
+        count.duration += duration
+
+
+@contextmanager
+def count_queries():
+    """
+    Count the Cypher queries issued by the current thread in a block of code.
+
+    :return: a context manager that yields the QueryCount
+    """
+    tracing.instrument_neo4j()
+    tracing.add_query_listener(_record_query)
+    count = QueryCount()
+    if not hasattr(_local, 'counts'):
+        _local.counts = []
+    _local.counts.append(count)
+    try:
+        yield count
+    finally:
+        _local.counts.remove(count)
+
+
+@contextmanager
+def query_budget(max_queries):
+    """
+    Fail if a block of code issues more Cypher queries than allowed.
+
+    This is meant for tests that catch handlers whose query count regresses.
+
+    :param int max_queries: the maximum number of queries
+    :return: a context manager that yields the QueryCount
+    :raises QueryBudgetExceeded: if the block issues more queries than allowed
+    """
+    with count_queries() as count:
+        yield count
+    if count.queries > max_queries:
+        raise QueryBudgetExceeded('{0} Cypher queries were issued but the budget is {1}'.format(
+            count.queries, max_queries))
+
+
+class QueryMonitor(object):
+    """Record the Cypher queries of each handled message per handler method."""
+
+    def __init__(self, budgets=None, strict=False):
+        """
+        Initialize the monitor.
+
+        :kwarg dict budgets: the maximum number of queries per message keyed by the handler method,
+            such as "KojiHandler.build_handler"
+        :kwarg bool strict: when true, QueryBudgetExceeded is raised when a message goes over its
+            budget instead of logging a warning
+        """
+        self.budgets = budgets or {}
+        self.strict = strict
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def measure(self, name, message_id):
+        """
+        Count the queries of a message and check them against the budget of the handler method.
+
+        :param str name: the name of the handler method, such as "KojiHandler.build_handler"
+        :param str message_id: the ID of the message
+        :return: a context manager that yields the QueryCount
+        :raises QueryBudgetExceeded: if the monitor is strict and the message is over its budget
+        """
+        with count_queries() as count:
+            yield count
+
+        with self._lock:
+            stats = self._stats.setdefault(
+                name, {'messages': 0, 'queries': 0, 'duration': 0.0, 'max_queries': 0})
+            stats['messages'] += 1
+            stats['queries'] += count.queries
+            stats['duration'] += count.duration
+            stats['max_queries'] = max(stats['max_queries'], count.queries)
+
+        budget = self.budgets.get(name)
+        if budget is not None and count.queries > budget:
+            error = ('The message {0} issued {1} Cypher queries in {2} but the budget is {3}'
+                     .format(message_id, count.queries, name, budget))
+            if self.strict:
+                raise QueryBudgetExceeded(error)
+            log.warning(error)
+
+    def stats(self):
+        """
+        Get the query statistics of each handler method.
+
+        :return: a dictionary with the handler methods as keys and dictionaries with the number of
+            messages, total queries, total seconds, the most queries of a message and the mean
+            queries per message as values
+        :rtype: dict
+        """
+        with self._lock:
+            return dict(
+                (name, dict(stats, mean_queries=float(stats['queries']) / stats['messages']))
+                for name, stats in self._stats.items()
+            )
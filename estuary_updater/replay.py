@@ -0,0 +1,213 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals, absolute_import
+
+import argparse
+import json
+import os
+import threading
+import time
+
+from estuary_updater import config, log
+from estuary_updater.coalescer import coalesce_messages
+from estuary_updater.dispatcher import Dispatcher
+from estuary_updater.workers import KeyedWorkerPool
+
+
+def read_checkpoint(path, messages_path):
+    """
+    Get the number of lines of the messages file that were already processed.
+
+    :param str path: the path of the checkpoint file
+    :param str messages_path: the path of the messages file being replayed
+    :return: the number of processed lines or 0 if there is no checkpoint for the messages file
+    :rtype: int
+    """
+    if not path or not os.path.exists(path):
+        return 0
+    with open(path, 'r') as f:
+        checkpoint = json.load(f)
+    if checkpoint.get('messages_path') != os.path.abspath(messages_path):
+        log.warning('Ignoring the checkpoint {0} since it is for {1}'.format(
+            path, checkpoint.get('messages_path')))
+        return 0
+    return checkpoint['line']
+
+
+def write_checkpoint(path, messages_path, line):
+    """
+    Record the number of lines of the messages file that were processed.
+
+    :param str path: the path of the checkpoint file
+    :param str messages_path: the path of the messages file being replayed
+    :param int line: the number of processed lines
+    """
+    # Write to a temporary file first so that a crash doesn't leave a truncated file behind
+    tmp_path = '{0}.tmp'.format(path)
+    with open(tmp_path, 'w') as f:
+        json.dump({'messages_path': os.path.abspath(messages_path), 'line': line}, f)
+    os.rename(tmp_path, path)
+
+
+class Replayer(object):
+    """Feed recorded messages through the handlers in large transactions."""
+
+    def __init__(self, dispatcher, batch_size, workers, coalesce=False):
+        """
+        Initialize the replayer.
+
+        :param Dispatcher dispatcher: the dispatcher that processes the messages
+        :param int batch_size: the maximum number of messages stored in a single transaction
+        :param int workers: the number of threads that process messages in parallel
+        :kwarg bool coalesce: whether only the newest state message of each Koji build and
+            Freshmaker event or build in a chunk is processed
+        """
+        self.dispatcher = dispatcher
+        self.batch_size = batch_size
+        self.coalesce = coalesce
+        # The IDs of the messages that failed to be processed, in the order they failed
+        self.failed_message_ids = []
+        self._failed_lock = threading.Lock()
+        self.worker_pool = None
+        if workers > 1:
+            self.worker_pool = KeyedWorkerPool(
+                self._dispatch_messages, workers, batch_size * 2, batch_size)
+            self.worker_pool.start()
+
+    def process_chunk(self, msgs):
+        """
+        Process messages and wait until all of them are stored.
+
+        :param list msgs: the messages in the order they were received
+        :return: the number of messages that were processed
+        :rtype: int
+        """
+        if self.coalesce:
+            msgs, discarded = coalesce_messages(msgs, self.dispatcher.get_coalesce_key)
+            if discarded:
+                log.debug('Discarded {0} superseded messages'.format(discarded))
+
+        if self.worker_pool is not None:
+            for msg in msgs:
+                self.worker_pool.submit(self.dispatcher.get_ordering_key(msg), msg)
+            self.worker_pool.join()
+        else:
+            for i in range(0, len(msgs), self.batch_size):
+                self._dispatch_messages(msgs[i:i + self.batch_size])
+        return len(msgs)
+
+    def _dispatch_messages(self, msgs):
+        """
+        Process a batch of messages and record the IDs of the ones that failed.
+
+        :param list msgs: the messages in the order they were received
+        """
+        failed = self.dispatcher.dispatch_messages(msgs)
+        if failed:
+            with self._failed_lock:
+                self.failed_message_ids.extend(msg['headers']['message-id'] for msg in failed)
+
+    def stop(self):
+        """Stop the worker threads."""
+        if self.worker_pool is not None:
+            self.worker_pool.stop()
+
+
+def replay(messages_path, replayer, checkpoint_path=None, chunk_size=10000):
+    """
+    Replay the messages of a JSON lines file.
+
+    The messages are processed in chunks. A chunk is fully stored before the checkpoint is
+    updated, so that an interrupted replay can resume after the last stored chunk. Once a message
+    fails to be processed, the checkpoint is no longer updated, so that the next replay retries
+    the chunk it failed in. The IDs of the failed messages are in the replayer's
+    ``failed_message_ids``.
+
+    :param str messages_path: the path of the file with one JSON message per line
+    :param Replayer replayer: the replayer that processes the messages
+    :kwarg str checkpoint_path: the path of the checkpoint file to resume from and update
+    :kwarg int chunk_size: the number of lines processed between checkpoints
+    :return: the number of messages that were processed
+    :rtype: int
+    """
+    start_line = read_checkpoint(checkpoint_path, messages_path)
+    if start_line:
+        log.info('Resuming the replay of {0} after line {1}'.format(messages_path, start_line))
+
+    start_time = time.time()
+    processed = 0
+    line_number = 0
+    chunk = []
+    with open(messages_path, 'r') as f:
+        for line_number, line in enumerate(f, 1):
+            if line_number <= start_line or not line.strip():
+                continue
+            chunk.append(json.loads(line))
+            if len(chunk) < chunk_size:
+                continue
+            processed += replayer.process_chunk(chunk)
+            chunk = []
+            if checkpoint_path and not replayer.failed_message_ids:
+                write_checkpoint(checkpoint_path, messages_path, line_number)
+            _log_progress(line_number, processed, start_time)
+
+    if chunk:
+        processed += replayer.process_chunk(chunk)
+    if checkpoint_path and not replayer.failed_message_ids:
+        write_checkpoint(checkpoint_path, messages_path, max(line_number, start_line))
+    _log_progress(line_number, processed, start_time)
+    return processed
+
+
+def _log_progress(line_number, processed, start_time):
+    """
+    Log the progress and rate of the replay.
+
+    :param int line_number: the last line that was read
+    :param int processed: the number of messages processed so far
+    :param float start_time: the time the replay started at
+    """
+    elapsed = time.time() - start_time
+    rate = processed / elapsed if elapsed else 0.0
+    log.info('Read {0} lines and processed {1} messages in {2:.1f} seconds ({3:.1f} '
+             'messages/second)'.format(line_number, processed, elapsed, rate))
+
+
+def main(argv=None):
+    """
+    Replay archived messages through the handlers to rebuild or backfill the graph.
+
+    :kwarg list argv: the command-line arguments, which default to sys.argv
+    :return: the exit status, which is 1 if any message failed to be processed
+    :rtype: int
+    """
+    parser = argparse.ArgumentParser(description=(
+        'Replay archived messages, one JSON message per line, through the Estuary Updater '
+        'handlers'))
+    parser.add_argument('messages_path', help='the path of the JSON lines file of messages')
+    parser.add_argument('--batch-size', type=int, default=500,
+                        help='the maximum number of messages stored per Neo4j transaction')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='the number of threads that process messages in parallel')
+    parser.add_argument('--chunk-size', type=int, default=10000,
+                        help='the number of lines processed between checkpoints')
+    parser.add_argument('--checkpoint', dest='checkpoint_path',
+                        help='the file used to resume an interrupted replay')
+    parser.add_argument('--coalesce', action='store_true',
+                        help='only process the newest state message of each entity in a chunk')
+    args = parser.parse_args(argv)
+
+    dispatcher = Dispatcher(config)
+    dispatcher.startup()
+    replayer = Replayer(dispatcher, args.batch_size, args.workers, coalesce=args.coalesce)
+    try:
+        replay(args.messages_path, replayer, args.checkpoint_path, args.chunk_size)
+    finally:
+        replayer.stop()
+        dispatcher.shutdown()
+
+    if replayer.failed_message_ids:
+        log.error('Failed to process {0} messages: {1}'.format(
+            len(replayer.failed_message_ids), ', '.join(replayer.failed_message_ids)))
+        return 1
+    return 0
@@ -0,0 +1,128 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals, absolute_import
+
+import numbers
+
+try:
+    string_types = (basestring,)  # noqa: F821
+except NameError:
+    string_types = (str,)
+
+integer_types = (numbers.Integral,)
+
+
+# The value of a path that doesn't exist in a message
+_MISSING = object()
+
+
+class MessageValidationError(ValueError):
+    """Raised when a message doesn't have a field its handler needs or the field has a bad type."""
+
+    pass
+
+
+class Field(object):
+    """A value that is extracted from a message by a schema."""
+
+    __slots__ = ('name', 'path', 'types', 'required', 'nullable', 'default')
+
+    def __init__(self, name, path, types=None, required=True, nullable=False, default=None):
+        """
+        Initialize the field.
+
+        :param str name: the name of the attribute of the record that stores the value
+        :param str path: the dotted path of the value in the message, such as "body.msg.info.id"
+        :kwarg tuple types: the types the value must be an instance of. If not set, any type is
+            accepted.
+        :kwarg bool required: whether a message without the value is invalid
+        :kwarg bool nullable: whether the value can be None regardless of its types
+        :kwarg default: the value used when the field isn't required and isn't in the message
+        """
+        self.name = name
+        self.path = tuple(path.split('.'))
+        self.types = types
+        self.required = required
+        self.nullable = nullable
+        self.default = default
+
+
+class Record(object):
+    """The base class of the records created by schemas."""
+
+    __slots__ = ()
+
+    def __repr__(self):
+        """
+        Get a representation of the record with its values.
+
+        :return: the representation
+        :rtype: str
+        """
+        return '{0}({1})'.format(type(self).__name__, ', '.join(
+            '{0}={1!r}'.format(name, getattr(self, name)) for name in self.__slots__))
+
+
+class Schema(object):
+    """
+    Extract and validate the fields a handler needs from a message in a single pass.
+
+    The paths of the fields are compiled into a list of steps when the schema is created, so the
+    dictionaries that several fields share, such as ``msg['body']['msg']``, are only looked up once
+    per message. The values are stored on a record class with ``__slots__``.
+    """
+
+    def __init__(self, name, fields):
+        """
+        Initialize the schema and compile the paths of its fields.
+
+        :param str name: the name of the record class
+        :param list fields: the Field objects of the schema
+        """
+        self.fields = tuple(fields)
+        self.record_class = type(
+            str(name), (Record,), {'__slots__': tuple(str(field.name) for field in self.fields)})
+        # Each step looks up a key in the value of an earlier step, where index 0 is the message
+        self._steps = []
+        self._field_indexes = []
+        step_indexes = {(): 0}
+        for field in self.fields:
+            for depth in range(1, len(field.path) + 1):
+                prefix = field.path[:depth]
+                if prefix not in step_indexes:
+                    self._steps.append((step_indexes[prefix[:-1]], prefix[-1]))
+                    step_indexes[prefix] = len(self._steps)
+            self._field_indexes.append(step_indexes[field.path])
+
+    def extract(self, msg):
+        """
+        Create the record of a message.
+
+        :param dict msg: the message
+        :return: the record with the values of the fields
+        :rtype: Record
+        :raises MessageValidationError: if a required field is missing or a value has a bad type
+        """
+        values = [msg]
+        for parent_index, key in self._steps:
+            parent = values[parent_index]
+            if isinstance(parent, dict):
+                values.append(parent.get(key, _MISSING))
+            else:
+                values.append(_MISSING)
+
+        record = self.record_class()
+        for field, index in zip(self.fields, self._field_indexes):
+            value = values[index]
+            if value is _MISSING:
+                if field.required:
+                    raise MessageValidationError('The message is missing "{0}"'.format(
+                        '.'.join(field.path)))
+                value = field.default
+            elif field.types is not None and not isinstance(value, field.types):
+                if value is not None or not field.nullable:
+                    raise MessageValidationError(
+                        'The value of "{0}" in the message is {1!r}'.format(
+                            '.'.join(field.path), value))
+            setattr(record, field.name, value)
+        return record
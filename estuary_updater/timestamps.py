@@ -0,0 +1,119 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals, absolute_import
+
+from datetime import datetime, timedelta
+
+
+# The formats tried with strptime when a timestamp doesn't have the fixed layout of the fast path
+FALLBACK_FORMATS = (
+    '%Y-%m-%d %H:%M:%S.%f',
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%dT%H:%M:%S.%f',
+    '%Y-%m-%dT%H:%M:%S'
+)
+
+
+def _strip_utc_suffix(timestamp):
+    """
+    Remove the UTC designator at the end of a timestamp.
+
+    :param str timestamp: the timestamp, such as "2018-07-03 13:34:14 UTC" or "2018-06-14T20:26:06Z"
+    :return: the timestamp without "Z" or " UTC"
+    :rtype: str
+    """
+    if timestamp.endswith('Z'):
+        return timestamp[:-1]
+    elif timestamp.endswith(' UTC'):
+        return timestamp[:-4]
+    return timestamp
+
+
+def _parse_with_strptime(timestamp):
+    """
+    Parse a timestamp with strptime, which is slower but accepts numbers that aren't zero-padded.
+
+    :param str timestamp: the timestamp
+    :return: the naive datetime in UTC
+    :rtype: datetime.datetime
+    :raises ValueError: if the timestamp isn't in a supported format
+    """
+    stripped = _strip_utc_suffix(timestamp.strip())
+    for ts_format in FALLBACK_FORMATS:
+        try:
+            return datetime.strptime(stripped, ts_format)
+        except ValueError:
+            pass
+    raise ValueError('The timestamp "{0}" is not in a supported format'.format(timestamp))
+
+
+def parse_timestamp(timestamp):
+    """
+    Parse a timestamp from Koji, the Errata Tool, Freshmaker or dist-git.
+
+    The supported layout is "YYYY-MM-DD HH:MM:SS" or "YYYY-MM-DDTHH:MM:SS", optionally followed
+    by up to six digits of fractional seconds and either "Z", " UTC" or a "+HH:MM" offset. The
+    fields are read at fixed offsets, which is several times faster than strptime. Anything else
+    falls back to strptime.
+
+    :param str timestamp: the timestamp
+    :return: the naive datetime in UTC, which is how neomodel expects it
+    :rtype: datetime.datetime
+    :raises ValueError: if the timestamp isn't in a supported format
+    """
+    # The separators are at the offsets 4, 7, 10, 13 and 16
+    if timestamp[4:17:3] not in ('-- ::', '--T::'):
+        return _parse_with_strptime(timestamp)
+
+    rest = timestamp[19:]
+    microsecond = 0
+    offset = None
+    if rest:
+        rest = _strip_utc_suffix(rest)
+        if rest[:1] == '.':
+            fraction_end = 1
+            while fraction_end < len(rest) and rest[fraction_end].isdigit():
+                fraction_end += 1
+            if not 1 < fraction_end <= 7:
+                return _parse_with_strptime(timestamp)
+            microsecond = int(rest[1:fraction_end].ljust(6, '0'))
+            rest = rest[fraction_end:]
+        if rest:
+            # An offset such as "+02:00" or "-0500"
+            offset_digits = rest[1:].replace(':', '')
+            if rest[0] not in '+-' or len(offset_digits) != 4 or not offset_digits.isdigit():
+                return _parse_with_strptime(timestamp)
+            offset = timedelta(hours=int(offset_digits[:2]), minutes=int(offset_digits[2:]))
+            if rest[0] == '-':
+                offset = -offset
+
+    try:
+        parsed = datetime(
+            int(timestamp[0:4]), int(timestamp[5:7]), int(timestamp[8:10]), int(timestamp[11:13]),
+            int(timestamp[14:16]), int(timestamp[17:19]), microsecond)
+    except ValueError:
+        return _parse_with_strptime(timestamp)
+    if offset is not None:
+        parsed -= offset
+    return parsed
+
+
+def parse_timestamps(timestamps):
+    """
+    Parse many timestamps at once, such as the timestamps of a batch of messages being replayed.
+
+    Repeated timestamps are only parsed once.
+
+    :param iterable timestamps: the timestamps, where None values are kept as None
+    :return: the naive datetimes in UTC in the same order
+    :rtype: list
+    :raises ValueError: if a timestamp isn't in a supported format
+    """
+    parsed = {None: None}
+    results = []
+    for timestamp in timestamps:
+        value = parsed.get(timestamp)
+        if value is None and timestamp is not None:
+            value = parsed[timestamp] = parse_timestamp(timestamp)
+        results.append(value)
+    return results
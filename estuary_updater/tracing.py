@@ -0,0 +1,287 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals, absolute_import
+
+from contextlib import contextmanager
+import functools
+import json
+import threading
+import time
+
+from neomodel.util import Database
+
+from estuary_updater import log
+
+
+# The trace of the message the current thread is processing
+_local = threading.local()
+# The functions called with every finished trace
+_exporters = []
+# The functions called with the duration of every Cypher query once Neo4j is instrumented
+_query_listeners = []
+_neo4j_lock = threading.Lock()
+_neo4j_instrumented = False
+
+
+class Trace(object):
+    """The timings of the stages and external calls made while processing a message."""
+
+    def __init__(self, **tags):
+        """
+        Initialize the trace.
+
+        :param tags: the tags of the trace, such as the topic, handler and message ID
+        """
+        self.tags = tags
+        self.spans = []
+        self.start = time.time()
+        self.duration = None
+        self._lock = threading.Lock()
+
+    def add_span(self, name, duration, tags):
+        """
+        Record a finished span, which may be from another thread processing the same message.
+
+        :param str name: the name of the span, such as "koji.getBuild"
+        :param float duration: the number of seconds the span took
+        :param dict tags: the tags of the span
+        """
+        with self._lock:
+            self.spans.append({'name': name, 'duration': duration, 'tags': tags})
+
+    def get_totals(self):
+        """
+        Get the number of spans and total seconds per span name.
+
+        :return: a dictionary with the span names as keys and dictionaries with the count and
+            duration as values
+        :rtype: dict
+        """
+        totals = {}
+        with self._lock:
+            for span_info in self.spans:
+                total = totals.setdefault(span_info['name'], {'count': 0, 'duration': 0.0})
+                total['count'] += 1
+                total['duration'] += span_info['duration']
+        return totals
+
+    def to_dict(self):
+        """
+        Get a JSON serializable representation of the trace.
+
+        :return: the tags, duration and spans of the trace in milliseconds
+        :rtype: dict
+        """
+        with self._lock:
+            spans = [
+                dict(span_info['tags'], name=span_info['name'],
+                     duration_ms=round(span_info['duration'] * 1000, 3))
+                for span_info in self.spans
+            ]
+        return dict(
+            self.tags,
+            duration_ms=round((self.duration or 0) * 1000, 3),
+            spans=spans,
+            totals=dict(
+                (name, {'count': total['count'], 'duration_ms': round(total['duration'] * 1000, 3)})
+                for name, total in self.get_totals().items()
+            )
+        )
+
+
+def get_current_trace():
+    """
+    Get the trace of the message the current thread is processing.
+
+    :return: the trace or None if the message isn't traced
+    :rtype: Trace or None
+    """
+    return getattr(_local, 'trace', None)
+
+
+@contextmanager
+def trace(enabled, **tags):
+    """
+    Trace the processing of a message and export the trace once it's done.
+
+    :param bool enabled: if false, nothing is traced
+    :param tags: the tags of the trace, such as the topic, handler and message ID
+    :return: a context manager that yields the trace or None if tracing isn't enabled
+    """
+    if not enabled:
+        yield None
+        return
+
+    new_trace = Trace(**tags)
+    previous = get_current_trace()
+    _local.trace = new_trace
+    try:
+        yield new_trace
+    except Exception as error:
+        new_trace.tags['error'] = type(error).__name__
+        raise
+    finally:
+        new_trace.duration = time.time() - new_trace.start
+        _local.trace = previous
+        pending = getattr(_local, 'pending', None)
+        if pending is None:
+            _export(new_trace)
+        else:
+            pending.append(new_trace)
+
+
+@contextmanager
+def deferred():
+    """
+    Hold the traces finished by the current thread until the block finishes without an error.
+
+    This is used around a Neo4j transaction so that the messages of a batch that is rolled back
+    and then processed one by one are only traced once.
+
+    :return: a context manager
+    """
+    pending = _local.pending = []
+    try:
+        yield
+        for finished_trace in pending:
+            _export(finished_trace)
+    finally:
+        _local.pending = None
+
+
+def _export(finished_trace):
+    """
+    Pass a finished trace to every exporter.
+
+    :param Trace finished_trace: the trace
+    """
+    for exporter in list(_exporters):
+        try:
+            exporter(finished_trace)
+        except Exception:
+            log.exception('Failed to export the trace of {0}'.format(finished_trace.tags))
+
+
+@contextmanager
+def span(name, **tags):
+    """
+    Time a stage or external call as part of the trace of the current message.
+
+    :param str name: the name of the span, such as "koji.getBuild"
+    :param tags: the tags of the span
+    :return: a context manager
+    """
+    current = get_current_trace()
+    if current is None:
+        yield
+        return
+
+    start = time.time()
+    try:
+        yield
+    finally:
+        current.add_span(name, time.time() - start, tags)
+
+
+def bind(func):
+    """
+    Make a function record its spans in the current trace even when it's called in another thread.
+
+    :param callable func: the function, such as one submitted to a thread pool
+    :return: the wrapped function
+    :rtype: callable
+    """
+    current = get_current_trace()
+    if current is None:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        previous = get_current_trace()
+        _local.trace = current
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.trace = previous
+
+    return wrapper
+
+
+def add_exporter(exporter):
+    """
+    Register a function that is called with every finished trace.
+
+    :param callable exporter: the function
+    """
+    if exporter not in _exporters:
+        _exporters.append(exporter)
+
+
+def remove_exporter(exporter):
+    """
+    Unregister a function registered with add_exporter.
+
+    :param callable exporter: the function
+    """
+    if exporter in _exporters:
+        _exporters.remove(exporter)
+
+
+def log_exporter(finished_trace):
+    """
+    Log a finished trace as a single line of JSON.
+
+    :param Trace finished_trace: the trace
+    """
+    log.info('Trace: {0}'.format(json.dumps(finished_trace.to_dict(), sort_keys=True)))
+
+
+def add_query_listener(listener):
+    """
+    Register a function that is called with the duration of every Cypher query.
+
+    instrument_neo4j must be called for the function to be called.
+
+    :param callable listener: the function
+    """
+    if listener not in _query_listeners:
+        _query_listeners.append(listener)
+
+
+def remove_query_listener(listener):
+    """
+    Unregister a function registered with add_query_listener.
+
+    :param callable listener: the function
+    """
+    if listener in _query_listeners:
+        _query_listeners.remove(listener)
+
+
+def instrument_neo4j():
+    """
+    Time every Cypher query sent by neomodel.
+
+    Each query is recorded as a span of the current trace and passed to the query listeners.
+    """
+    global _neo4j_instrumented
+    with _neo4j_lock:
+        if _neo4j_instrumented:
+            return
+        original = Database.cypher_query
+
+        @functools.wraps(original)
+        def cypher_query(self, *args, **kwargs):
+            start = time.time()
+            try:
+                return original(self, *args, **kwargs)
+            finally:
+                duration = time.time() - start
+                current = get_current_trace()
+                if current is not None:
+                    current.add_span('neo4j.query', duration, {})
+                for listener in list(_query_listeners):
+                    listener(duration)
+
+        Database.cypher_query = cypher_query
+        _neo4j_instrumented = True
@@ -0,0 +1,123 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals, absolute_import
+
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from estuary_updater import log
+
+
+# Put on a worker's queue to tell the worker to exit
+_STOP = object()
+
+
+class KeyedWorkerPool(object):
+    """
+    Process items on a pool of threads while keeping the items with the same key in order.
+
+    Every key is always assigned to the same worker, and each worker processes the items on its
+    queue one after the other. The queues are bounded, so submitting an item blocks while the
+    queue of its worker is full, which keeps a slow backend from letting the backlog grow
+    without limit.
+    """
+
+    def __init__(self, process, num_workers, queue_size, batch_size=1):
+        """
+        Initialize the pool.
+
+        :param callable process: the function called with a list of items to process
+        :param int num_workers: the number of worker threads
+        :param int queue_size: the maximum number of items waiting on each worker's queue
+        :kwarg int batch_size: the maximum number of queued items a worker passes to the process
+            function at once
+        """
+        self.process = process
+        self.batch_size = max(batch_size, 1)
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in range(num_workers)]
+        self._threads = []
+
+    def start(self):
+        """Start the worker threads."""
+        for index, worker_queue in enumerate(self._queues):
+            thread = threading.Thread(
+                target=self._work, args=(worker_queue,),
+                name='estuary-updater-worker-{0}'.format(index))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def get_worker_index(self, key):
+        """
+        Get the index of the worker that processes the items with the key.
+
+        :param key: the hashable key of an item
+        :return: the index of the worker
+        :rtype: int
+        """
+        return hash(key) % len(self._queues)
+
+    def submit(self, key, item):
+        """
+        Queue an item to be processed after the previously submitted items with the same key.
+
+        This blocks while the queue of the worker is full.
+
+        :param key: the hashable key of the item
+        :param item: the item to process
+        """
+        self._queues[self.get_worker_index(key)].put(item)
+
+    def qsize(self):
+        """
+        Get the number of items waiting to be processed.
+
+        :return: the approximate number of items on all the queues
+        :rtype: int
+        """
+        return sum(worker_queue.qsize() for worker_queue in self._queues)
+
+    def join(self):
+        """Wait until all the submitted items are processed."""
+        for worker_queue in self._queues:
+            worker_queue.join()
+
+    def stop(self):
+        """Process the remaining items and stop the worker threads."""
+        for worker_queue in self._queues:
+            worker_queue.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _work(self, worker_queue):
+        """
+        Process the items of a queue until the worker is told to stop.
+
+        :param queue.Queue worker_queue: the queue of the worker
+        """
+        stop = False
+        while not stop:
+            items = [worker_queue.get()]
+            # Take whatever else is already queued, up to the batch size, without waiting for it
+            while len(items) < self.batch_size and items[-1] is not _STOP:
+                try:
+                    items.append(worker_queue.get_nowait())
+                except queue.Empty:
+                    break
+            if items[-1] is _STOP:
+                stop = True
+                items.pop()
+
+            try:
+                if items:
+                    self.process(items)
+            except Exception:
+                log.exception('Failed to process {0} queued items'.format(len(items)))
+            finally:
+                for _ in range(len(items) + int(stop)):
+                    worker_queue.task_done()
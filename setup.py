@@ -19,11 +19,15 @@ setup(
     author='Red Hat, Inc.',
     author_email='mprahl@redhat.com',
     license='GPLv3+',
-    packages=find_packages(exclude=['tests']),
+    packages=find_packages(exclude=['benchmarks', 'tests']),
     include_package_data=True,
     install_requires=requirements,
     dependency_links=dependency_links,
     entry_points="""
+    [console_scripts]
+    estuary-updater-replay = estuary_updater.replay:main
+    estuary-updater-async = estuary_updater.async_consumer:main
+
     [moksha.consumer]
     estuary_updater = estuary_updater.consumer:EstuaryUpdater
     """
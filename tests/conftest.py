@@ -4,6 +4,7 @@ from __future__ import unicode_literals, absolute_import
 import os
 from datetime import datetime
 
+import mock
 import pytest
 from neomodel import config as neomodel_config, db as neo4j_db
 from estuary.models.koji import KojiBuild, ContainerKojiBuild, KojiTag
@@ -32,9 +33,11 @@ def consumer():
     class FakeHub(object):
         """FakeHub to used to initialize a fedmsg consumer."""
 
-        config = {}
+        config = {'estuary_updater.enabled': True}
 
-    return EstuaryUpdater(FakeHub())
+    # The fake hub doesn't have what moksha needs to subscribe to the topics
+    with mock.patch('fedmsg.consumers.FedmsgConsumer.__init__', return_value=None):
+        return EstuaryUpdater(FakeHub())
 
 
 @pytest.fixture
@@ -0,0 +1,87 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals, absolute_import
+
+from estuary.models.errata import Advisory
+from estuary.models.koji import KojiBuild
+import koji
+import mock
+import pytest
+
+from estuary_updater.handlers import (
+    get_topic_to_handler, topic_to_handler, DistGitHandler, ErrataHandler, KojiHandler)
+from estuary_updater.handlers.base import BaseHandler
+from estuary_updater.query_monitor import count_queries
+from estuary_updater.resources import SharedResources
+from estuary_updater import config
+
+
+def test_topic_to_handler():
+    """Test that the dispatch table maps topics to the right handler methods."""
+    assert topic_to_handler['/topic/VirtualTopic.eng.distgit.push'] == (
+        DistGitHandler, 'push_handler')
+    assert topic_to_handler['/topic/VirtualTopic.eng.brew.build.untag'] == (
+        KojiHandler, 'build_tag_handler')
+    assert '/topic/VirtualTopic.eng.unsupported' not in topic_to_handler
+
+
+def test_topic_to_handler_duplicate():
+    """Test that registering the same topic twice raises an exception."""
+    class DuplicateHandler(BaseHandler):
+        topic_to_method = {'/topic/VirtualTopic.eng.distgit.push': 'push_handler'}
+
+    with pytest.raises(RuntimeError):
+        get_topic_to_handler([DistGitHandler, DuplicateHandler])
+
+
+def test_handle_unsupported_topic():
+    """Test that the handle compatibility method rejects unsupported topics."""
+    msg = {'topic': '/topic/VirtualTopic.eng.unsupported'}
+    assert DistGitHandler.can_handle(msg) is False
+    with pytest.raises(RuntimeError):
+        DistGitHandler(config).handle(msg)
+
+
+@mock.patch('koji.ClientSession')
+def test_koji_session_shared(mock_koji_cs):
+    """Test that handlers sharing resources reuse the same Koji session."""
+    resources = SharedResources(config)
+    koji_handler = KojiHandler(config, resources)
+    distgit_handler = DistGitHandler(config, resources)
+    assert koji_handler.koji_session is distgit_handler.koji_session
+    assert koji_handler.koji_session is koji_handler.koji_session
+    assert mock_koji_cs.call_count == 1
+
+
+def test_get_or_create_build_unchanged(mock_getBuild_complete):
+    """Test that a build is only written again when its build info changed."""
+    handler = KojiHandler(config)
+    build = handler.get_or_create_build(mock_getBuild_complete)
+    with count_queries() as count:
+        assert handler.get_or_create_build(dict(mock_getBuild_complete)).id == build.id
+    assert count.queries == 0
+
+    building_build = dict(mock_getBuild_complete, state=koji.BUILD_STATES['BUILDING'])
+    with count_queries() as count:
+        build = handler.get_or_create_build(building_build)
+    # Only the changed state is sent to Neo4j
+    assert count.queries == 1
+    assert build.state == koji.BUILD_STATES['BUILDING']
+    assert KojiBuild.nodes.get(id_='736244').state == koji.BUILD_STATES['BUILDING']
+
+
+def test_connect_bugzilla_bugs():
+    """Test that the bugs of a node are stored with a single query."""
+    advisory = Advisory.get_or_create({'id_': '34661'})[0]
+    handler = ErrataHandler(config)
+    with count_queries() as count:
+        handler.connect_bugzilla_bugs(advisory, 'attached_bugs', [1542358, 1563171, 1542358])
+    assert count.queries == 1
+    # Connecting the same bugs again doesn't create duplicate nodes or relationships
+    handler.connect_bugzilla_bugs(advisory, 'attached_bugs', ['1563171', '1578337'])
+    assert sorted(bug.id_ for bug in advisory.attached_bugs.all()) == [
+        '1542358', '1563171', '1578337']
+
+    with count_queries() as count:
+        handler.connect_bugzilla_bugs(advisory, 'attached_bugs', [])
+    assert count.queries == 0
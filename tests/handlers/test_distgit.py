@@ -12,6 +12,7 @@ import pytz
 
 from tests import message_dir
 from estuary_updater.handlers.distgit import DistGitHandler
+from estuary_updater.query_monitor import count_queries, query_budget
 from estuary.models.bugzilla import BugzillaBug
 from estuary_updater import config
 from estuary.models.user import User
@@ -99,7 +100,10 @@ def test_distgit_push():
         ['1234567', '2345678'], ['1534646', '1484051'], ['635241']),
     ('Related: BZ243648, bz#2345678\n', ['243648', '2345678'], [], []),
     ('RESOLVES: bug975310', [], ['975310'], []),
-    ('reverted: RHBZ125689', [], [], ['125689'])
+    ('reverted: RHBZ125689', [], [], ['125689']),
+    # Duplicates are removed and references on the next line don't belong to the relationship
+    ('Resolves: rhbz#975310, bz 975310\n#1234567\nResolves: bug 975310, bug 125689\n',
+        [], ['975310', '125689'], [])
 ])
 def test_parse_bugzilla_bugs(msg, related, resolves, reverted):
     """Test the Bugzilla bug parsing function."""
@@ -109,3 +113,100 @@ def test_parse_bugzilla_bugs(msg, related, resolves, reverted):
         'resolves': resolves,
         'reverted': reverted
     }
+
+
+def test_parse_bugzilla_bugs_batch():
+    """Test that many commit messages are parsed at once."""
+    commit_messages = ['Resolves: rhbz#1\n', 'Fix a typo\n', 'Resolves: rhbz#1\n']
+    assert DistGitHandler.parse_bugzilla_bugs_batch(commit_messages) == [
+        {'resolves': ['1'], 'related': [], 'reverted': []},
+        {'resolves': [], 'related': [], 'reverted': []},
+        {'resolves': ['1'], 'related': [], 'reverted': []}
+    ]
+
+
+def test_distgit_commit_rerun():
+    """Test that handling a commit again replaces the author and doesn't duplicate anything."""
+    with open(path.join(message_dir, 'distgit', 'distgit_commit.json'), 'r') as f:
+        msg = json.load(f)
+
+    handler = DistGitHandler(config)
+    handler.handle(msg)
+    msg['headers']['email'] = 'tbrady@redhat.com'
+    msg['body']['msg']['message'] += 'Resolves: rhbz#1534646\nReverted: rhbz#1534646\n'
+    handler.handle(msg)
+
+    commit = DistGitCommit.nodes.get_or_none(hash_='2cc7f45c8aae163feed162478622f5f9165c8e78')
+    assert len(commit.author.all()) == 1
+    assert commit.author.get().username == 'tbrady'
+    assert len(commit.resolved_bugs.all()) == 2
+    assert len(commit.related_bugs.all()) == 2
+    assert [bug.id_ for bug in commit.reverted_bugs.all()] == ['1534646']
+    assert len(commit.repos) == 1
+    assert len(commit.branches) == 1
+    repo = DistGitRepo.nodes.get_or_none(name='openldap')
+    assert len(repo.contributors.all()) == 2
+
+
+@pytest.mark.parametrize('chunk_size', [1, 500])
+def test_distgit_push_chunks(chunk_size):
+    """Test the dist-git handler when a push is stored in several chunks."""
+    commits = ['{0:040x}'.format(i) for i in range(1, 6)]
+    msg = {
+        'topic': '/topic/VirtualTopic.eng.distgit.push',
+        'body': {'msg': {'oldrev': '{0:040x}'.format(0), 'commits': commits}}
+    }
+    test_config = dict(config)
+    test_config['estuary_updater.push_chunk_size'] = chunk_size
+    DistGitHandler(test_config).handle(msg)
+
+    parent = DistGitCommit.nodes.get_or_none(hash_='{0:040x}'.format(0))
+    assert parent is not None
+    for commit_hash in commits:
+        child = DistGitCommit.nodes.get_or_none(hash_=commit_hash)
+        assert len(child.parent.all()) == 1
+        assert child.parent.is_connected(parent)
+        parent = child
+
+
+@pytest.mark.parametrize('chunk_size', [0, -1])
+def test_distgit_push_chunk_size_invalid(chunk_size):
+    """Test that the dist-git handler doesn't start with a push chunk size less than 1."""
+    test_config = dict(config)
+    test_config['estuary_updater.push_chunk_size'] = chunk_size
+    with pytest.raises(ValueError):
+        DistGitHandler(test_config).startup()
+
+
+def test_distgit_commit_query_count():
+    """Test that the number of Cypher queries of a commit doesn't grow with its number of bugs."""
+    with open(path.join(message_dir, 'distgit', 'distgit_commit.json'), 'r') as f:
+        msg = json.load(f)
+
+    handler = DistGitHandler(config)
+    with count_queries() as count:
+        handler.handle(msg)
+    msg['headers']['rev'] = '{0:040x}'.format(1)
+    msg['body']['msg']['message'] += ''.join(
+        'Resolves: rhbz#{0}\n'.format(bug_id) for bug_id in range(100, 150))
+    with query_budget(count.queries):
+        handler.handle(msg)
+
+
+def test_distgit_push_query_count():
+    """Test that the number of Cypher queries of a push doesn't grow with its number of commits."""
+    handler = DistGitHandler(config)
+    query_counts = []
+    for num_commits in (2, 50):
+        first_commit = num_commits * 1000
+        msg = {
+            'topic': '/topic/VirtualTopic.eng.distgit.push',
+            'body': {'msg': {
+                'oldrev': '{0:040x}'.format(first_commit),
+                'commits': ['{0:040x}'.format(first_commit + i) for i in range(1, num_commits)]
+            }}
+        }
+        with count_queries() as count:
+            handler.handle(msg)
+        query_counts.append(count.queries)
+    assert query_counts[0] == query_counts[1]
@@ -33,7 +33,7 @@ def test_activity_status_handler(msg_type):
     if msg_type == 'created':
         errata_api_msg['errata']['rhea']['status'] = 'NEW_FILES'
 
-    with mock.patch('requests.get') as mock_get:
+    with mock.patch('requests.Session.get') as mock_get:
         mock_response_api = mock.Mock()
         mock_response_prod = mock.Mock()
         mock_response_reporter = mock.Mock()
@@ -42,8 +42,23 @@ def test_activity_status_handler(msg_type):
         mock_response_prod.json.return_value = product_info_msg
         mock_response_reporter.json.return_value = reporter_info_msg
         mock_response_assigned_to.json.return_value = assigned_to_info_msg
-        mock_get.side_effect = [mock_response_api, mock_response_prod, mock_response_reporter,
-                                mock_response_assigned_to]
+        # The lookups are made concurrently, so return the responses based on the URL
+        responses = {
+            '/api/v1/erratum/34661': mock_response_api,
+            '/products/{0}.json'.format(errata_api_msg['errata']['rhea']['product_id']):
+                mock_response_prod,
+            '/api/v1/user/{0}'.format(errata_api_msg['errata']['rhea']['reporter_id']):
+                mock_response_reporter,
+            '/api/v1/user/{0}'.format(errata_api_msg['errata']['rhea']['assigned_to_id']):
+                mock_response_assigned_to
+        }
+
+        def mock_get_response(url, **kwargs):
+            """Return the mock response of the requested URL."""
+            return next(
+                response for path, response in responses.items() if url.endswith(path))
+
+        mock_get.side_effect = mock_get_response
 
         with open(path.join(message_dir, 'errata', 'activity_{0}.json'.format(msg_type)), 'r') as f:
             msg = json.load(f)
@@ -75,9 +90,11 @@ def test_activity_status_handler(msg_type):
         assert advisory.status_time == datetime.datetime(2018, 7, 3, 14, 15, 40, tzinfo=pytz.utc)
         assert advisory.synopsis == 'libvirt-python bug fix and enhancement update'
         assert advisory.update_date == datetime.datetime(2018, 6, 15, 15, 26, 38, tzinfo=pytz.utc)
+        assert sorted(bug.id_ for bug in advisory.attached_bugs.all()) == [
+            '1542358', '1563171', '1578337']
 
 
-@mock.patch('requests.get')
+@mock.patch('requests.Session.get')
 def test_activity_status_handler_embargoed(mock_get):
     """Test the errata handler when it receives an embargoed activity status message."""
     mock_response_api = mock.Mock()
@@ -10,10 +10,12 @@ from estuary.models.koji import KojiBuild, KojiTag, ModuleKojiBuild
 from estuary.models.distgit import DistGitCommit
 import koji
 import pytz
+import pytest
 import mock
 
 from tests import message_dir, utils
 from estuary_updater.handlers.koji import KojiHandler
+from estuary_updater.schemas import MessageValidationError
 from estuary_updater import config
 
 
@@ -205,3 +207,63 @@ def test_build_untag(kb_one, koji_tag):
     handler.handle(msg)
 
     assert not koji_tag.builds.is_connected(kb_one)
+
+
+@mock.patch('koji.ClientSession')
+def test_modulebuild_complete_multicall(mock_koji_cs, mock_getBuild_module_complete,
+                                        module_build_getTag, mock_getBuild_complete):
+    """Test that incomplete module component builds are retrieved with a Koji multicall."""
+    mock_koji_session = mock.Mock()
+    mock_koji_session.getBuild.return_value = mock_getBuild_module_complete
+    mock_koji_session.getTag.return_value = module_build_getTag
+    mock_koji_session.listTaggedRPMS.return_value = [
+        [], [{'id': 736244, 'package_name': 'python-attrs'}]]
+    mock_koji_session.multiCall.return_value = [[mock_getBuild_complete]]
+    mock_koji_cs.return_value = mock_koji_session
+
+    with open(path.join(message_dir, 'koji', 'modulebuild_complete.json'), 'r') as f:
+        msg = json.load(f)
+    handler = KojiHandler(config)
+    handler.handle(msg)
+
+    mock_koji_session.multiCall.assert_called_once_with(strict=True)
+    mock_koji_session.getBuild.assert_called_with(736244, True)
+    assert mock_koji_session.multicall is False
+    build = ModuleKojiBuild.nodes.get_or_none(id_='753795')
+    component = KojiBuild.nodes.get_or_none(id_='736244')
+    assert component.name == 'python-attrs'
+    assert component.owner.get().username == 'emusk'
+    assert build.components.is_connected(component)
+
+
+@mock.patch('koji.ClientSession')
+def test_get_koji_build_cached(mock_koji_cs, mock_getBuild_complete):
+    """Test that Koji builds are cached by ID and NVR until their state changes."""
+    mock_koji_session = mock.Mock()
+    mock_koji_session.getBuild.return_value = mock_getBuild_complete
+    mock_koji_cs.return_value = mock_koji_session
+
+    handler = KojiHandler(config)
+    assert handler.get_koji_build(736244) == mock_getBuild_complete
+    assert handler.get_koji_build(736244) == mock_getBuild_complete
+    assert handler.get_koji_build('python-attrs-17.4.0-8.el8+1325+72a36e76') == \
+        mock_getBuild_complete
+    assert mock_koji_session.getBuild.call_count == 1
+
+    with open(path.join(message_dir, 'koji', 'build_complete.json'), 'r') as f:
+        msg = json.load(f)
+    handler.handle(msg)
+    # The build complete message invalidated the cached build before it was retrieved again
+    assert mock_koji_session.getBuild.call_count == 2
+    assert handler.resources.koji_cache.stats()['hits'] == 2
+
+
+@mock.patch('koji.ClientSession')
+def test_build_complete_malformed(mock_koji_cs):
+    """Test that a malformed build message is rejected before Koji is called."""
+    with open(path.join(message_dir, 'koji', 'build_complete.json'), 'r') as f:
+        msg = json.load(f)
+    del msg['body']['msg']['info']['id']
+    with pytest.raises(MessageValidationError):
+        KojiHandler(config).handle(msg)
+    mock_koji_cs.assert_not_called()
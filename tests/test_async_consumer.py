@@ -0,0 +1,72 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals, absolute_import
+
+import threading
+import time
+
+import mock
+
+from estuary_updater.async_consumer import AsyncEstuaryUpdater, AsyncPipeline
+
+
+def test_async_pipeline_ordering():
+    """Test that messages are processed concurrently but in order for the same key."""
+    processed = []
+    lock = threading.Lock()
+
+    def dispatch(msg):
+        # Make the earlier messages slower so that they'd finish last without the ordering
+        time.sleep(0.01 * (5 - msg['index']))
+        with lock:
+            processed.append((msg['key'], msg['index']))
+        return True
+
+    dispatcher = mock.Mock()
+    dispatcher.get_ordering_key.side_effect = lambda msg: msg['key']
+    dispatcher.dispatch.side_effect = dispatch
+    pipeline = AsyncPipeline(dispatcher, 4)
+    pipeline.start()
+    futures = [
+        pipeline.submit({'key': key, 'index': index, 'headers': {'message-id': index}})
+        for index in range(5) for key in ('a', 'b')
+    ]
+    pipeline.stop()
+    assert all(future.done() for future in futures)
+    for key in ('a', 'b'):
+        assert [index for k, index in processed if k == key] == list(range(5))
+    assert dispatcher.dispatch.call_count == 10
+
+
+def test_async_pipeline_coroutine_handler():
+    """Test that handler methods that are coroutine functions are awaited on the event loop."""
+    msgs = []
+
+    async def handler_method(msg):
+        msgs.append(msg)
+
+    dispatcher = mock.Mock()
+    dispatcher.get_ordering_key.return_value = None
+    dispatcher.get_handler_method.return_value = handler_method
+    pipeline = AsyncPipeline(dispatcher, 2)
+    pipeline.start()
+    msg = {'headers': {'message-id': '1'}}
+    pipeline.submit(msg).result()
+    pipeline.stop()
+    assert msgs == [msg]
+    dispatcher.dispatch.assert_not_called()
+
+
+@mock.patch('estuary_updater.async_consumer.AsyncPipeline')
+@mock.patch('estuary_updater.async_consumer.Dispatcher')
+def test_disabled_async_consumer(mock_dispatcher, mock_pipeline):
+    """Test that a disabled asyncio consumer doesn't start a dispatcher or an event loop."""
+    class FakeHub(object):
+        """FakeHub to used to initialize a fedmsg consumer."""
+
+        config = {'estuary_updater.enabled': False}
+
+    consumer = AsyncEstuaryUpdater(FakeHub())
+    assert consumer.dispatcher is None
+    mock_dispatcher.assert_not_called()
+    mock_pipeline.assert_not_called()
@@ -0,0 +1,118 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals, absolute_import
+
+import threading
+
+import mock
+
+from estuary.models.user import User
+
+from estuary_updater.cache import TTLCache, NodeCache
+
+
+def test_ttl_cache_lru():
+    """Test that the least recently used entries are evicted first."""
+    cache = TTLCache(2, 60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert cache.stats() == {
+        'hits': 3, 'misses': 1, 'evictions': 1, 'size': 2, 'hit_ratio': 0.75}
+
+
+def test_ttl_cache_expiration():
+    """Test that entries expire after the time-to-live."""
+    cache = TTLCache(10, 60)
+    with mock.patch('time.time', return_value=1000):
+        cache.set('a', 1)
+    with mock.patch('time.time', return_value=1059):
+        assert cache.get('a') == 1
+    with mock.patch('time.time', return_value=1061):
+        assert cache.get('a', 'expired') == 'expired'
+    assert len(cache) == 0
+
+
+def test_ttl_cache_invalidate():
+    """Test that entries can be removed from the cache."""
+    cache = TTLCache(10, 60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.invalidate('a', 'missing')
+    assert cache.get('a') is None
+    assert cache.get('b') == 2
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_ttl_cache_persistence(tmpdir):
+    """Test that the entries that haven't expired can be saved and loaded."""
+    cache_file = str(tmpdir.join('cache.json'))
+    cache = TTLCache(10, 60)
+    with mock.patch('time.time', return_value=1000):
+        cache.set('/products/16.json', {'product': {'name': 'RHEL'}})
+    with mock.patch('time.time', return_value=1030):
+        cache.set('/api/v1/user/3001', {'login_name': 'emusk@redhat.com'})
+        cache.save(cache_file)
+
+    new_cache = TTLCache(10, 60)
+    with mock.patch('time.time', return_value=1070):
+        assert new_cache.load(cache_file) == 1
+        assert new_cache.get('/products/16.json') is None
+        assert new_cache.get('/api/v1/user/3001') == {'login_name': 'emusk@redhat.com'}
+
+
+def test_node_cache_skips_unchanged_writes():
+    """Test that a node is only written again when its properties change."""
+    cache = NodeCache(10, 60)
+    with mock.patch.object(User, 'create_or_update') as mock_create_or_update:
+        mock_create_or_update.side_effect = lambda properties: [mock.Mock()]
+        user = cache.create_or_update(User, {'username': 'tbrady', 'email': 'tbrady@redhat.com'})
+        assert cache.create_or_update(
+            User, {'username': 'tbrady', 'email': 'tbrady@redhat.com'}) is user
+        assert mock_create_or_update.call_count == 1
+        cache.create_or_update(User, {'username': 'tbrady', 'email': 'tom.brady@redhat.com'})
+        assert mock_create_or_update.call_count == 2
+    with mock.patch.object(User, 'get_or_create') as mock_get_or_create:
+        # Any cached node with the same unique properties satisfies get_or_create
+        assert cache.get_or_create(User, {'username': 'tbrady'}) is not None
+        mock_get_or_create.assert_not_called()
+    assert cache.stats()['skipped_writes'] == 2
+    cache.clear()
+    assert cache.get(User, {'username': 'tbrady'}, update_existing=False) is None
+
+
+def test_node_cache_deferred():
+    """Test that the nodes cached in a transaction are only shared once it's committed."""
+    cache = NodeCache(10, 60)
+    properties = {'username': 'tbrady', 'email': 'tbrady@redhat.com'}
+    seen_by_other_thread = []
+
+    def read_from_other_thread():
+        """Look up the node from another thread like a concurrent worker would."""
+        thread = threading.Thread(
+            target=lambda: seen_by_other_thread.append(cache.get(User, properties)))
+        thread.start()
+        thread.join()
+
+    user = mock.Mock()
+    try:
+        with cache.deferred():
+            cache.set(User, properties, user)
+            # The thread that wrote the node sees it, but the other threads don't
+            assert cache.get(User, properties) is user
+            read_from_other_thread()
+            raise RuntimeError('The transaction was rolled back')
+    except RuntimeError:
+        pass
+    assert seen_by_other_thread == [None]
+    assert cache.get(User, properties) is None
+
+    with cache.deferred():
+        cache.set(User, properties, user)
+    read_from_other_thread()
+    assert seen_by_other_thread == [None, user]
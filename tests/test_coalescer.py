@@ -0,0 +1,35 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals, absolute_import
+
+from estuary_updater.coalescer import Coalescer
+
+
+def test_coalescer_keeps_newest_state():
+    """Test that only the newest message of an entity is processed in its first position."""
+    processed = []
+    coalescer = Coalescer(lambda msg: msg['key'], processed.append, 60000, 100)
+    msgs = [
+        {'key': 1, 'state': 'building', 'headers': {'message-id': '1'}},
+        {'key': None, 'state': 'tagged', 'headers': {'message-id': '2'}},
+        {'key': None, 'state': 'tagged', 'headers': {'message-id': '3'}},
+        {'key': 1, 'state': 'complete', 'headers': {'message-id': '4'}},
+        {'key': 2, 'state': 'failed', 'headers': {'message-id': '5'}}
+    ]
+    for msg in msgs:
+        coalescer.add(msg)
+    assert processed == []
+    coalescer.flush()
+    assert processed == [msgs[3], msgs[1], msgs[2], msgs[4]]
+    assert coalescer.stats() == {'discarded': 1, 'pending': 0}
+
+
+def test_coalescer_max_size():
+    """Test that the buffered messages are processed once the maximum size is reached."""
+    processed = []
+    coalescer = Coalescer(lambda msg: msg['key'], processed.append, 60000, 2)
+    coalescer.add({'key': 1, 'headers': {'message-id': '1'}})
+    coalescer.add({'key': 1, 'headers': {'message-id': '2'}})
+    assert processed == []
+    coalescer.add({'key': 2, 'headers': {'message-id': '3'}})
+    assert [msg['headers']['message-id'] for msg in processed] == ['2', '3']
@@ -0,0 +1,52 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals, absolute_import
+
+import time
+
+import mock
+
+from estuary_updater.consumer import EstuaryUpdater
+
+
+def test_consume_batch_size(consumer):
+    """Test that buffered messages are processed once the batch is full."""
+    msgs = [{'topic': '/topic/VirtualTopic.eng.distgit.push', 'index': i} for i in range(3)]
+    with mock.patch.object(consumer, 'batch_size', 2), \
+            mock.patch.object(consumer, 'dispatcher') as mock_dispatcher:
+        for msg in msgs:
+            consumer.consume(msg)
+        mock_dispatcher.dispatch_batch.assert_called_once_with(msgs[:2])
+        # The last message is processed when the consumer stops
+        consumer.flush_batch()
+        mock_dispatcher.dispatch_batch.assert_called_with(msgs[2:])
+        mock_dispatcher.dispatch.assert_not_called()
+
+
+def test_consume_batch_timeout(consumer):
+    """Test that buffered messages are processed once the batch timeout expires."""
+    msg = {'topic': '/topic/VirtualTopic.eng.distgit.push'}
+    with mock.patch.object(consumer, 'batch_size', 10), \
+            mock.patch.object(consumer, 'batch_timeout', 10), \
+            mock.patch.object(consumer, 'dispatcher') as mock_dispatcher:
+        consumer.consume(msg)
+        for _ in range(100):
+            if mock_dispatcher.dispatch_batch.called:
+                break
+            time.sleep(0.01)
+        mock_dispatcher.dispatch_batch.assert_called_once_with([msg])
+
+
+@mock.patch('estuary_updater.consumer.KeyedWorkerPool')
+@mock.patch('estuary_updater.consumer.Dispatcher')
+def test_disabled_consumer(mock_dispatcher, mock_worker_pool):
+    """Test that a disabled consumer doesn't start a dispatcher, metrics server or workers."""
+    class FakeHub(object):
+        """FakeHub to used to initialize a fedmsg consumer."""
+
+        config = {'estuary_updater.enabled': False}
+
+    consumer = EstuaryUpdater(FakeHub())
+    assert consumer.dispatcher is None
+    mock_dispatcher.assert_not_called()
+    mock_worker_pool.assert_not_called()
@@ -0,0 +1,73 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals, absolute_import
+
+import pytest
+
+from estuary_updater.dedup import (
+    DedupStore, MemoryDedupStore, SQLiteDedupStore, get_content_hash)
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def dedup_store(request, tmpdir):
+    """Create each type of dedup store."""
+    if request.param == 'memory':
+        store = MemoryDedupStore(100, 3600)
+    else:
+        store = SQLiteDedupStore(str(tmpdir.join('dedup.sqlite')), 100, 3600)
+    yield store
+    store.close()
+
+
+def test_dedup_store(dedup_store):
+    """Test that messages are duplicates by message ID or by the content of their entity."""
+    tag = get_content_hash({'topic': 'tag', 'body': {'msg': {'build': 1}}})
+    untag = get_content_hash({'topic': 'untag', 'body': {'msg': {'build': 1}}})
+    assert dedup_store.is_duplicate('1', ('koji', 1), tag) is None
+    dedup_store.mark('1', ('koji', 1), tag)
+    assert dedup_store.is_duplicate('1', ('koji', 1), tag) == 'message_id'
+    assert dedup_store.is_duplicate('2', ('koji', 1), tag) == 'content'
+    assert dedup_store.is_duplicate('2', ('koji', 2), tag) is None
+
+    dedup_store.mark('2', ('koji', 1), untag)
+    # Tagging the build again isn't a duplicate since it was untagged in between
+    assert dedup_store.is_duplicate('3', ('koji', 1), tag) is None
+    assert dedup_store.stats() == {'message_id': 1, 'content': 1, 'size': 2}
+
+
+def test_dedup_store_deferred(dedup_store):
+    """Test that the messages marked in a block that fails aren't recorded."""
+    with pytest.raises(RuntimeError):
+        with dedup_store.deferred():
+            dedup_store.mark('1', ('koji', 1), 'hash1')
+            assert dedup_store.is_duplicate('1', ('koji', 1), 'hash1') == 'message_id'
+            raise RuntimeError('The transaction was rolled back')
+    assert dedup_store.is_duplicate('1', ('koji', 1), 'hash1') is None
+
+    with dedup_store.deferred():
+        dedup_store.mark('1', ('koji', 1), 'hash1')
+    assert dedup_store.is_duplicate('2', ('koji', 1), 'hash1') == 'content'
+
+
+def test_sqlite_dedup_store_persists(tmpdir):
+    """Test that the SQLite dedup store remembers the messages after it's reopened."""
+    db_path = str(tmpdir.join('dedup.sqlite'))
+    store = SQLiteDedupStore(db_path, 100, 3600)
+    store.mark('1', ('errata', '34661'), 'hash1')
+    store.close()
+    store = SQLiteDedupStore(db_path, 100, 3600)
+    assert store.is_duplicate('1', None, 'hash2') == 'message_id'
+    store.close()
+
+
+def test_incomplete_dedup_store():
+    """Test that a store that doesn't implement every abstract method can't be created."""
+    class IncompleteDedupStore(DedupStore):
+        """A store that only implements the lookup of message IDs."""
+
+        def _has_message(self, message_id):
+            """Pretend that no message was applied."""
+            return False
+
+    with pytest.raises(TypeError):
+        IncompleteDedupStore()
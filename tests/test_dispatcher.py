@@ -0,0 +1,192 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals, absolute_import
+
+import copy
+import json
+from os import path
+import threading
+
+from estuary.models.distgit import DistGitCommit
+from estuary.models.user import User
+import mock
+
+from tests import message_dir
+from estuary_updater.dispatcher import Dispatcher
+from estuary_updater.handlers import DistGitHandler, KojiHandler
+from estuary_updater import config
+
+
+def test_dispatcher_handlers():
+    """Test that the dispatcher creates a single instance of each handler."""
+    dispatcher = Dispatcher(config)
+    koji_handler = dispatcher.handlers[KojiHandler]
+    assert dispatcher.handlers[DistGitHandler].resources is dispatcher.resources
+    assert koji_handler.resources is dispatcher.resources
+
+    complete_method = dispatcher.get_handler_method(
+        {'topic': '/topic/VirtualTopic.eng.brew.build.complete'})
+    tag_method = dispatcher.get_handler_method({'topic': '/topic/VirtualTopic.eng.brew.build.tag'})
+    assert complete_method.__self__ is koji_handler
+    assert tag_method.__self__ is koji_handler
+    assert complete_method.__name__ == 'build_handler'
+    assert tag_method.__name__ == 'build_tag_handler'
+
+
+def test_dispatch_unsupported_topic():
+    """Test that messages with an unsupported topic are ignored."""
+    dispatcher = Dispatcher(config)
+    assert dispatcher.dispatch({'topic': '/topic/VirtualTopic.eng.unsupported'}) is False
+
+
+def test_dispatcher_startup_and_shutdown():
+    """Test that the hooks of every handler are called."""
+    dispatcher = Dispatcher(config)
+    with mock.patch.object(KojiHandler, 'startup') as mock_startup, \
+            mock.patch.object(KojiHandler, 'shutdown') as mock_shutdown:
+        dispatcher.startup()
+        dispatcher.shutdown()
+    mock_startup.assert_called_once_with()
+    mock_shutdown.assert_called_once_with()
+
+
+@mock.patch('estuary_updater.dispatcher.start_server')
+def test_dispatcher_metrics_server_shutdown(mock_start_server):
+    """Test that the metrics server is stopped and its socket is closed on shutdown."""
+    metrics_config = dict(config)
+    metrics_config['estuary_updater.metrics_port'] = 0
+    dispatcher = Dispatcher(metrics_config)
+    dispatcher.startup()
+    dispatcher.shutdown()
+    mock_start_server.return_value.shutdown.assert_called_once_with()
+    mock_start_server.return_value.server_close.assert_called_once_with()
+    assert dispatcher.metrics_server is None
+
+
+def test_dispatch_batch_fallback():
+    """Test that a bad message doesn't keep the rest of its batch from being stored."""
+    with open(path.join(message_dir, 'distgit', 'distgit_commit.json'), 'r') as f:
+        msg = json.load(f)
+    bad_msg = copy.deepcopy(msg)
+    del bad_msg['headers']['rev']
+
+    dispatcher = Dispatcher(config)
+    with mock.patch.object(dispatcher, 'dispatch', wraps=dispatcher.dispatch) as mock_dispatch:
+        dispatcher.dispatch_batch([msg, bad_msg])
+    # Both messages were attempted in the batch and then again individually
+    assert mock_dispatch.call_count == 4
+    assert DistGitCommit.nodes.get_or_none(
+        hash_='2cc7f45c8aae163feed162478622f5f9165c8e78') is not None
+
+
+def test_dispatcher_ordering_key():
+    """Test that the ordering key of a message comes from its handler."""
+    dispatcher = Dispatcher(config)
+    with open(path.join(message_dir, 'koji', 'build_tag.json'), 'r') as f:
+        msg = json.load(f)
+    assert dispatcher.get_ordering_key(msg) == ('koji', 736088)
+    assert dispatcher.get_ordering_key({'topic': '/topic/VirtualTopic.eng.unsupported'}) is None
+
+
+def test_dispatcher_malformed_message_keys():
+    """Test that a malformed message gets no ordering or coalesce key instead of an error."""
+    dispatcher = Dispatcher(config)
+    msg = {
+        'topic': '/topic/VirtualTopic.eng.brew.build.complete',
+        'headers': {'message-id': 'ID:malformed'},
+        'body': {'msg': {}}
+    }
+    assert dispatcher.get_ordering_key(msg) is None
+    assert dispatcher.get_coalesce_key(msg) is None
+    distgit_msg = {'topic': '/topic/VirtualTopic.eng.distgit.commit', 'headers': {}}
+    assert dispatcher.get_ordering_key(distgit_msg) is None
+
+
+def test_dispatch_duplicates():
+    """Test that messages that were already applied are skipped."""
+    with open(path.join(message_dir, 'distgit', 'distgit_commit.json'), 'r') as f:
+        msg = json.load(f)
+    redelivered_msg = copy.deepcopy(msg)
+    redelivered_msg['headers']['message-id'] += '-redelivered'
+
+    dedup_config = dict(config)
+    dedup_config['estuary_updater.dedup'] = 'memory'
+    with mock.patch.object(DistGitHandler, 'commit_handler') as mock_commit_handler:
+        dispatcher = Dispatcher(dedup_config)
+        assert dispatcher.dispatch(msg) is True
+        assert dispatcher.dispatch(msg) is False
+        assert dispatcher.dispatch(redelivered_msg) is False
+    mock_commit_handler.assert_called_once_with(msg)
+    assert dispatcher.dedup_store.stats() == {'message_id': 1, 'content': 1, 'size': 1}
+
+
+def test_dispatch_batch_fallback_duplicates():
+    """Test that the messages of a batch that was rolled back aren't skipped as duplicates."""
+    with open(path.join(message_dir, 'distgit', 'distgit_commit.json'), 'r') as f:
+        msg = json.load(f)
+    bad_msg = copy.deepcopy(msg)
+    bad_msg['headers']['message-id'] += '-bad'
+    del bad_msg['headers']['rev']
+
+    dedup_config = dict(config)
+    dedup_config['estuary_updater.dedup'] = 'memory'
+    dispatcher = Dispatcher(dedup_config)
+    dispatcher.dispatch_batch([msg, bad_msg])
+    assert DistGitCommit.nodes.get_or_none(
+        hash_='2cc7f45c8aae163feed162478622f5f9165c8e78') is not None
+    assert dispatcher.dedup_store.stats()['size'] == 1
+
+
+def test_dispatch_batch_fallback_metrics():
+    """Test that the messages of a batch that was rolled back are only counted once."""
+    with open(path.join(message_dir, 'distgit', 'distgit_commit.json'), 'r') as f:
+        msg = json.load(f)
+    bad_msg = copy.deepcopy(msg)
+    bad_msg['headers']['message-id'] += '-bad'
+
+    def commit_handler(msg):
+        """Fail to handle the bad message."""
+        if msg['headers']['message-id'] == bad_msg['headers']['message-id']:
+            raise RuntimeError('Something went wrong')
+
+    metrics_config = dict(config)
+    metrics_config['estuary_updater.metrics_port'] = 0
+    with mock.patch.object(DistGitHandler, 'commit_handler', side_effect=commit_handler):
+        dispatcher = Dispatcher(metrics_config)
+        try:
+            assert dispatcher.dispatch_batch([msg, bad_msg]) == [bad_msg]
+        finally:
+            dispatcher.shutdown()
+    assert dispatcher.metrics.messages.collect() == [
+        ('estuary_updater_messages_total', {'topic': msg['topic']}, 2.0)]
+    assert dispatcher.metrics.errors.collect() == [
+        ('estuary_updater_message_errors_total', {'topic': msg['topic']}, 1.0)]
+
+
+def test_dispatch_batch_rollback_node_cache():
+    """Test that the nodes cached in a batch that is rolled back are never used by other workers."""
+    with open(path.join(message_dir, 'distgit', 'distgit_commit.json'), 'r') as f:
+        msg = json.load(f)
+    properties = {'username': 'tbrady', 'email': 'tbrady@redhat.com'}
+    seen_by_other_worker = []
+
+    def failing_commit_handler(msg):
+        """Store a user and then fail while another worker looks it up."""
+        node_cache = dispatcher.resources.node_cache
+        node_cache.create_or_update(User, properties)
+        worker = threading.Thread(
+            target=lambda: seen_by_other_worker.append(node_cache.get(User, properties)))
+        worker.start()
+        worker.join()
+        raise RuntimeError('Something went wrong')
+
+    # The handler method is patched before the dispatcher gets it from the handler instance
+    with mock.patch.object(DistGitHandler, 'commit_handler', side_effect=failing_commit_handler):
+        dispatcher = Dispatcher(config)
+        assert dispatcher.dispatch_batch([msg, msg]) == [msg, msg]
+    # The batch was attempted once and then each message was retried individually
+    assert len(seen_by_other_worker) == 3
+    # The user created in the transaction that was rolled back was never shared
+    assert seen_by_other_worker[0] is None
+    # The user created when the message was retried without a transaction exists in Neo4j
+    assert seen_by_other_worker[1].id == User.nodes.get(username='tbrady').id
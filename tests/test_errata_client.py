@@ -0,0 +1,47 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals, absolute_import
+
+import mock
+
+from estuary_updater.cache import TTLCache
+from estuary_updater.errata_client import ErrataClient
+
+
+@mock.patch('requests.Session.get')
+def test_errata_client(mock_get):
+    """Test that the Errata client reuses its session and authentication."""
+    client = ErrataClient({
+        'estuary_updater.errata_url': 'https://errata.domain.com/',
+        'estuary_updater.errata_pool_size': 4,
+        'estuary_updater.errata_retries': 2
+    })
+    client.get_erratum(34661)
+    client.get_product(16)
+    client.get_user(3001)
+
+    urls = [call[0][0] for call in mock_get.call_args_list]
+    assert urls == [
+        'https://errata.domain.com/api/v1/erratum/34661',
+        'https://errata.domain.com/products/16.json',
+        'https://errata.domain.com/api/v1/user/3001'
+    ]
+    auths = set(id(call[1]['auth']) for call in mock_get.call_args_list)
+    assert len(auths) == 1
+    adapter = client.session.get_adapter('https://errata.domain.com/')
+    assert adapter._pool_maxsize == 4
+    assert adapter.max_retries.total == 2
+
+
+@mock.patch('requests.Session.get')
+def test_errata_client_cache(mock_get):
+    """Test that products and users are cached but advisories are not."""
+    client = ErrataClient(
+        {'estuary_updater.errata_url': 'https://errata.domain.com'}, TTLCache(10, 60))
+    for _ in range(2):
+        client.get_erratum(34661)
+        client.get_product(16)
+        client.get_user(3001)
+
+    assert mock_get.call_count == 4
+    assert client.cache.stats()['hits'] == 2
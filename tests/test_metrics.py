@@ -0,0 +1,103 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals, absolute_import
+
+import mock
+import pytest
+import requests
+
+from estuary_updater.metrics import ConsumerMetrics, Metric, start_server
+
+
+def test_consumer_metrics_render():
+    """Test that the recorded metrics are rendered in the Prometheus text format."""
+    resources = mock.Mock()
+    resources.cache_stats.return_value = {
+        'koji': {'hits': 3, 'misses': 1, 'evictions': 0, 'size': 2, 'hit_ratio': 0.75}}
+    metrics = ConsumerMetrics(resources)
+    msg = {
+        'topic': '/topic/VirtualTopic.eng.brew.build.complete',
+        'headers': {'timestamp': '1533318582000'}
+    }
+    metrics.observe_message(msg, 'KojiHandler', 0.02, False)
+    metrics.observe_message(msg, 'KojiHandler', 2.0, True)
+    metrics.observe_query(0.001)
+
+    text = metrics.registry.render()
+    assert '# TYPE estuary_updater_messages_total counter' in text
+    assert ('estuary_updater_messages_total{topic="/topic/VirtualTopic.eng.brew.build.complete"} '
+            '2.0') in text
+    assert ('estuary_updater_message_errors_total{'
+            'topic="/topic/VirtualTopic.eng.brew.build.complete"} 1.0') in text
+    assert ('estuary_updater_handler_duration_seconds_bucket{handler="KojiHandler",le="0.025"} '
+            '1.0') in text
+    assert ('estuary_updater_handler_duration_seconds_bucket{handler="KojiHandler",le="+Inf"} '
+            '2.0') in text
+    assert 'estuary_updater_neo4j_queries_total 1.0' in text
+    assert 'estuary_updater_cache_hit_ratio{cache="koji"} 0.75' in text
+    assert 'estuary_updater_last_message_age_seconds ' in text
+
+
+def test_metrics_server():
+    """Test that the metrics are served on /metrics."""
+    metrics = ConsumerMetrics(mock.Mock(**{'cache_stats.return_value': {}}))
+    metrics.observe_query(0.001)
+    server = start_server(metrics.registry, '127.0.0.1', 0)
+    try:
+        url = 'http://127.0.0.1:{0}'.format(server.server_address[1])
+        response = requests.get(url + '/metrics')
+        assert response.status_code == 200
+        assert 'estuary_updater_neo4j_queries_total 1.0' in response.text
+        assert requests.get(url + '/other').status_code == 404
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_consumer_metrics_lag():
+    """Test that the lag is the age of the timestamp of the last message that had one."""
+    metrics = ConsumerMetrics(mock.Mock(**{'cache_stats.return_value': {}}))
+    msg = {'topic': '/topic/VirtualTopic.eng.brew.build.complete', 'headers': {}}
+    # Nothing is reported until a message with a timestamp is processed
+    metrics.observe_message(msg, 'KojiHandler', 0.02, False)
+    assert metrics.collect_lag() == []
+
+    msg['headers']['timestamp'] = '1533318582000'
+    metrics.observe_message(msg, 'KojiHandler', 0.02, False)
+    with mock.patch('time.time', return_value=1533318592.5):
+        lag = metrics.collect_lag()
+    assert lag[0].collect() == [('estuary_updater_last_message_age_seconds', {}, 10.5)]
+
+    # A missing, unset or invalid timestamp keeps the timestamp of the previous message
+    for timestamp in (None, '0', 'not a timestamp'):
+        msg['headers']['timestamp'] = timestamp
+        metrics.observe_message(msg, 'KojiHandler', 0.02, False)
+    assert metrics.last_message_timestamp == 1533318582.0
+
+
+def test_consumer_metrics_deferred():
+    """Test that the messages of a block that fails, such as a rolled back batch, aren't counted."""
+    metrics = ConsumerMetrics(mock.Mock(**{'cache_stats.return_value': {}}))
+    msg = {'topic': '/topic/VirtualTopic.eng.brew.build.complete', 'headers': {}}
+    with pytest.raises(RuntimeError):
+        with metrics.deferred():
+            metrics.observe_message(msg, 'KojiHandler', 0.02, False)
+            raise RuntimeError('Something went wrong')
+    assert metrics.messages.collect() == []
+
+    with metrics.deferred():
+        metrics.observe_message(msg, 'KojiHandler', 0.02, False)
+        assert metrics.messages.collect() == []
+    assert metrics.messages.collect() == [
+        ('estuary_updater_messages_total', {'topic': msg['topic']}, 1.0)]
+
+
+def test_incomplete_metric():
+    """Test that a metric that doesn't implement collect can't be created."""
+    class IncompleteMetric(Metric):
+        """A metric without samples."""
+
+        metric_type = 'gauge'
+
+    with pytest.raises(TypeError):
+        IncompleteMetric('estuary_updater_incomplete', 'An incomplete metric')
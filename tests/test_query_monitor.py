@@ -0,0 +1,36 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals, absolute_import
+
+import neomodel
+import pytest
+
+from estuary_updater.query_monitor import QueryBudgetExceeded, QueryMonitor, query_budget
+
+
+def test_query_monitor_budget():
+    """Test that the queries are counted per handler method and checked against the budget."""
+    monitor = QueryMonitor({'KojiHandler.build_handler': 1}, strict=True)
+    with monitor.measure('KojiHandler.build_handler', '1') as count:
+        neomodel.db.cypher_query('RETURN 1')
+    assert count.queries == 1
+
+    with pytest.raises(QueryBudgetExceeded):
+        with monitor.measure('KojiHandler.build_handler', '2'):
+            neomodel.db.cypher_query('RETURN 1')
+            neomodel.db.cypher_query('RETURN 2')
+
+    stats = monitor.stats()['KojiHandler.build_handler']
+    assert stats['messages'] == 2
+    assert stats['queries'] == 3
+    assert stats['max_queries'] == 2
+    assert stats['mean_queries'] == 1.5
+
+
+def test_query_budget():
+    """Test that the query budget of a block of code is enforced."""
+    with query_budget(1):
+        neomodel.db.cypher_query('RETURN 1')
+    with pytest.raises(QueryBudgetExceeded):
+        with query_budget(0):
+            neomodel.db.cypher_query('RETURN 1')
@@ -0,0 +1,71 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals, absolute_import
+
+import json
+
+import mock
+import pytest
+
+from estuary_updater.replay import Replayer, replay
+
+
+def test_replay_checkpoint(tmpdir):
+    """Test that a replay stores the messages in batches and resumes from its checkpoint."""
+    msgs = [{'topic': '/topic/VirtualTopic.eng.distgit.push', 'index': i} for i in range(5)]
+    messages_path = str(tmpdir.join('messages.jsonl'))
+    checkpoint_path = str(tmpdir.join('checkpoint.json'))
+    with open(messages_path, 'w') as f:
+        for msg in msgs:
+            f.write(json.dumps(msg) + '\n')
+
+    dispatcher = mock.Mock()
+    dispatcher.dispatch_messages.return_value = []
+    replayer = Replayer(dispatcher, 2, 1)
+    assert replay(messages_path, replayer, checkpoint_path, chunk_size=3) == 5
+    assert dispatcher.dispatch_messages.call_args_list == [
+        mock.call(msgs[0:2]), mock.call(msgs[2:3]), mock.call(msgs[3:5])]
+    with open(checkpoint_path, 'r') as f:
+        assert json.load(f)['line'] == 5
+
+    # Everything was already processed, so nothing is replayed again
+    dispatcher.reset_mock()
+    assert replay(messages_path, replayer, checkpoint_path, chunk_size=3) == 0
+    dispatcher.dispatch_messages.assert_not_called()
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_replay_failure_checkpoint(tmpdir, workers):
+    """Test that the checkpoint doesn't advance past a message that failed to be processed."""
+    msgs = [{'topic': '/topic/VirtualTopic.eng.distgit.push', 'headers': {'message-id': str(i)}}
+            for i in range(6)]
+    messages_path = str(tmpdir.join('messages.jsonl'))
+    checkpoint_path = str(tmpdir.join('checkpoint.json'))
+    with open(messages_path, 'w') as f:
+        for msg in msgs:
+            f.write(json.dumps(msg) + '\n')
+
+    dispatcher = mock.Mock()
+    dispatcher.get_ordering_key.return_value = 'key'
+    # The message on the third line fails, so only the first chunk is checkpointed
+    dispatcher.dispatch_messages.side_effect = lambda batch: [
+        msg for msg in batch if msg['headers']['message-id'] == '2']
+    replayer = Replayer(dispatcher, 10, workers)
+    try:
+        assert replay(messages_path, replayer, checkpoint_path, chunk_size=2) == 6
+    finally:
+        replayer.stop()
+    assert replayer.failed_message_ids == ['2']
+    with open(checkpoint_path, 'r') as f:
+        assert json.load(f)['line'] == 2
+
+
+def test_replay_coalesce():
+    """Test that superseded messages in a chunk are not replayed when coalescing."""
+    msgs = [{'key': 1, 'index': 0}, {'key': 2, 'index': 1}, {'key': 1, 'index': 2}]
+    dispatcher = mock.Mock()
+    dispatcher.get_coalesce_key.side_effect = lambda msg: msg['key']
+    dispatcher.dispatch_messages.return_value = []
+    replayer = Replayer(dispatcher, 10, 1, coalesce=True)
+    assert replayer.process_chunk(msgs) == 2
+    dispatcher.dispatch_messages.assert_called_once_with([msgs[2], msgs[1]])
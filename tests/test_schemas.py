@@ -0,0 +1,41 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals, absolute_import
+
+import pytest
+
+from estuary_updater.schemas import (
+    Field, MessageValidationError, Schema, integer_types, string_types)
+
+
+SCHEMA = Schema('TestMessage', [
+    Field('build_id', 'body.msg.info.id', integer_types),
+    Field('source', 'body.msg.info.source', string_types, nullable=True),
+    Field('extra', 'body.msg.info.extra', dict, required=False, default={})
+])
+
+
+def test_schema_extract():
+    """Test that the fields of a message are extracted to a record."""
+    record = SCHEMA.extract({'body': {'msg': {'info': {'id': 123, 'source': None}}}})
+    assert record.build_id == 123
+    assert record.source is None
+    assert record.extra == {}
+    # The record only has the slots of its fields
+    with pytest.raises(AttributeError):
+        record.other = 'value'
+
+
+@pytest.mark.parametrize('msg,error', [
+    ({'body': {'msg': {'info': {'source': None}}}}, 'The message is missing "body.msg.info.id"'),
+    ({'body': {'msg': None}}, 'The message is missing "body.msg.info.id"'),
+    ({'body': {'msg': {'info': {'id': '123', 'source': None}}}},
+     'The value of "body.msg.info.id" in the message is'),
+    ({'body': {'msg': {'info': {'id': 123, 'source': None, 'extra': None}}}},
+     'The value of "body.msg.info.extra" in the message is None')
+])
+def test_schema_extract_invalid(msg, error):
+    """Test that a malformed message is rejected."""
+    with pytest.raises(MessageValidationError) as exc_info:
+        SCHEMA.extract(msg)
+    assert str(exc_info.value).startswith(error)
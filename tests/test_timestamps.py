@@ -0,0 +1,45 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals, absolute_import
+
+from datetime import datetime
+
+import pytest
+
+from estuary_updater.timestamps import parse_timestamp, parse_timestamps
+
+
+@pytest.mark.parametrize('timestamp,expected', [
+    # Koji
+    ('2018-08-03 17:49:42.735506', datetime(2018, 8, 3, 17, 49, 42, 735506)),
+    ('2018-06-15 20:26:38', datetime(2018, 6, 15, 20, 26, 38)),
+    # Freshmaker and the Errata Tool API
+    ('2018-06-14T23:50:37Z', datetime(2018, 6, 14, 23, 50, 37)),
+    # Errata Tool messages
+    ('2018-07-03 13:34:14 UTC', datetime(2018, 7, 3, 13, 34, 14)),
+    ('2018-07-03T13:34:14.5+02:00', datetime(2018, 7, 3, 11, 34, 14, 500000)),
+    ('2018-07-03T13:34:14-0500', datetime(2018, 7, 3, 18, 34, 14)),
+    # Only strptime accepts numbers that aren't zero-padded
+    ('2018-7-3 1:34:14', datetime(2018, 7, 3, 1, 34, 14))
+])
+def test_parse_timestamp(timestamp, expected):
+    """Test that the timestamps of every service are parsed to naive datetimes in UTC."""
+    assert parse_timestamp(timestamp) == expected
+
+
+@pytest.mark.parametrize('timestamp', [
+    '2018-02-30 10:00:00',
+    '2018-08-03 17:49:42.1234567',
+    '2018-08-03 17:49:42 EST',
+    'yesterday'
+])
+def test_parse_timestamp_invalid(timestamp):
+    """Test that an invalid timestamp raises a ValueError."""
+    with pytest.raises(ValueError):
+        parse_timestamp(timestamp)
+
+
+def test_parse_timestamps():
+    """Test that many timestamps are parsed at once and that None values are kept."""
+    assert parse_timestamps(['2018-06-15 20:26:38', None, '2018-06-15 20:26:38']) == [
+        datetime(2018, 6, 15, 20, 26, 38), None, datetime(2018, 6, 15, 20, 26, 38)]
@@ -0,0 +1,76 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals, absolute_import
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from estuary_updater import tracing
+
+
+def test_trace_spans():
+    """Test that spans, including those of other threads, are recorded in the trace."""
+    traces = []
+    tracing.add_exporter(traces.append)
+
+    def get_user():
+        with tracing.span('errata.get', path='/api/v1/user/1'):
+            pass
+
+    try:
+        with tracing.trace(True, topic='some.topic', message_id='1') as current:
+            assert tracing.get_current_trace() is current
+            with tracing.span('koji.getBuild', identifier=2):
+                pass
+            with ThreadPoolExecutor(1) as executor:
+                executor.submit(tracing.bind(get_user)).result()
+    finally:
+        tracing.remove_exporter(traces.append)
+
+    assert tracing.get_current_trace() is None
+    assert traces == [current]
+    trace_dict = current.to_dict()
+    assert trace_dict['topic'] == 'some.topic'
+    assert [span['name'] for span in trace_dict['spans']] == ['koji.getBuild', 'errata.get']
+    assert trace_dict['spans'][0]['identifier'] == 2
+    assert trace_dict['totals']['errata.get']['count'] == 1
+
+
+def test_trace_disabled():
+    """Test that nothing is recorded when tracing is disabled."""
+    with tracing.trace(False, topic='some.topic') as current:
+        assert current is None
+        with tracing.span('koji.getBuild'):
+            pass
+    assert tracing.get_current_trace() is None
+
+
+def test_trace_error():
+    """Test that the trace is tagged with the error that failed the message."""
+    with pytest.raises(ValueError):
+        with tracing.trace(True, topic='some.topic') as current:
+            raise ValueError('Failed')
+    assert current.tags['error'] == 'ValueError'
+    assert current.duration is not None
+
+
+def test_trace_deferred():
+    """Test that the traces of a block that fails, such as a rolled back batch, aren't exported."""
+    traces = []
+    tracing.add_exporter(traces.append)
+    try:
+        with pytest.raises(RuntimeError):
+            with tracing.deferred():
+                with tracing.trace(True, topic='some.topic', message_id='1'):
+                    pass
+                raise RuntimeError('Something went wrong')
+        assert traces == []
+
+        with tracing.deferred():
+            with tracing.trace(True, topic='some.topic', message_id='1') as current:
+                pass
+            assert traces == []
+    finally:
+        tracing.remove_exporter(traces.append)
+    assert traces == [current]
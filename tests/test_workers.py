@@ -0,0 +1,44 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals, absolute_import
+
+import threading
+
+from estuary_updater.workers import KeyedWorkerPool
+
+
+def test_keyed_worker_pool_ordering():
+    """Test that the items with the same key are processed in the order they were submitted."""
+    processed = {}
+    lock = threading.Lock()
+
+    def process(items):
+        with lock:
+            for key, index in items:
+                processed.setdefault(key, []).append(index)
+
+    pool = KeyedWorkerPool(process, 4, 5, batch_size=3)
+    pool.start()
+    for index in range(50):
+        for key in ('a', 'b', 'c'):
+            pool.submit(key, (key, index))
+    pool.join()
+    pool.stop()
+    assert processed == {key: list(range(50)) for key in ('a', 'b', 'c')}
+
+
+def test_keyed_worker_pool_failure():
+    """Test that a failure to process an item doesn't stop the worker."""
+    processed = []
+
+    def process(items):
+        if items == ['bad']:
+            raise RuntimeError('Failed')
+        processed.extend(items)
+
+    pool = KeyedWorkerPool(process, 1, 5)
+    pool.start()
+    pool.submit(None, 'bad')
+    pool.submit(None, 'good')
+    pool.stop()
+    assert processed == ['good']